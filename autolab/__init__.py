@@ -13,8 +13,9 @@ Drivers made for this package can be found at https://github.com/autolab-project
 
 Visit https://autolab.readthedocs.io/ for the full documentation of this package.
 """
-import numpy  # OPTIMIZE: temporary fix to an infinite loading on some computer following the master merge (commit 25fd4d6)
-import socket  # OPTIMIZE: temporary fix to an infinite loading on some computer
+import sys as _sys
+import threading as _threading
+import importlib as _importlib
 
 # Load current version in version file
 from .core.paths import PATHS, DRIVER_SOURCES
@@ -22,71 +23,138 @@ with open(PATHS['version']) as version_file:
     __version__ = version_file.read().strip()
 del version_file
 
-# Process updates from previous versions
-from .core import version_adapter
-version_adapter.process_all_changes()
-del version_adapter
-
-# Load user config
-from .core import config as _config
-FIRST = _config.initialize_local_directory()
-_config.check_autolab_config()
-_config.check_plotter_config()
-_config.set_temp_folder()
-_config.add_extra_driver_path()
-_config.add_extra_driver_repo_url()
-
-# Add drivers folder to sys (allows a driver to import another driver)
-import sys
-# Order of append between local and official matter for priority
-for folder in reversed(list(DRIVER_SOURCES.values())):
-    sys.path.append(folder)
-del sys
-del folder
-
-# infos
-from .core.infos import infos, config_help
-from .core.infos import _list_devices as list_devices
-from .core.infos import _list_drivers as list_drivers
-
-# Devices
-from .core.devices import get_device, close, list_loaded_devices
-from .core import devices as _devices
-
-# Drivers
-from .core.drivers import get_driver, explore_driver
-from .core import drivers as _drivers
-
-# Webbrowser shortcuts
-from .core.web import report, doc
-
-# Server
-from .core.server import Server as server
-
-# GUI
-from .core.gui import (gui, plotter, monitor, slider, add_device, about,
-                       variables_menu, preferences, driver_installer)
-
-from .core.variables import get_variable, list_variables
-from .core.variables import set_variable as add_variable
-
-# Repository
-from .core.repository import install_drivers
-from .core import repository as _repository
-_repository._check_empty_driver_folder()
-
-del numpy
-del socket
-
-from .core._create_shortcut import create_shortcut
-
-if FIRST:
-    # Ask if create shortcut
-    create_shortcut(ask=True)
-del FIRST
-
-# Loading the drivers informations on startup
-_drivers.update_drivers_paths()
-
-# Used by os shell to start autolab
-from ._entry_script import main as _main
+# The functions of the package are only imported on first use (see __getattr__),
+# after the initialization of the user folder (see _initialize)
+# name: (module, attribute of the module or None for the module itself)
+_LAZY_ATTRIBUTES = {
+    # infos
+    'infos': ('.core.infos', 'infos'),
+    'config_help': ('.core.infos', 'config_help'),
+    'list_devices': ('.core.infos', '_list_devices'),
+    'list_drivers': ('.core.infos', '_list_drivers'),
+    # Devices
+    'get_device': ('.core.devices', 'get_device'),
+    'get_devices': ('.core.devices', 'get_devices'),
+    'aget_device': ('.core.devices', 'aget_device'),
+    'close': ('.core.devices', 'close'),
+    'list_loaded_devices': ('.core.devices', 'list_loaded_devices'),
+    'read': ('.core.devices', 'read'),
+    '_devices': ('.core.devices', None),
+    # Drivers
+    'get_driver': ('.core.drivers', 'get_driver'),
+    'explore_driver': ('.core.drivers', 'explore_driver'),
+    'refresh_drivers': ('.core.drivers', 'refresh_drivers'),
+    '_drivers': ('.core.drivers', None),
+    '_config': ('.core.config', None),
+    # Webbrowser shortcuts
+    'report': ('.core.web', 'report'),
+    'doc': ('.core.web', 'doc'),
+    # Server
+    'server': ('.core.server', 'Server'),
+    # GUI
+    'gui': ('.core.gui', 'gui'),
+    'plotter': ('.core.gui', 'plotter'),
+    'monitor': ('.core.gui', 'monitor'),
+    'slider': ('.core.gui', 'slider'),
+    'add_device': ('.core.gui', 'add_device'),
+    'about': ('.core.gui', 'about'),
+    'variables_menu': ('.core.gui', 'variables_menu'),
+    'preferences': ('.core.gui', 'preferences'),
+    'driver_installer': ('.core.gui', 'driver_installer'),
+    # Variables
+    'get_variable': ('.core.variables', 'get_variable'),
+    'list_variables': ('.core.variables', 'list_variables'),
+    'add_variable': ('.core.variables', 'set_variable'),
+    # Scans
+    'load_scan': ('.core.scanning.container', 'load_scan'),
+    # Repository
+    'install_drivers': ('.core.repository', 'install_drivers'),
+    '_repository': ('.core.repository', None),
+    'create_shortcut': ('.core._create_shortcut', 'create_shortcut'),
+    # Used by os shell to start autolab
+    '_main': ('._entry_script', 'main'),
+}
+
+__all__ = ['PATHS', 'DRIVER_SOURCES'] + [
+    name for name in _LAZY_ATTRIBUTES if not name.startswith('_')]
+
+_INITIALIZED = False
+_INITIALIZE_LOCK = _threading.RLock()
+
+
+def _initialize():
+    """ Prepares the user folder, configuration and drivers on first use of the
+    package. Also called at the import of core.config and core.drivers, so that
+    the submodules imported directly are initialized too """
+    global _INITIALIZED
+    with _INITIALIZE_LOCK:
+        if _INITIALIZED: return None
+        _INITIALIZED = True  # set first to allow the imports below
+        try:
+            _initialize_user_folder()
+        except BaseException:
+            _INITIALIZED = False
+            raise
+
+
+def _initialize_user_folder():
+    """ Processes the version changes, checks the configuration files and loads the drivers paths """
+    import numpy  # OPTIMIZE: temporary fix to an infinite loading on some computer following the master merge (commit 25fd4d6)
+    import socket  # OPTIMIZE: temporary fix to an infinite loading on some computer
+
+    # Process updates from previous versions
+    from .core import version_adapter
+    version_adapter.process_all_changes()
+
+    # Load user config
+    from .core import config
+    first = config.initialize_local_directory()
+    config.check_autolab_config()
+    config.check_plotter_config()
+    config.set_temp_folder()
+    config.add_extra_driver_path()
+    config.add_extra_driver_repo_url()
+
+    # Add drivers folder to sys (allows a driver to import another driver)
+    # Order of append between local and official matter for priority
+    for folder in reversed(list(DRIVER_SOURCES.values())):
+        _sys.path.append(folder)
+
+    from .core import repository
+    repository._check_empty_driver_folder()
+
+    if first:
+        # Ask if create shortcut
+        from .core._create_shortcut import create_shortcut
+        create_shortcut(ask=True)
+
+    # Loading the drivers informations on startup
+    from .core import drivers
+    drivers.update_drivers_paths()
+
+
+def __getattr__(name: str):
+    """ Imports the requested function of the package on first use """
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+    _initialize()
+    module_name, attribute = _LAZY_ATTRIBUTES[name]
+    value = _importlib.import_module(module_name, __name__)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    """ For auto-completion """
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+
+# Module __getattr__ is not supported before python 3.7
+if _sys.version_info < (3, 7):
+    for _name in _LAZY_ATTRIBUTES:
+        __getattr__(_name)
+    del _name
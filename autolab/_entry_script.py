@@ -26,6 +26,7 @@ def print_help():
     print('  install_drivers       Install drivers from GitHub')
     print('  driver                Driver interface')
     print('  device                Device interface')
+    print('  scan                  Run a scan configuration without GUI')
     print('  doc                   Open the online documentation (readthedocs)')
     print('  report                Open the online report/suggestions webpage (github)')
     print('  infos                 Displays the available drivers and devices configuration')
@@ -57,6 +58,8 @@ def main():
             driver_parser(args)
         elif command == 'device':
             device_parser(args)
+        elif command == 'scan':
+            scan_parser(args)
         elif command in dir(autolab):  # Execute autolab.command if exists
             attr = getattr(autolab, command)
             if hasattr(attr, '__call__'):
@@ -296,5 +299,45 @@ def device_parser(args_list: List[str]):
 #####################################################################################
 
 
+#####################################################################################
+################################### autolab scan ####################################
+def scan_parser(args_list: List[str]):
+
+    # autolab scan run config.conf --out C:\Users\data.txt            RUN SCAN WITHOUT GUI
+    # autolab scan convert C:\Users\data.txt                          CONVERT SAVED SCAN TO .hdf5
+
+    parser = argparse.ArgumentParser(prog=args_list[0])
+    subparsers = parser.add_subparsers(dest='action')
+
+    run_parser = subparsers.add_parser('run', help='Run a scan configuration exported by the scanner, without GUI')
+    run_parser.add_argument('config', type=str, help='Path of the scan configuration file (.conf)')
+    run_parser.add_argument('-o', '--out', type=str, dest='out', help='Path where to save the data. Adds _<recipe_name> to the file name if the scan has several recipes')
+    run_parser.add_argument('-q', '--quiet', action='store_true', dest='quiet', help='Do not print the number of points acquired during and after the scan')
+
+    convert_parser = subparsers.add_parser('convert', help='Convert a scan saved as text by the scanner into a single .hdf5 file')
+    convert_parser.add_argument('data', type=str, help='Path of the scan data file (.txt)')
+    convert_parser.add_argument('-o', '--out', type=str, dest='out', help='Path of the .hdf5 file (data path with .hdf5 extension by default)')
+
+    args = parser.parse_args(args_list[1: ])
+
+    if args.action == 'convert':
+        from autolab.core.scanning.container import convert_scan_folder
+        print(f'Scan saved in {convert_scan_folder(args.data, out=args.out)}')
+        sys.exit()
+
+    if args.action != 'run':
+        parser.print_help(); sys.exit()
+
+    autolab._initialize()  # before opening the devices of the scan
+    from autolab.core.scanning.engine import run_scan
+
+    try:
+        run_scan(args.config, out=args.out, verbose=not args.quiet)
+    finally:
+        autolab.close()
+################################### autolab scan ####################################
+#####################################################################################
+
+
 if __name__ == '__main__':
     main()
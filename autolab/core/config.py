@@ -7,12 +7,21 @@ Created on Mon Nov 18 14:53:10 2019
 
 import os
 import tempfile
+import threading
 import configparser
-from typing import List
+from types import MappingProxyType
+from typing import List, Mapping, Callable
 
 from .paths import PATHS, DRIVER_SOURCES, DRIVER_REPOSITORY
 from .utilities import boolean
 
+# Parsed configuration files: config_name -> (file stamp, text, config, sections views)
+# The files are only parsed again if their modification time or size changed
+_CONFIG_CACHE = {}
+_CONFIG_LOCK = threading.RLock()
+# Functions called with the config_name when a configuration file has changed
+_CONFIG_LISTENERS = []
+
 
 # =============================================================================
 # GENERAL
@@ -69,23 +78,109 @@ def initialize_local_directory() -> bool:
 
 def save_config(config_name: str, config: configparser.ConfigParser):
     """ This function saves the given config parser in the autolab configuration file """
-    with open(PATHS[config_name], 'w') as file:
-        config.write(file)
+    with _CONFIG_LOCK:
+        with open(PATHS[config_name], 'w') as file:
+            config.write(file)
+        _CONFIG_CACHE.pop(config_name, None)
+
+    _notify_config_change(config_name)
 
 
 def load_config(config_name: str) -> configparser.ConfigParser:
-    """ This function loads the autolab configuration file in a config parser """
+    """ This function loads the autolab configuration file in a config parser.
+    The returned config parser is a copy that can be modified """
+    config = _new_config_parser()
+    config.read_string(_get_cached_config(config_name)[1], PATHS[config_name])
+
+    return config
+
+
+def _new_config_parser() -> configparser.ConfigParser:
+    """ Returns an empty config parser with the autolab options """
     config = configparser.ConfigParser(allow_no_value=True, delimiters='=')  # don't want ':' as delim, needed for path as key
     config.optionxform = str
-    try:  # encoding order matter
-        config.read(PATHS[config_name],
-                    encoding='utf-8')
-    except:
-        config.read(PATHS[config_name])
-
     return config
 
 
+def _get_file_stamp(path: str) -> tuple:
+    """ Returns the modification time and size of a file, or None if missing """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _get_cached_config(config_name: str) -> tuple:
+    """ Returns the cache entry (stamp, text, config, sections views) of the
+    configuration file, parsed again only if the file has been modified.
+    The config parser of the cache must not be modified """
+    path = PATHS[config_name]
+    stamp = _get_file_stamp(path)
+
+    with _CONFIG_LOCK:
+        cached = _CONFIG_CACHE.get(config_name)
+        if cached is not None and cached[0] == stamp:
+            return cached
+
+        text = ''
+        if stamp is not None:
+            try:  # encoding order matter
+                with open(path, 'r', encoding='utf-8') as file:
+                    text = file.read()
+            except UnicodeDecodeError:
+                with open(path, 'r') as file:
+                    text = file.read()
+
+        config = _new_config_parser()
+        config.read_string(text, path)
+        entry = (stamp, text, config, {})
+        _CONFIG_CACHE[config_name] = entry
+
+    if cached is not None:
+        _notify_config_change(config_name)
+
+    return entry
+
+
+def _get_config_section(config_name: str, section_name: str) -> Mapping[str, str]:
+    """ Returns a read-only view of a section of the cached configuration file """
+    _, _, config, views = _get_cached_config(config_name)
+    if section_name not in views:
+        views[section_name] = MappingProxyType(dict(config[section_name]))
+    return views[section_name]
+
+
+def add_config_listener(listener: Callable[[str], None]):
+    """ Adds a function called with the configuration name (ex: 'devices_config')
+    when a configuration file is saved or found modified on disk.
+    Can be called from any thread """
+    if listener not in _CONFIG_LISTENERS:
+        _CONFIG_LISTENERS.append(listener)
+
+
+def remove_config_listener(listener: Callable[[str], None]):
+    """ Removes a function added with :meth:`add_config_listener` """
+    if listener in _CONFIG_LISTENERS:
+        _CONFIG_LISTENERS.remove(listener)
+
+
+def check_config_changes():
+    """ Checks if the configuration files have been modified on disk,
+    to notify the listeners """
+    for config_name in list(_CONFIG_CACHE):
+        _get_cached_config(config_name)
+
+
+def _notify_config_change(config_name: str):
+    """ Calls the listeners of configuration changes """
+    for listener in list(_CONFIG_LISTENERS):
+        try:
+            listener(config_name)
+        except Exception as e:
+            print(f"Warning, error in config listener {listener}: {e}")
+
+
 def modify_config(config_name: str, config_dict: dict) -> configparser.ConfigParser:
     """ Returns a modified config file structures using the input dict """
     config = load_config(config_name)
@@ -147,6 +242,11 @@ autolab_dict = {
                 'save_figure': True,
                 'save_temp': True,
                 'ask_close': True,
+                'flush_rows': 100,
+                'flush_time': 1.,
+                'array_chunk_size': 100,
+                'compress_arrays': False,
+                'memory_budget': 1000,
                 },
     'directories': {'temp_folder': 'default'},
     'extra_driver_path': {},
@@ -159,6 +259,9 @@ def change_autolab_config(config: configparser.ConfigParser):
     config.set('GUI', '# qt_api -> Choose between default, pyqt5, pyside2, pyqt6 and pyside6')
     config.set('GUI', '# theme -> Choose between default and dark')
     config.set('scanner', '# Think twice before using save_temp = False')
+    config.set('scanner', '# flush_rows, flush_time -> Temporary scan data are written every flush_rows points or flush_time seconds (flush_rows = 1 to write each point)')
+    config.set('scanner', '# array_chunk_size, compress_arrays -> Temporary array and dataframe results are written in binary files of array_chunk_size points or flush_time seconds, compressed if compress_arrays')
+    config.set('scanner', '# memory_budget -> Memory in MB kept for the previous scans, the least recently displayed are moved to the temp folder above it (0 for no limit)')
     config.set('extra_driver_path', r'# Example: onedrive = C:\Users\username\OneDrive\my_drivers')
     config.set('extra_driver_url_repo', r'# Example: C:\Users\username\OneDrive\my_drivers = https://github.com/my_repo/my_drivers')
 
@@ -215,49 +318,49 @@ def check_autolab_config():
     change_autolab_config(autolab_config)
 
 
-def get_config(section_name: str) -> configparser.SectionProxy:
-    ''' Returns section from autolab_config.ini '''
-    config = load_config('autolab_config')
+def get_config(section_name: str) -> Mapping[str, str]:
+    ''' Returns a read-only view of a section from autolab_config.ini '''
+    config = _get_cached_config('autolab_config')[2]
     assert section_name in config.sections(), f'Missing {section_name} section in autolab_config.ini'
-    return config[section_name]
+    return _get_config_section('autolab_config', section_name)
 
 
-def get_server_config() -> configparser.SectionProxy:
+def get_server_config() -> Mapping[str, str]:
     ''' Returns section server from autolab_config.ini '''
     return get_config('server')
 
 
-def get_GUI_config() -> configparser.SectionProxy:
+def get_GUI_config() -> Mapping[str, str]:
     ''' Returns section qt_api from autolab_config.ini '''
     return get_config('GUI')
 
 
-def get_control_center_config() -> configparser.SectionProxy:
+def get_control_center_config() -> Mapping[str, str]:
     ''' Returns section control_center from autolab_config.ini '''
     return get_config('control_center')
 
 
-def get_monitor_config() -> configparser.SectionProxy:
+def get_monitor_config() -> Mapping[str, str]:
     ''' Returns section monitor from autolab_config.ini '''
     return get_config('monitor')
 
 
-def get_scanner_config() -> configparser.SectionProxy:
+def get_scanner_config() -> Mapping[str, str]:
     ''' Returns section scanner from autolab_config.ini '''
     return get_config('scanner')
 
 
-def get_directories_config() -> configparser.SectionProxy:
+def get_directories_config() -> Mapping[str, str]:
     ''' Returns section directories from autolab_config.ini '''
     return get_config('directories')
 
 
-def get_extra_driver_path_config() -> configparser.SectionProxy:
+def get_extra_driver_path_config() -> Mapping[str, str]:
     ''' Returns section extra_driver_path from autolab_config.ini '''
     return get_config('extra_driver_path')
 
 
-def get_extra_driver_repo_url_config() -> configparser.SectionProxy:
+def get_extra_driver_repo_url_config() -> Mapping[str, str]:
     ''' Returns section extra_driver_url_repo from autolab_config.ini '''
     return get_config('extra_driver_url_repo')
 
@@ -347,7 +450,7 @@ def check_plotter_config():
 # =============================================================================
 
 def get_all_devices_configs() -> configparser.ConfigParser:
-    ''' Returns current devices configuration '''
+    ''' Returns current devices configuration (copy that can be modified) '''
     config = load_config('devices_config')
     assert len(set(config.sections())) == len(config.sections()), "Each device must have a unique name."
     return config
@@ -355,12 +458,18 @@ def get_all_devices_configs() -> configparser.ConfigParser:
 
 def list_all_devices_configs() -> List[str]:
     ''' Returns the list of available configuration names '''
-    devices_configs = get_all_devices_configs()
+    devices_configs = _get_cached_config('devices_config')[2]
     return sorted(list(devices_configs.sections()))
 
 
-def get_device_config(config_name) -> configparser.SectionProxy:
-    ''' Returns the config associated with config_name '''
-    assert config_name in list_all_devices_configs(), f"Device configuration {config_name} not found"
-    devices_configs = get_all_devices_configs()
-    return devices_configs[config_name]
+def get_device_config(config_name) -> Mapping[str, str]:
+    ''' Returns a read-only view of the config associated with config_name '''
+    devices_configs = _get_cached_config('devices_config')[2]
+    assert config_name in devices_configs.sections(), f"Device configuration {config_name} not found"
+    return _get_config_section('devices_config', config_name)
+
+
+# Initialization of the user folder if this module is imported directly
+# (ex: import autolab.core.devices) instead of through the autolab functions
+from .. import _initialize
+_initialize()
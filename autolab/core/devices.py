@@ -5,17 +5,23 @@ Created on Thu Jun 13 10:25:49 2019
 @author: quentin.chateiller
 """
 
-from typing import List, Union
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union, Any, Dict
 
 from .drivers import get_driver_path, get_driver
 from .config import list_all_devices_configs, get_device_config
-from .elements import Module, Element
+from .elements import Module, Element, read_variables
+from .executor import DeviceExecutor, run_async
 
 # Storage of the devices
 DEVICES = {}
 
-# After DEVICES to avoid circular import
-from .variables import update_allowed_dict
+# Devices are opened concurrently by a shared pool of threads
+LOADING_MAX_WORKERS = 8
+_LOADING_POOL = None
+_LOADING_LOCK = threading.Lock()
+_DEVICE_LOCKS = {}  # device name -> lock preventing to open a device twice
 
 # =============================================================================
 # DEVICE CLASS
@@ -32,31 +38,54 @@ class Device(Module):
         super().__init__(None, {'name': device_name, 'object': instance,
                                 'help': f'Device {device_name} at {self.driver_path}'})
 
+        # Flat address -> Element index used by get_element_by_address
+        self._index = {}
+        self.update_index()
+
+        # Serialize the requests made to the instrument from different threads
+        self._executor = DeviceExecutor(device_name)
+        for element in self._index.values():
+            element._executor = self._executor
+
+    def update_index(self):
+        """ Builds the flat address -> Element index of this device """
+        index = {self.name: self}
+        for element in self.get_elements():
+            index[element.address()] = element
+        self._index = index
+
+    def get_element(self, address: str) -> Union[Element, None]:
+        """ Returns the Element located at the provided address (starting with
+        the device name) or None if not found """
+        return self._index.get(address)
+
     def close(self):
         """ This function close the connection of the current physical device """
         # Remove read and write signals from gui
         try:
             # condition avoid reopenning connection if use close twice
             if self.name in DEVICES:
-                for struc in self.get_structure():
-                    element = get_element_by_address(struc[0])
-                    if struc[1] == 'variable':
+                for element in self._index.values():
+                    if element._element_type == 'variable':
                         element._read_signal = None
                         element._write_signal = None
-                    if struc[1] == 'action':
+                    if element._element_type == 'action':
                         element._write_signal = None
         except: pass
 
-        try: self.instance.close()
+        # Wait for the pending requests before closing the connection
+        try: self._run(self.instance.close)
         except: pass
+        self._executor.shutdown()
 
         del DEVICES[self.name]
-        update_allowed_dict()
+        self._index = {}
 
     def __dir__(self):
         """ For auto-completion """
         return (self.list_modules() + self.list_variables()
-                + self.list_actions() + ['driver_path', 'close', 'help', 'instance'])
+                + self.list_actions() + ['driver_path', 'close', 'help', 'instance',
+                                         'get_element'])
 
 
 # =============================================================================
@@ -73,6 +102,11 @@ def get_element_by_address(address: str) -> Element:
         # This should not be used on autolab closing to avoid access violation due to config opening
         element = get_device(device_name)
 
+    # Fast path using the device index
+    indexed_element = element.get_element(address)
+    if indexed_element is not None:
+        return indexed_element
+
     for i, address_part in enumerate(address_list[1: ]):
         address_part = address_part.replace(' ', '')
         if hasattr(element, address_part):
@@ -83,6 +117,13 @@ def get_element_by_address(address: str) -> Element:
     return element
 
 
+def read(addresses: List[str]) -> List[Any]:
+    """ Returns the values of the variables located at the provided addresses.
+    Variables of a same device are read in a single call to the read_batch
+    function of its driver if available (see :meth:`read_variables`) """
+    return read_variables([get_element_by_address(address) for address in addresses])
+
+
 def get_final_device_config(device_name: str, **kwargs) -> dict:
     ''' Returns a valid device config from configuration file overwritten by kwargs '''
     assert device_name in list_all_devices_configs(), f"Device name '{device_name}' not found in devices_config.ini"
@@ -111,19 +152,71 @@ def get_device(device_name: str, **kwargs) -> Device:
 
     device_config = get_final_device_config(device_name, **kwargs)
 
-    if device_name in list_loaded_devices():
-        # if kwargs:  # OPTIMIZE: If don't provide argument, assume want to get an existing device or new device without argument, so should not raise error if existing device had arguments. Drawback, now could get an existing device with argument when thinking to get a new device without argument
-            assert device_config == DEVICES[device_name].device_config, 'You cannot change the configuration of an existing Device. Close it first & retry, or remove the provided configuration.'
+    with get_device_lock(device_name):
+        if device_name in list_loaded_devices():
+            # if kwargs:  # OPTIMIZE: If don't provide argument, assume want to get an existing device or new device without argument, so should not raise error if existing device had arguments. Drawback, now could get an existing device with argument when thinking to get a new device without argument
+                assert device_config == DEVICES[device_name].device_config, 'You cannot change the configuration of an existing Device. Close it first & retry, or remove the provided configuration.'
 
-    else:
-        instance = get_driver(
-            device_config['driver'], device_config['connection'],
-            **{k: v for k, v in device_config.items() if k not in [
-                'driver', 'connection']})
-        DEVICES[device_name] = Device(device_name, instance, device_config)
-        update_allowed_dict()
-
-    return DEVICES[device_name]
+        else:
+            instance = get_driver(
+                device_config['driver'], device_config['connection'],
+                **{k: v for k, v in device_config.items() if k not in [
+                    'driver', 'connection']})
+            DEVICES[device_name] = Device(device_name, instance, device_config)
+
+        return DEVICES[device_name]
+
+
+def get_devices(device_names: List[str],
+                max_workers: int = None) -> Dict[str, Union[Device, Exception]]:
+    ''' Returns a dict with the Device associated to each device name, opening
+    them concurrently. Devices that can't be opened are associated to the raised
+    exception instead. Uses the shared loading pool if max_workers is not provided. '''
+    assert not isinstance(device_names, str), f'{device_names} must be a list of strings'
+    device_names = list(dict.fromkeys(device_names))  # remove duplicates
+
+    if max_workers is None:
+        pool = get_loading_pool()
+        futures = {name: pool.submit(get_device, name) for name in device_names}
+        return _get_results(futures)
+
+    assert max_workers > 0, 'max_workers must be greater than 0'
+    with ThreadPoolExecutor(max_workers=max_workers,
+                            thread_name_prefix='autolab_loading') as pool:
+        futures = {name: pool.submit(get_device, name) for name in device_names}
+        return _get_results(futures)
+
+
+def _get_results(futures: dict) -> dict:
+    ''' Returns the results of the given futures, or their exceptions '''
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            results[name] = e
+    return results
+
+
+def get_loading_pool() -> ThreadPoolExecutor:
+    ''' Returns the pool of threads shared to open the devices '''
+    global _LOADING_POOL
+    with _LOADING_LOCK:
+        if _LOADING_POOL is None:
+            _LOADING_POOL = ThreadPoolExecutor(
+                max_workers=LOADING_MAX_WORKERS, thread_name_prefix='autolab_loading')
+        return _LOADING_POOL
+
+
+def get_device_lock(device_name: str) -> threading.RLock:
+    ''' Returns the lock used to open the device device_name '''
+    with _LOADING_LOCK:
+        return _DEVICE_LOCKS.setdefault(device_name, threading.RLock())
+
+
+async def aget_device(device_name: str, **kwargs) -> Device:
+    ''' Asyncio version of :meth:`get_device`, the device is loaded in a thread '''
+    return await run_async(get_device, device_name, **kwargs)
 
 
 # =============================================================================
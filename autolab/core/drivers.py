@@ -6,13 +6,71 @@ Created on Tue Oct  1 17:38:15 2019
 """
 import os
 import sys
+import ast
+import json
 import inspect
 import importlib
-from typing import Type, List, Tuple
+import importlib.abc
+import importlib.machinery
+import threading
+import contextlib
+from typing import Type, List, Tuple, Any, Union
 from types import ModuleType
 
 from .paths import PATHS, DRIVERS_PATHS, DRIVER_SOURCES
 
+# Sources and directories mtimes used to validate DRIVERS_PATHS
+_DRIVERS_PATHS_STAMP = None
+_DRIVERS_PATHS_LOCK = threading.Lock()
+
+# Loaded driver libraries: path -> (mtime, size, module)
+_LIB_CACHE = {}
+_LIB_CACHE_LOCK = threading.Lock()
+
+
+# =============================================================================
+# DRIVERS IMPORT PATH
+# =============================================================================
+
+class DriverFinder(importlib.abc.MetaPathFinder):
+    """ Finds the modules imported by a driver in its own folder.
+    The folders are specific to each thread, so drivers can be loaded
+    concurrently without changing the working directory or sys.path """
+
+    def __init__(self):
+        self._context = threading.local()
+
+    def get_directories(self) -> List[str]:
+        """ Returns the driver folders used by the current thread """
+        if not hasattr(self._context, 'directories'):
+            self._context.directories = []
+        return self._context.directories
+
+    def find_spec(self, fullname: str, path=None, target=None):
+        # Only top-level imports, submodules are found by the parent package
+        if path is not None: return None
+        directories = self.get_directories()
+        if not directories: return None
+        # Last driver folder first as for nested driver loads
+        return importlib.machinery.PathFinder.find_spec(
+            fullname, list(reversed(directories)))
+
+
+_DRIVER_FINDER = DriverFinder()
+# After the default finders to behave like sys.path.append
+sys.meta_path.append(_DRIVER_FINDER)
+
+
+@contextlib.contextmanager
+def driver_import_path(directory: str):
+    """ Allows the current thread to import modules from directory """
+    directories = _DRIVER_FINDER.get_directories()
+    directories.append(directory)
+    try:
+        yield
+    finally:
+        directories.pop()
+
 
 # =============================================================================
 # DRIVERS INSTANTIATION
@@ -28,12 +86,8 @@ def get_driver(driver_name: str, connection: str, **kwargs) -> Type:
         driver_lib = load_driver_lib(driver_name)
         # Need to add the driver path to allow driver imports from its folder (and only his own, not other drivers)
         driver_path = os.path.dirname(driver_lib.__file__)
-        if driver_path not in sys.path:
-            sys.path.append(driver_path)
-        try:
+        with driver_import_path(driver_path):
             driver_instance = get_connection_class(driver_lib, connection)(**kwargs)
-        finally:
-            sys.path.remove(driver_path)
 
     return driver_instance
 
@@ -42,41 +96,74 @@ def load_driver_lib(driver_name: str) -> ModuleType:
     ''' Returns a driver library that contains Driver, Driver_XXX, Module_XXX '''
     # Loading preparation
     driver_path = get_driver_path(driver_name)
-    driver_directory = os.path.dirname(driver_path)
 
-    if driver_directory not in sys.path:
-        sys.path.append(driver_directory)
-    try:
-        # Load library
-        driver_lib = load_lib(driver_path)
-    finally:
-        sys.path.remove(driver_directory)
+    # Load library
+    driver_lib = load_lib(driver_path)
 
     return driver_lib
 
 
 def load_lib(lib_path: str) -> ModuleType:
-    ''' Returns an instance of the python script located at lib_path '''
+    ''' Returns an instance of the python script located at lib_path.
+    The module is only executed again if the file has been modified '''
     lib_name = os.path.basename(lib_path).split('.')[0]
 
-    # Save current working directory path
-    curr_dir = os.getcwd()
+    lib = _get_cached_lib(lib_path)
+    if lib is not None: return lib
 
-    # Go to the driver's directory (in case it contains absolute imports)
-    os.chdir(os.path.dirname(lib_path))
+    # Stamp taken before the execution, a file modified meanwhile is reloaded
+    stamp = _get_file_stamp(lib_path)
 
-    try:
+    # Allow imports from the driver's directory (in case it contains absolute imports).
+    # The working directory is not changed: files of the driver's folder must
+    # be opened from os.path.dirname(__file__)
+    with driver_import_path(os.path.dirname(lib_path)):
         # Load the module
         spec = importlib.util.spec_from_file_location(lib_name, lib_path)
         lib = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(lib)
-    finally:
-        # Come back to previous working directory
-        os.chdir(curr_dir)
+
+    _set_cached_lib(lib_path, lib, stamp)
 
     return lib
 
 
+def _get_file_stamp(path: str) -> Tuple[float, int]:
+    ''' Returns the modification time and size of the file used to validate the cache '''
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def _get_cached_lib(lib_path: str) -> ModuleType:
+    ''' Returns the cached module of lib_path if the file is unchanged, else None '''
+    lib_path = os.path.abspath(lib_path)
+    with _LIB_CACHE_LOCK:
+        cached = _LIB_CACHE.get(lib_path)
+    if cached is None: return None
+
+    try:
+        stamp = _get_file_stamp(lib_path)
+    except OSError:
+        return None
+
+    return cached[2] if cached[: 2] == stamp else None
+
+
+def _set_cached_lib(lib_path: str, lib: ModuleType, stamp: Tuple[float, int]):
+    ''' Stores the module lib loaded from lib_path in the cache, stamp being
+    the file stamp taken before its execution '''
+    lib_path = os.path.abspath(lib_path)
+    with _LIB_CACHE_LOCK:
+        _LIB_CACHE[lib_path] = (*stamp, lib)
+
+
+def clear_driver_cache():
+    ''' Removes all the loaded driver libraries from the cache, to force their
+    execution on next load (used when drivers are reinstalled) '''
+    with _LIB_CACHE_LOCK:
+        _LIB_CACHE.clear()
+
+
 def load_driver_utilities_lib(driver_utilities_name: str) -> ModuleType:
     ''' Returns a driver library that contains Driver, Driver_XXX, Module_XXX '''
     # Loading preparation
@@ -95,21 +182,25 @@ def load_utilities_lib(lib_path: str) -> ModuleType:
     ''' Returns an instance of the python script located at lib_path '''
     lib_name = os.path.basename(lib_path).split('.')[0]
 
-    # Save current working directory path
-    curr_dir = os.getcwd()
+    lib_name = lib_name + '_utilities'
+    utilities_path = os.path.join(os.path.dirname(lib_path), f'{lib_name}.py')
 
-    # Go to the driver's directory (in case it contains absolute imports)
-    os.chdir(os.path.dirname(lib_path))
+    lib = _get_cached_lib(utilities_path)
+    if lib is not None: return lib
 
-    # Load the module
-    lib_name = lib_name + '_utilities'
-    spec = importlib.util.spec_from_file_location(
-        lib_name, os.path.join(os.path.dirname(lib_path), f'{lib_name}.py'))
-    lib = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(lib)
+    # Stamp taken before the execution, a file modified meanwhile is reloaded
+    stamp = _get_file_stamp(utilities_path)
 
-    # Come back to previous working directory
-    os.chdir(curr_dir)
+    # Allow imports from the driver's directory (in case it contains absolute imports).
+    # The working directory is not changed: files of the driver's folder must
+    # be opened from os.path.dirname(__file__)
+    with driver_import_path(os.path.dirname(lib_path)):
+        # Load the module
+        spec = importlib.util.spec_from_file_location(lib_name, utilities_path)
+        lib = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(lib)
+
+    _set_cached_lib(utilities_path, lib, stamp)
 
     return lib
 
@@ -146,24 +237,8 @@ def get_connection_names(driver_lib: ModuleType) -> List[str]:
 
 
 def get_driver_category(driver_name: str) -> str:
-    ''' Returns the driver's category from class Driver '''
-    for filename in ('', '_utilities'):
-
-        driver_utilities_path = os.path.join(
-            os.path.dirname(get_driver_path(driver_name)), f'{driver_name}{filename}.py')
-        category = 'Unknown'
-
-        if os.path.exists(driver_utilities_path):
-            try:
-                driver_utilities = load_lib(driver_utilities_path)
-            except Exception as e:
-                print(f"Can't load {driver_name}: {e}", file=sys.stderr)
-            else:
-                if hasattr(driver_utilities, 'category'):
-                    category = driver_utilities.category
-                    break
-
-    return category
+    ''' Returns the driver's category from the drivers index (see :meth:`get_driver_infos`) '''
+    return get_driver_infos(driver_name)['category']
 
 
 def get_driver_class(driver_lib: ModuleType) -> Type:
@@ -444,27 +519,350 @@ def load_drivers_paths() -> dict:
         - key: name of the driver
         - value: path of the driver python script
     '''
+    return _scan_drivers_sources()[0]
+
+
+def _scan_drivers_sources() -> Tuple[dict, dict]:
+    ''' Returns the drivers paths (see :meth:`load_drivers_paths`) and the
+    modification times of the directories that can change them: the drivers
+    sources, and their subfolders without a driver file '''
     drivers_paths = {}
+    stamp = {}
     for source_name, source_path in DRIVER_SOURCES.items():
         if not os.path.isdir(source_path):
             print(f"Warning, can't found driver folder: {source_path}")
+            stamp[source_path] = None
             continue
-        for driver_name in os.listdir(source_path):
-            temp_path = os.path.join(source_path, driver_name)
-            if (os.path.isdir(temp_path)
-                    and f'{driver_name}.py' in os.listdir(temp_path)):
-                ## Before, raised error if two identical drivers in different folders, I thought of putting a warning message instead but there was too much printing, now don't say that overwrite path (don't overwrite file).
-                # if driver_name in drivers_paths.keys():
-                #     print(f"Two drivers where found with the name '{driver_name}', will use path {source_name}")
-                # assert driver_name not in drivers_paths.keys(), f"Two drivers where found with the name '{driver_name}'. Each driver must have a unique name."
-                drivers_paths[driver_name] = {
-                    'path': os.path.join(temp_path, f'{driver_name}.py'),
-                    'source': source_name}
-
-    return drivers_paths
-
-
-def update_drivers_paths():
-    ''' Update list of available driver '''
-    DRIVERS_PATHS.clear()
-    DRIVERS_PATHS.update(load_drivers_paths())
+        stamp[source_path] = os.stat(source_path).st_mtime
+        with os.scandir(source_path) as entries:
+            for entry in entries:
+                if not entry.is_dir(): continue
+                driver_name = entry.name
+                driver_path = os.path.join(entry.path, f'{driver_name}.py')
+                if os.path.isfile(driver_path):
+                    ## Before, raised error if two identical drivers in different folders, I thought of putting a warning message instead but there was too much printing, now don't say that overwrite path (don't overwrite file).
+                    # if driver_name in drivers_paths.keys():
+                    #     print(f"Two drivers where found with the name '{driver_name}', will use path {source_name}")
+                    # assert driver_name not in drivers_paths.keys(), f"Two drivers where found with the name '{driver_name}'. Each driver must have a unique name."
+                    drivers_paths[driver_name] = {
+                        'path': driver_path, 'source': source_name}
+                else:
+                    # A driver file could be added later in this folder
+                    stamp[entry.path] = entry.stat().st_mtime
+
+    return drivers_paths, stamp
+
+
+def _is_drivers_paths_valid() -> bool:
+    ''' Returns True if the drivers sources are unchanged since the last scan '''
+    if _DRIVERS_PATHS_STAMP is None: return False
+    sources, stamp = _DRIVERS_PATHS_STAMP
+    if sources != tuple(DRIVER_SOURCES.items()): return False
+
+    for path, mtime in stamp.items():
+        try:
+            if os.stat(path).st_mtime != mtime: return False
+        except OSError:
+            if mtime is not None: return False
+
+    return True
+
+
+def update_drivers_paths(force: bool = False):
+    ''' Update list of available driver.
+    The drivers sources are only scanned again if they have been modified,
+    or if force is True (a driver file removed from a driver folder still
+    containing other files is only detected with force) '''
+    global _DRIVERS_PATHS_STAMP
+    with _DRIVERS_PATHS_LOCK:
+        if not force and _is_drivers_paths_valid(): return None
+
+        drivers_paths, stamp = _scan_drivers_sources()
+        # Update in place without clearing to never expose an empty dict
+        for driver_name in list(DRIVERS_PATHS):
+            if driver_name not in drivers_paths:
+                DRIVERS_PATHS.pop(driver_name)
+        DRIVERS_PATHS.update(drivers_paths)
+        _DRIVERS_PATHS_STAMP = (tuple(DRIVER_SOURCES.items()), stamp)
+
+
+def refresh_drivers():
+    ''' Scans again the drivers folders, to be used if a driver has been
+    added or removed outside of autolab '''
+    update_drivers_paths(force=True)
+
+
+# =============================================================================
+# DRIVERS INDEX
+# =============================================================================
+
+# Metadata of the drivers stored in PATHS['drivers_index']: driver path -> infos
+_DRIVERS_INDEX = None
+_DRIVERS_INDEX_LOCK = threading.RLock()
+_DRIVERS_INDEX_VERSION = 2
+
+
+def get_driver_infos(driver_name: str) -> dict:
+    ''' Returns the metadata of a driver without importing it if possible:
+        - category: category of the driver (str)
+        - connections: {connection name: {argument: default value}}
+        - driver_args: {argument: default value} of the class Driver
+        - slot_config: slot_config attribute of the class Driver, or None
+        - modules: {module name: category of the class Module_XXX or None}
+    The metadata are read from the drivers index and updated if the driver
+    folder or files have been modified since.
+    '''
+    driver_path = get_driver_path(driver_name)
+    with _DRIVERS_INDEX_LOCK:
+        infos, modified = _get_indexed_driver_infos(driver_name, driver_path)
+        if modified: _save_drivers_index()
+    return infos
+
+
+def update_drivers_index():
+    ''' Updates the metadata of all the available drivers in the drivers index
+    and removes the drivers no longer available '''
+    with _DRIVERS_INDEX_LOCK:
+        index = _load_drivers_index()
+        modified = False
+
+        drivers_paths = {val['path']: key for key, val in DRIVERS_PATHS.items()}
+        for driver_path in list(index):
+            if driver_path not in drivers_paths:
+                index.pop(driver_path)
+                modified = True
+
+        for driver_path, driver_name in drivers_paths.items():
+            modified |= _get_indexed_driver_infos(driver_name, driver_path)[1]
+
+        if modified: _save_drivers_index()
+
+
+def _get_indexed_driver_infos(driver_name: str, driver_path: str) -> Tuple[dict, bool]:
+    ''' Returns the infos of the driver from the index, updated if needed, and
+    True if the index has been modified '''
+    index = _load_drivers_index()
+    stamp = _get_driver_stamp(driver_name, driver_path)
+    infos = index.get(driver_path)
+
+    if infos is not None and infos['stamp'] == stamp:
+        return infos, False
+
+    infos = _parse_driver_infos(driver_name, driver_path)
+    # Keep driver in index only if the metadata are complete
+    if infos.pop('complete'):
+        infos['stamp'] = stamp
+        index[driver_path] = infos
+        return infos, True
+
+    infos['stamp'] = None
+    return infos, index.pop(driver_path, None) is not None
+
+
+def _get_driver_stamp(driver_name: str, driver_path: str) -> list:
+    ''' Returns the modification times and sizes of the driver folder and files '''
+    driver_directory = os.path.dirname(driver_path)
+    stamp = [os.stat(driver_directory).st_mtime]
+    for path in (driver_path, os.path.join(driver_directory,
+                                           f'{driver_name}_utilities.py')):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stamp += [0, 0]
+        else:
+            stamp += [stat.st_mtime, stat.st_size]
+    return stamp
+
+
+def _load_drivers_index() -> dict:
+    ''' Returns the drivers index, read from PATHS['drivers_index'] on first call '''
+    global _DRIVERS_INDEX
+    if _DRIVERS_INDEX is None:
+        _DRIVERS_INDEX = {}
+        if os.path.exists(PATHS['drivers_index']):
+            try:
+                with open(PATHS['drivers_index'], 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == _DRIVERS_INDEX_VERSION:
+                    _DRIVERS_INDEX = data['drivers']
+            except Exception as e:
+                print(f"Warning, can't read drivers index: {e}", file=sys.stderr)
+    return _DRIVERS_INDEX
+
+
+def _save_drivers_index():
+    ''' Writes the drivers index to PATHS['drivers_index'] '''
+    temp_path = PATHS['drivers_index'] + '.tmp'
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump({'version': _DRIVERS_INDEX_VERSION,
+                       'drivers': _load_drivers_index()}, f)
+        os.replace(temp_path, PATHS['drivers_index'])
+    except Exception as e:
+        print(f"Warning, can't write drivers index: {e}", file=sys.stderr)
+
+
+def _parse_driver_infos(driver_name: str, driver_path: str) -> dict:
+    ''' Returns the metadata of a driver, by parsing its files if possible,
+    else by importing it. 'complete' is False if the import failed '''
+    infos = {'category': None, 'connections': {}, 'driver_args': None,
+             'slot_config': None, 'modules': {}, 'complete': True}
+    resolved = True
+
+    utilities_path = os.path.join(os.path.dirname(driver_path),
+                                  f'{driver_name}_utilities.py')
+    for path in (driver_path, utilities_path):
+        if not os.path.exists(path): continue
+        try:
+            with open(path, 'rb') as f:
+                tree = ast.parse(f.read(), path)
+        except Exception:
+            if path == driver_path: resolved = False
+            continue
+
+        if path == driver_path and _has_dynamic_classes(tree):
+            resolved = False
+
+        for node in tree.body:
+            if _get_assigned_literal(node, 'category') is not None:
+                if infos['category'] is None:
+                    infos['category'] = _get_assigned_literal(node, 'category')
+
+            if path != driver_path or not isinstance(node, ast.ClassDef):
+                continue
+
+            if node.name == 'Driver':
+                infos['driver_args'] = _get_init_defaults(node)
+                for subnode in node.body:
+                    slot_config = _get_assigned_literal(subnode, 'slot_config')
+                    if slot_config is not None:
+                        infos['slot_config'] = f'{slot_config}'
+                    elif _is_assigned(subnode, 'slot_config'):
+                        resolved = False  # f-string, concatenation, ... needs an import
+            elif node.name.startswith('Driver_'):
+                infos['connections'][node.name.split('_')[1]] = _get_init_defaults(node)
+            elif node.name.startswith('Module_'):
+                category = None
+                for subnode in node.body:
+                    if _get_assigned_literal(subnode, 'category') is not None:
+                        category = _get_assigned_literal(subnode, 'category')
+                infos['modules'][node.name.split('_')[1]] = category
+
+    if infos['category'] is None: infos['category'] = 'Unknown'
+
+    # Same order as get_connection_names and get_module_names (sorted class
+    # names), the first connection being the default one
+    for key, prefix in (('connections', 'Driver_'), ('modules', 'Module_')):
+        infos[key] = dict(sorted(infos[key].items(),
+                                 key=lambda item: prefix + item[0]))
+
+    # Arguments that can't be found in the source need the driver to be imported
+    if (not resolved or infos['driver_args'] is None
+            or None in infos['connections'].values()):
+        try:
+            driver_lib = load_driver_lib(driver_name)
+            driver_class = get_driver_class(driver_lib)
+            infos['driver_args'] = _get_json_args(get_class_args(driver_class))
+            infos['slot_config'] = (f'{driver_class.slot_config}' if hasattr(
+                driver_class, 'slot_config') else None)
+            infos['connections'] = {
+                conn: _get_json_args(get_class_args(
+                    get_connection_class(driver_lib, conn)))
+                for conn in get_connection_names(driver_lib)}
+            infos['modules'] = {
+                module: getattr(get_module_class(driver_lib, module), 'category', None)
+                for module in get_module_names(driver_lib)}
+        except Exception as e:
+            print(f"Can't load {driver_name}: {e}", file=sys.stderr)
+            infos['complete'] = False
+            if infos['driver_args'] is None: infos['driver_args'] = {}
+            infos['connections'] = {conn: args if args is not None else {}
+                                    for conn, args in infos['connections'].items()}
+
+    return infos
+
+
+def _has_dynamic_classes(tree: ast.Module) -> bool:
+    ''' Returns True if a name Driver_XXX or Module_XXX is bound at module level
+    by other means than a class definition (import, assignment, class created in
+    a if or try block), which can only be found by importing the driver '''
+    prefixes = ('Driver_', 'Module_')
+    for node in tree.body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for subnode in ast.walk(node):
+            if isinstance(subnode, ast.ClassDef):
+                names = [subnode.name]
+            elif isinstance(subnode, ast.Name) and isinstance(subnode.ctx, ast.Store):
+                names = [subnode.id]
+            elif isinstance(subnode, (ast.Import, ast.ImportFrom)):
+                names = [alias.asname or alias.name.split('.')[0]
+                         for alias in subnode.names]
+            else:
+                continue
+            if any(name == '*' or name.startswith(prefixes) for name in names):
+                return True
+    return False
+
+
+def _is_assigned(node: ast.AST, name: str) -> bool:
+    ''' Returns True if node assigns a value to name '''
+    if isinstance(node, ast.Assign):
+        targets = node.targets
+    elif isinstance(node, (ast.AnnAssign, ast.AugAssign)):
+        targets = [node.target]
+    else:
+        return False
+    return any(isinstance(target, ast.Name) and target.id == name
+               for target in targets)
+
+
+def _get_assigned_literal(node: ast.AST, name: str) -> Any:
+    ''' Returns the value assigned to name if node is an assignment of a
+    literal string or number to name, else None '''
+    if not (isinstance(node, ast.Assign) and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id == name):
+        return None
+    try:
+        value = ast.literal_eval(node.value)
+    except ValueError:
+        return None
+    return value if isinstance(value, (str, int, float)) else None
+
+
+def _get_init_defaults(node: ast.ClassDef) -> Union[dict, None]:
+    ''' Returns the arguments with default value of the __init__ method of
+    the class, as get_class_args, or None if they can't be found statically '''
+    for subnode in node.body:
+        if isinstance(subnode, ast.FunctionDef) and subnode.name == '__init__':
+            args = subnode.args
+            positional = getattr(args, 'posonlyargs', []) + args.args
+            positional = positional[len(positional) - len(args.defaults): ]
+            keywords = [(arg, default) for arg, default in zip(
+                args.kwonlyargs, args.kw_defaults) if default is not None]
+            defaults = {}
+            for arg, default in list(zip(positional, args.defaults)) + keywords:
+                try:
+                    value = ast.literal_eval(default)
+                except ValueError:
+                    return None
+                if not isinstance(value, (str, int, float, bool, type(None))):
+                    return None
+                defaults[arg.arg] = value
+            return defaults
+    # Inherited __init__
+    return None
+
+
+def _get_json_args(args: dict) -> dict:
+    ''' Returns the arguments with their default values converted to str if
+    they can't be stored in json '''
+    return {key: value if isinstance(value, (str, int, float, bool, type(None)))
+            else str(value) for key, value in args.items()}
+
+
+# Initialization of the user folder if this module is imported directly
+# (ex: import autolab.core.devices) instead of through the autolab functions
+from .. import _initialize
+_initialize()
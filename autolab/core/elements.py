@@ -7,14 +7,20 @@ Created on Fri Oct 18 22:20:14 2019
 
 import os
 import sys
+import time
 import inspect
-from typing import Type, Tuple, List, Any
+import functools
+from typing import Type, Tuple, List, Any, Callable, Hashable, Awaitable
 
 import numpy as np
 import pandas as pd
 
 from .paths import PATHS
 from .utilities import emphasize, clean_string, SUPPORTED_EXTENSION
+from .executor import run_async
+
+# Values bigger than this size (in bytes) are not kept in the Variable read cache
+CACHE_MAX_SIZE = 10 * 1024**2
 
 
 class Element():
@@ -25,6 +31,22 @@ class Element():
         self._element_type = element_type
         self._parent = parent
         self._help = None
+        self._executor = None  # DeviceExecutor set by the Device
+
+    def _run(self, function: Callable, *args, key: Hashable = None) -> Any:
+        """ Executes a driver function through the device executor if any,
+        to serialize the calls made to the instrument from different threads """
+        if self._executor is None:
+            return function(*args)
+        return self._executor.submit(function, *args, key=key)
+
+    def _arun(self, function: Callable, *args) -> Awaitable:
+        """ Executes function(*args) in the worker thread of the device and
+        returns an awaitable future (or in the default executor of the event
+        loop if the element doesn't belong to a device) """
+        if self._executor is None:
+            return run_async(function, *args)
+        return self._executor.submit_async(function, *args)
 
     def address(self) -> str:
         """ Returns the address of the given element.
@@ -33,6 +55,13 @@ class Element():
             return self._parent.address() + '.' + self.name
         return self.name
 
+    def _root(self) -> Type:  # -> Module
+        """ Returns the top-level module (Device) of the given element """
+        element = self
+        while element._parent is not None:
+            element = element._parent
+        return element
+
 
 class Variable(Element):
 
@@ -44,6 +73,9 @@ class Variable(Element):
         assert 'type' in config, f"Variable {self.address()}: Missing variable type"
         assert config['type'] in [int, float, bool, str, bytes, tuple, np.ndarray, pd.DataFrame], f"Variable {self.address()} configuration: Variable type not supported in autolab"
         self.type = config['type']
+
+        # Last value with its monotonic read timestamp (None if not read)
+        self._cache = (None, None)
         if self.type in [tuple]:
             self.value = ([], -1)
 
@@ -61,6 +93,13 @@ class Variable(Element):
                 assert isinstance(config['read_init'], bool), f"Variable {self.address()} configuration: read_init parameter must be a boolean"
                 self.read_init = bool(config['read_init'])
 
+        # Read cache: store the last read value to be reused by reads with max_age
+        self.cache = False
+        self.cache_max_size = CACHE_MAX_SIZE
+        if 'cache' in config:
+            assert isinstance(config['cache'], bool), f"Variable {self.address()} configuration: cache parameter must be a boolean"
+            self.cache = bool(config['cache'])
+
         # Write function
         self.write_function = None
         if 'write' in config:
@@ -104,6 +143,38 @@ class Variable(Element):
         self._read_signal = None
         self._write_signal = None
 
+    @property
+    def value(self) -> Any:
+        """ Returns the last value read or written (only stored if cache is
+        enabled, if the value is small enough or for tuple variables) """
+        return self._cache[0]
+
+    @value.setter
+    def value(self, value: Any):
+        self._cache = (value, None)
+
+    def clear_cache(self):
+        """ Invalidates the read cache of the variable """
+        self._cache = (self._cache[0], None) if self.type in [tuple] else (None, None)
+
+    def _store_cache(self, value: Any):
+        """ Stores the read value with its timestamp if not too big in memory """
+        if isinstance(value, np.ndarray): size = value.nbytes
+        elif isinstance(value, pd.DataFrame): size = value.memory_usage(deep=False).sum()
+        elif isinstance(value, (bytes, str)): size = len(value)
+        else: size = 0
+
+        if size <= self.cache_max_size:
+            self._cache = (value, time.monotonic())
+        else:
+            self.clear_cache()
+
+    def _process_read(self, answer: Any, store: bool = False):
+        """ Sends the read value to the GUI and stores it in the cache """
+        if self._read_signal is not None: self._read_signal.emit_read(answer)
+        if store or self.cache or self.type in [tuple]:
+            self._store_cache(answer)
+
     def save(self, path: str, value: Any = None):
         """ This function measure the variable and saves its value in the provided path """
 
@@ -156,15 +227,20 @@ class Variable(Element):
 
         return display
 
-    def __call__(self, value: Any = None) -> Any:
-        """ Measure or set the value of the variable """
+    def __call__(self, value: Any = None, max_age: float = None) -> Any:
+        """ Measure or set the value of the variable.
+        If max_age (in seconds) is provided, returns the cached value if it has
+        been read less than max_age seconds ago instead of measuring it again """
         # GET FUNCTION
         if value is None:
             assert self.readable, f"The variable {self.address()} is not readable"
-            answer = self.read_function()
-            if self._read_signal is not None: self._read_signal.emit_read(answer)
-            if self.type in [tuple]:  # OPTIMIZE: could be generalized to any variable but fear could lead to memory issue
-                self.value = answer
+            if max_age is not None:
+                cached_value, timestamp = self._cache
+                if timestamp is not None and time.monotonic() - timestamp <= max_age:
+                    return cached_value
+
+            answer = self._run(self.read_function, key=self)
+            self._process_read(answer, store=max_age is not None)
             return answer
 
         # SET FUNCTION
@@ -174,12 +250,21 @@ class Variable(Element):
             value = np.array(value, ndmin=1)  # ndim=1 to avoid having float if 0D
         else:
             value = self.type(value)
-        if self.type in [tuple]:  # OPTIMIZE: could be generalized to any variable but fear could lead to memory issue
-            self.value = value
-        self.write_function(value)
+        # Written value invalidates the read cache (keep tuple to know its items)
+        self._cache = (value, None) if self.type in [tuple] else (None, None)
+        self._run(self.write_function, value)
         if self._write_signal is not None: self._write_signal.emit_write(value)
         return None
 
+    async def aread(self, max_age: float = None) -> Any:
+        """ Asyncio version of variable() (see :meth:`__call__`) """
+        return await self._arun(functools.partial(self.__call__, max_age=max_age))
+
+    async def awrite(self, value: Any):
+        """ Asyncio version of variable(value) (see :meth:`__call__`) """
+        assert value is not None, f"The variable {self.address()} cannot be set to None"
+        await self._arun(self.__call__, value)
+
 
 class Action(Element):
 
@@ -246,7 +331,7 @@ class Action(Element):
                     value = np.array(value, ndmin=1)  # ndim=1 to avoid having float if 0D
                 else:
                     value = self.type(value)
-                self.function(value)
+                self._run(self.function, value)
             elif self.unit in ('open-file', 'save-file', 'filename'):
                 if self.unit == 'filename':  # LEGACY (may be removed later)
                     print(f"Using 'filename' as unit is depreciated in favor of 'open-file' and 'save-file'" \
@@ -272,7 +357,7 @@ class Action(Element):
                     path = os.path.dirname(filename)
                     PATHS['last_folder'] = path
                     value = filename
-                    self.function(value)
+                    self._run(self.function, value)
                 else:
                     print(f"Action '{self.address()}' cancel filename selection")
 
@@ -287,17 +372,25 @@ class Action(Element):
 
                 if response != '':
                     value = response
-                    self.function(value)
+                    self._run(self.function, value)
             else:
                 assert value is not None, f"The action {self.address()} requires an argument"
         else:
             assert value is None, f"The action {self.address()} doesn't require an argument"
-            self.function()
+            self._run(self.function)
 
         if self.type in [tuple]:  # OPTIMIZE: could be generalized to any variable but fear could lead to memory issue
             self.value = value
         if self._write_signal is not None: self._write_signal.emit_write(value)
 
+    async def aexecute(self, value: Any = None):
+        """ Asyncio version of action(value) (see :meth:`__call__`).
+        The value is required if the action has a parameter, the file and
+        input dialogs can't be opened from the worker thread of the device """
+        assert not (self.has_parameter and value is None), (
+            f"The action {self.address()} requires an argument")
+        await self._arun(self.__call__, value)
+
 
 class Module(Element):
 
@@ -308,6 +401,7 @@ class Module(Element):
         self._mod = {}
         self._var = {}
         self._act = {}
+        self._names = {}  # merged name -> Element table used by __getattr__
         self._read_init_list = []
 
         # Object - instance
@@ -342,20 +436,23 @@ class Module(Element):
 
             if element_type == 'module':
                 # Check name uniqueness
-                assert name not in self.get_names(), f"Module {self.address()}, Submodule {name} configuration: '{name}' already exists"
+                assert name not in self._names, f"Module {self.address()}, Submodule {name} configuration: '{name}' already exists"
                 self._mod[name] = Module(self, config_line)
+                self._names[name] = self._mod[name]
 
             elif element_type == 'variable':
                 # Check name uniqueness
-                assert name not in self.get_names(), f"Module {self.address()}, Variable {name} configuration: '{name}' already exists"
+                assert name not in self._names, f"Module {self.address()}, Variable {name} configuration: '{name}' already exists"
                 self._var[name] = Variable(self, config_line)
+                self._names[name] = self._var[name]
                 if self._var[name].read_init:
                     self._read_init_list.append(self._var[name])
 
             elif element_type == 'action':
                 # Check name uniqueness
-                assert name not in self.get_names(), f"Module {self.address()}, Action {name} configuration: '{name}' already exists"
+                assert name not in self._names, f"Module {self.address()}, Action {name} configuration: '{name}' already exists"
                 self._act[name] = Action(self, config_line)
+                self._names[name] = self._act[name]
 
     def get_module(self, name: str) -> Type:  # -> Module
         """ Returns the submodule of the given name """
@@ -384,16 +481,44 @@ class Module(Element):
         """ Returns a list with the names of all existing actions attached to this module """
         return list(self._act)
 
+    def read_many(self, names: List[str]) -> List[Any]:
+        """ Returns the values of the variables with the given names, relative
+        to this module (ex: ['power', 'channel1.power']).
+        Uses the read_batch hook of the driver if available, see :meth:`read_variables` """
+        variables = []
+        for name in names:
+            element = self
+            for name_part in name.split('.'):
+                element = getattr(element, name_part)
+            variables.append(element)
+
+        return read_variables(variables)
+
     def get_names(self) -> List[str]:
         """ Returns the list of the names of all the elements of this module """
         return self.list_modules() + self.list_variables() + self.list_actions()
 
     def __getattr__(self, attr: str) -> Element:
-        if attr in self.list_variables(): return self.get_variable(attr)
-        if attr in self.list_actions(): return self.get_action(attr)
-        if attr in self.list_modules(): return self.get_module(attr)
+        # Use __dict__ to avoid infinite recursion if called before __init__
+        names = self.__dict__.get('_names')
+        if names is None: raise AttributeError(attr)
+        element = names.get(attr)
+        if element is not None: return element
         raise AttributeError(f"'{attr}' not found in module '{self.address()}'")
 
+    def get_elements(self) -> List[Element]:
+        """ Returns the list of all the elements (submodules, variables and actions)
+        attached to this module and its submodules """
+        elements = []
+
+        for mod in self._mod.values():
+            elements.append(mod)
+            elements += mod.get_elements()
+        elements += list(self._var.values())
+        elements += list(self._act.values())
+
+        return elements
+
     def get_structure(self) -> List[Tuple[str, str]]:
         """ Returns the structure of the module as a list containing each element address associated with its type as
         [['address1', 'variable'], ['address2', 'action'],...] """
@@ -455,3 +580,57 @@ class Module(Element):
         """ For auto-completion """
         return (self.list_modules() + self.list_variables()
                 + self.list_actions() + ['help', 'instance'])
+
+
+def has_read_batch(variable: Variable) -> bool:
+    """ Returns True if the driver of the variable provides a read_batch hook """
+    return callable(getattr(variable._root().instance, 'read_batch', None))
+
+
+def read_variables(variables: List[Variable],
+                   return_exceptions: bool = False) -> List[Any]:
+    """ Returns the values of the given variables.
+    Variables are grouped by device. If the driver class of a device has a
+    read_batch(names) function, it is called once with the list of the variable
+    addresses relative to the device (ex: ['power', 'channel1.power']) and must
+    return the list of their values in the same order (for example using a
+    single concatenated query). Otherwise the variables are read one by one.
+    If return_exceptions is True, a failed read doesn't stop the others and
+    its exception is returned in place of its value (for all the variables of
+    a failed read_batch call), so that no variable is read twice. """
+    results = [None] * len(variables)
+    groups = {}
+
+    for i, variable in enumerate(variables):
+        assert isinstance(variable, Variable), f"{variable} is not a Variable"
+        assert variable.readable, f"The variable {variable.address()} is not readable"
+        root = variable._root()
+        groups.setdefault(id(root), (root, []))[1].append(i)
+
+    for root, indexes in groups.values():
+        read_batch = getattr(root.instance, 'read_batch', None)
+
+        if len(indexes) == 1 or not callable(read_batch):
+            for i in indexes:
+                try:
+                    results[i] = variables[i]()
+                except Exception as e:
+                    if not return_exceptions: raise
+                    results[i] = e
+        else:
+            names = [variables[i].address()[len(root.name)+1: ] for i in indexes]
+            try:
+                answers = root._run(read_batch, names)
+                assert len(answers) == len(names), (
+                    f"Driver function read_batch of {root.address()} returned " \
+                    f"{len(answers)} values for {len(names)} variables")
+            except Exception as e:
+                if not return_exceptions: raise
+                for i in indexes: results[i] = e
+                continue
+
+            for i, answer in zip(indexes, answers):
+                variables[i]._process_read(answer)
+                results[i] = answer
+
+    return results
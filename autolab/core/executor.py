@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Per-device request executor.
+
+Serializes the calls made to a driver instance from the different threads of
+autolab (scan, monitors, control center, console). When the device is busy,
+pending requests are scheduled by priority (scan > monitor > GUI) and identical
+pending reads are folded into a single instrument round-trip.
+Requests are executed in the thread of the caller to keep the thread affinity
+of the drivers. Asyncio requests are executed in a worker thread dedicated to
+the device so that a slow instrument never blocks the others.
+"""
+
+import heapq
+import asyncio
+import itertools
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Awaitable
+
+
+# Priorities (lowest value is executed first)
+SCAN = 0
+MONITOR = 1
+GUI = 2
+
+_context = threading.local()
+
+
+def set_priority(priority: int):
+    """ Sets the priority of the requests made by the current thread """
+    _context.priority = priority
+
+
+def get_priority() -> int:
+    """ Returns the priority of the requests made by the current thread """
+    return getattr(_context, 'priority', GUI)
+
+
+class _Request:
+    """ Pending request waiting for the device to be free """
+
+    def __init__(self, priority: int, thread_id: int, key: Hashable = None):
+        self.priority = priority
+        self.thread_id = thread_id
+        self.key = key
+        self.turn = threading.Event()  # set when the request can be executed
+        self.done = threading.Event()  # set when the result is available
+        self.result = None
+        self.error = None
+
+    def get(self) -> Any:
+        self.done.wait()
+        if self.error is not None: raise self.error
+        return self.result
+
+
+class DeviceExecutor:
+    """ Serializes and schedules the requests made to a device """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._owner = None  # id of the thread currently using the device
+        self._pending = []  # heap of (priority, order, request)
+        self._keys = {}  # key -> pending request
+        self._order = itertools.count()
+        self._worker = None  # thread used by the asyncio requests, created on demand
+
+    def submit(self, function: Callable, *args,
+               key: Hashable = None, priority: int = None) -> Any:
+        """ Executes function(*args) once the device is free and returns its result.
+        If key is provided and an identical request is already pending,
+        waits for its result instead of executing function again. """
+        thread_id = threading.get_ident()
+
+        # Nested call from a driver function, the device is already owned
+        if self._owner == thread_id:
+            return function(*args)
+
+        if priority is None: priority = get_priority()
+
+        with self._lock:
+            if key is not None and key in self._keys:
+                folded = self._keys[key]
+                request = None
+                if priority < folded.priority:
+                    # Served with the best priority of its callers,
+                    # the previous heap entry is skipped in _release
+                    folded.priority = priority
+                    heapq.heappush(self._pending,
+                                   (priority, next(self._order), folded))
+            else:
+                folded = None
+                if self._owner is None:
+                    self._owner = thread_id
+                    request = None
+                else:
+                    request = _Request(priority, thread_id, key)
+                    heapq.heappush(self._pending,
+                                   (priority, next(self._order), request))
+                    if key is not None: self._keys[key] = request
+
+        if folded is not None:
+            return folded.get()
+
+        if request is not None:
+            request.turn.wait()
+
+        try:
+            result = function(*args)
+        except BaseException as e:
+            if request is not None:
+                request.error = e
+                request.done.set()
+            raise
+        else:
+            if request is not None:
+                request.result = result
+                request.done.set()
+            return result
+        finally:
+            self._release()
+
+    def _release(self):
+        """ Gives the device to the pending request with the highest priority """
+        with self._lock:
+            while self._pending:
+                priority, _, request = heapq.heappop(self._pending)
+                if priority != request.priority or request.turn.is_set():
+                    continue  # stale entry of a request whose priority was raised
+                if request.key is not None:
+                    self._keys.pop(request.key, None)
+                self._owner = request.thread_id
+                request.turn.set()
+                return None
+            self._owner = None
+
+    def is_busy(self) -> bool:
+        """ Returns True if a request is being executed """
+        return self._owner is not None
+
+    def submit_async(self, function: Callable, *args) -> Awaitable:
+        """ Executes function(*args) in the worker thread of the device and
+        returns an awaitable future. Must be called from a running event loop.
+        The priority of the calling thread is kept. """
+        with self._lock:
+            if self._worker is None:
+                self._worker = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix=f'autolab_{self.name}')
+            worker = self._worker
+
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(worker, functools.partial(
+            _call_with_priority, get_priority(), function, *args))
+
+    def shutdown(self):
+        """ Stops the worker thread used by the asyncio requests """
+        with self._lock:
+            worker = self._worker
+            self._worker = None
+        if worker is not None:
+            worker.shutdown(wait=False)
+
+
+def _call_with_priority(priority: int, function: Callable, *args) -> Any:
+    """ Executes function(*args) with the given priority for the current thread """
+    set_priority(priority)
+    return function(*args)
+
+
+def run_async(function: Callable, *args, **kwargs) -> Awaitable:
+    """ Executes function(*args, **kwargs) in the default executor of the
+    running event loop and returns an awaitable future """
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None, functools.partial(
+        _call_with_priority, get_priority(), function, *args, **kwargs))
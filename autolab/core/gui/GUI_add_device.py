@@ -10,8 +10,7 @@ from qtpy import QtCore, QtWidgets
 
 from .GUI_instances import clearAddDevice
 from .icons import icons
-from ..drivers import (list_drivers, load_driver_lib, get_connection_names,
-                       get_driver_class, get_connection_class, get_class_args)
+from ..drivers import list_drivers, get_driver_infos
 from ..config import get_all_devices_configs, save_config
 
 
@@ -195,10 +194,10 @@ class AddDeviceWindow(QtWidgets.QMainWindow):
         self.driverChanged()
 
         try:
-            driver_lib = load_driver_lib(driver_name)
+            driver_infos = get_driver_infos(driver_name)
         except: pass
         else:
-            list_conn = get_connection_names(driver_lib)
+            list_conn = list(driver_infos['connections'])
             if conn not in list_conn:
                 if list_conn:
                     self.setStatus(f"Connection {conn} not found, switch to {list_conn[0]}", 10000, False)
@@ -214,13 +213,10 @@ class AddDeviceWindow(QtWidgets.QMainWindow):
 
         # Used to remove default value
         try:
-            driver_lib = load_driver_lib(driver_name)
-            driver_class = get_driver_class(driver_lib)
-            assert hasattr(driver_class, 'slot_config')
+            slot_config = get_driver_infos(driver_name)['slot_config']
+            assert slot_config is not None
         except:
             slot_config = '<MODULE_NAME>'
-        else:
-            slot_config = f'{driver_class.slot_config}'
 
         # Update args
         for layout in (self.layoutDriverArgs, self.layoutDriverOtherArgs):
@@ -260,7 +256,7 @@ class AddDeviceWindow(QtWidgets.QMainWindow):
         self._prev_name = driver_name
 
         try:
-            driver_lib = load_driver_lib(driver_name)
+            driver_infos = get_driver_infos(driver_name)
         except Exception as e:
             # If error with driver remove all layouts
             self.setStatus(f"Can't load {driver_name}: {e}", 10000, False)
@@ -282,7 +278,7 @@ class AddDeviceWindow(QtWidgets.QMainWindow):
         self.setStatus('')
 
         # Update available connections
-        connections = get_connection_names(driver_lib)
+        connections = list(driver_infos['connections'])
         self.connectionComboBox.clear()
         self.connectionComboBox.addItems(connections)
 
@@ -296,16 +292,10 @@ class AddDeviceWindow(QtWidgets.QMainWindow):
 
         # used to skip doublon key
         conn = self.connectionComboBox.currentText()
-        try:
-            driver_instance = get_connection_class(driver_lib, conn)
-        except:
-            connection_args = {}
-        else:
-            connection_args = get_class_args(driver_instance)
+        connection_args = driver_infos['connections'].get(conn, {})
 
         # populate layoutDriverOtherArgs
-        driver_class = get_driver_class(driver_lib)
-        other_args = get_class_args(driver_class)
+        other_args = driver_infos['driver_args']
         for key, val in other_args.items():
             if key in connection_args: continue
             widget = QtWidgets.QLabel()
@@ -323,8 +313,8 @@ class AddDeviceWindow(QtWidgets.QMainWindow):
             layout.setParent(None)
 
         # populate layoutOptionalArg
-        if hasattr(driver_class, 'slot_config'):
-            self.addOptionalArgClicked('slot1', f'{driver_class.slot_config}')
+        if driver_infos['slot_config'] is not None:
+            self.addOptionalArgClicked('slot1', driver_infos['slot_config'])
             self.addOptionalArgClicked('slot1_name', 'my_<MODULE_NAME>')
 
     def connectionChanged(self):
@@ -336,12 +326,11 @@ class AddDeviceWindow(QtWidgets.QMainWindow):
 
         driver_name = self.driversComboBox.currentText()
         try:
-            driver_lib = load_driver_lib(driver_name)
+            driver_infos = get_driver_infos(driver_name)
         except:
             return None
 
-        connection_args = get_class_args(
-            get_connection_class(driver_lib, conn))
+        connection_args = driver_infos['connections'].get(conn, {})
 
         # reset layoutDriverArgs
         for i in reversed(range(self.layoutDriverArgs.count())):
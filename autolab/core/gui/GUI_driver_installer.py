@@ -12,7 +12,7 @@ from .icons import icons
 from .GUI_instances import clearDriverInstaller
 from ..paths import DRIVER_SOURCES, DRIVER_REPOSITORY
 from ..repository import install_drivers, _download_driver, _get_drivers_list_from_github
-from ..drivers import update_drivers_paths
+from ..drivers import update_drivers_paths, update_drivers_index
 
 
 class DriverInstaller(QtWidgets.QMainWindow):
@@ -130,7 +130,8 @@ class DriverInstaller(QtWidgets.QMainWindow):
             self.setStatus('Finished!', 5000)
 
         # Update available drivers
-        update_drivers_paths()
+        update_drivers_paths(force=True)
+        update_drivers_index()
 
     def closeEvent(self, event):
         """ This function does some steps before the window is really killed """
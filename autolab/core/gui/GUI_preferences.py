@@ -495,7 +495,7 @@ class PreferencesWindow(QtWidgets.QMainWindow):
         if (new_autolab_config['extra_driver_path']
                 != autolab_config['extra_driver_path']):
             add_extra_driver_path()
-            update_drivers_paths()
+            update_drivers_paths(force=True)
 
         if (new_autolab_config['control_center']['logger'] != autolab_config['control_center']['logger']
                 and hasattr(self.mainGui, 'activate_logger')):
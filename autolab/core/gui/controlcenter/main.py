@@ -37,8 +37,9 @@ from ..icons import icons
 from ...paths import PATHS
 from ...devices import list_devices, list_loaded_devices, Device, close
 from ...elements import Variable as Variable_og
-from ...elements import Action
-from ...config import get_control_center_config
+from ...elements import Action, read_variables
+from ...config import (get_control_center_config, add_config_listener,
+                       remove_config_listener, check_config_changes)
 from ...utilities import boolean, open_file
 from ...web import report, doc
 
@@ -132,6 +133,8 @@ class MyQTreeWidget(QtWidgets.QTreeWidget):
 class ControlCenter(QtWidgets.QMainWindow):
     """ Main Qt window, Used to control devices, open scanner... """
 
+    configChanged = QtCore.Signal(str)  # emitted from any thread by the config listener
+
     def __init__(self):
 
         # Set up the user interface.
@@ -167,6 +170,15 @@ class ControlCenter(QtWidgets.QMainWindow):
         self.timerQueue.timeout.connect(self._queueDriverHandler)
         self._stop_timerQueue = False
 
+        # Refresh the devices when devices_config.ini is saved or modified on disk
+        self.configChanged.connect(self.configChangedHandler)
+        self._config_listener = self.configChanged.emit
+        add_config_listener(self._config_listener)
+        self.timerConfig = QtCore.QTimer(self)
+        self.timerConfig.setInterval(2000) # ms
+        self.timerConfig.timeout.connect(check_config_changes)
+        self.timerConfig.start()
+
         # Import Autolab config
         control_center_config = get_control_center_config()
         logger_active = boolean(control_center_config['logger'])
@@ -485,6 +497,22 @@ class ControlCenter(QtWidgets.QMainWindow):
 
                 if dev_name in list_loaded_devices(): self.itemClicked(item)
 
+    def configChangedHandler(self, config_name: str):
+        """ Reloads the devices of the tree if their list has been modified
+        in devices_config.ini """
+        if config_name != 'devices_config': return None
+
+        try:
+            devices_name = list_devices()
+        except Exception as e:
+            self.setStatus(f'Error {e}', 10000, False)
+            return None
+
+        items_name = [self.tree.topLevelItem(i).name
+                      for i in range(self.tree.topLevelItemCount())]
+        if devices_name != items_name:
+            self.initialize()
+
     def setStatus(self, message: str, timeout: int = 0, stdout: bool = True):
         """ Modify the message displayed in the status bar and add error message to logger """
         self.statusBar.showMessage(message, timeout)
@@ -547,13 +575,14 @@ class ControlCenter(QtWidgets.QMainWindow):
         # load the entire module (submodules, variables, actions)
         item.load(module)
 
-        read_init_list = module._read_init_list
+        read_init_list = list(module._read_init_list)
         for mod in module._mod.values():
             read_init_list.extend(mod._read_init_list)
-        for variable in read_init_list:
-            try:
-                variable()
-            except:
+
+        # single driver call if read_batch available
+        results = read_variables(read_init_list, return_exceptions=True)
+        for variable, result in zip(read_init_list, results):
+            if isinstance(result, Exception):
                 self.setStatus(f"Can't read variable {variable.address()} on instantiation",
                                10000, False)
 
@@ -645,6 +674,8 @@ class ControlCenter(QtWidgets.QMainWindow):
 
         self.timerDevice.stop()
         self.timerQueue.stop()
+        self.timerConfig.stop()
+        remove_config_listener(self._config_listener)
 
         try:
             # Prevent 'RuntimeError: wrapped C/C++ object of type ViewBox has been deleted' when reloading gui
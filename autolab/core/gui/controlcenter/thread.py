@@ -12,9 +12,9 @@ from typing import Any
 from qtpy import QtCore, QtWidgets
 
 from ..GUI_utilities import qt_object_exists
-from ...devices import get_final_device_config, list_loaded_devices, DEVICES, Device
+from ...devices import (get_final_device_config, list_loaded_devices, DEVICES,
+                        Device, get_loading_pool, get_device_lock)
 from ...drivers import load_driver_lib, get_driver
-from ...variables import update_allowed_dict
 
 
 class ThreadManager:
@@ -137,28 +137,11 @@ class InteractionThread(QtCore.QThread):
             #     # Note that threadItemDict needs to be updated outside of thread to avoid timing error
             #     module = devices.get_device(self.item.name)  # Try to get / instantiated the device
             #     self.item.gui.threadDeviceDict[id(self.item)] = module
-            elif self.intType == 'load':  # OPTIMIZE: is very similar to get_device()
+            elif self.intType == 'load':
+                # Shares the pool of get_devices to bound the number of devices opened concurrently
+                device = get_loading_pool().submit(self.loadDevice).result()
                 # Note that threadItemDict needs to be updated outside of thread to avoid timing error
-                device_name = self.item.name
-                device_config = get_final_device_config(device_name)
-
-                if device_name in list_loaded_devices():
-                    assert device_config == DEVICES[device_name].device_config, 'You cannot change the configuration of an existing Device. Close it first & retry, or remove the provided configuration.'
-                else:
-                    driver_kwargs = {k: v for k, v in device_config.items() if k not in ['driver', 'connection']}
-                    driver_lib = load_driver_lib(device_config['driver'])
-
-                    if hasattr(driver_lib, 'Driver') and 'gui' in [param.name for param in inspect.signature(driver_lib.Driver.__init__).parameters.values()]:
-                            driver_kwargs['gui'] = self.item.gui
-
-                    instance = get_driver(
-                        device_config['driver'], device_config['connection'],
-                        **driver_kwargs)
-                    DEVICES[device_name] = Device(
-                        device_name, instance, device_config)
-                    update_allowed_dict()
-
-                self.item.gui.threadDeviceDict[id(self.item)] = DEVICES[device_name]
+                self.item.gui.threadDeviceDict[id(self.item)] = device
 
         except Exception as e:
             error = e
@@ -166,3 +149,27 @@ class InteractionThread(QtCore.QThread):
                 error = f'An error occured when loading device {self.item.name}: {str(e)}'
 
         self.endSignal.emit(error)
+
+    def loadDevice(self) -> Device:
+        """ Returns the device of the item, opening it if not already done """
+        # OPTIMIZE: is very similar to get_device()
+        device_name = self.item.name
+        device_config = get_final_device_config(device_name)
+
+        with get_device_lock(device_name):
+            if device_name in list_loaded_devices():
+                assert device_config == DEVICES[device_name].device_config, 'You cannot change the configuration of an existing Device. Close it first & retry, or remove the provided configuration.'
+            else:
+                driver_kwargs = {k: v for k, v in device_config.items() if k not in ['driver', 'connection']}
+                driver_lib = load_driver_lib(device_config['driver'])
+
+                if hasattr(driver_lib, 'Driver') and 'gui' in [param.name for param in inspect.signature(driver_lib.Driver.__init__).parameters.values()]:
+                        driver_kwargs['gui'] = self.item.gui
+
+                instance = get_driver(
+                    device_config['driver'], device_config['connection'],
+                    **driver_kwargs)
+                DEVICES[device_name] = Device(
+                    device_name, instance, device_config)
+
+            return DEVICES[device_name]
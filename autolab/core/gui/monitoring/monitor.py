@@ -15,6 +15,7 @@ from qtpy import QtCore, QtWidgets
 
 from ...variables import Variable
 from ...elements import Variable as Variable_og
+from ...executor import set_priority, MONITOR
 
 
 class MonitorManager:
@@ -81,6 +82,8 @@ class MonitorThread(QtCore.QThread):
         self.delay = 0
 
     def run(self):
+        # Monitor requests are executed after the scan ones on shared devices
+        set_priority(MONITOR)
 
         t_ini = time.time()
         pauseLength = 0
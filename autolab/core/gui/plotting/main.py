@@ -23,6 +23,7 @@ from ..GUI_utilities import get_font_size, setLineEditBackground, MyLineEdit
 from ..GUI_instances import clearPlotter, closePlotter
 from ...devices import list_devices
 from ...elements import Variable as Variable_og
+from ...elements import read_variables
 from ...variables import Variable
 from ...config import load_config
 
@@ -371,13 +372,13 @@ class Plotter(QtWidgets.QMainWindow):
         item.load(module)
         self.active_plugin_dict[item.nickname] = module
 
-        read_init_list = module._read_init_list
+        read_init_list = list(module._read_init_list)
         for mod in module._mod.values():
             read_init_list.extend(mod._read_init_list)
-        for variable in read_init_list:
-            try:
-                variable()
-            except:
+
+        results = read_variables(read_init_list, return_exceptions=True)
+        for variable, result in zip(read_init_list, results):
+            if isinstance(result, Exception):
                 self.setStatus(
                     f"Can't read variable {variable.address()} on instantiation",
                     10000, False)
@@ -4,7 +4,6 @@ Created on Sun Sep 29 18:16:09 2019
 
 @author: qchat
 """
-import configparser
 import json
 import datetime
 import os
@@ -20,12 +19,12 @@ from ...config import get_scanner_config
 from ...elements import Variable as Variable_og
 from ...elements import Action
 from ...devices import DEVICES, list_loaded_devices, get_element_by_address
-from ...utilities import (boolean, str_to_array, array_to_str, create_array,
-                          str_to_dataframe, dataframe_to_str, str_to_data,
-                          str_to_tuple)
+from ...utilities import array_to_str, create_array, dataframe_to_str
 from ...variables import (get_variable, has_eval, is_Variable, eval_variable,
                           remove_from_config, update_from_config, VARIABLES)
 from ...paths import PATHS
+from ...scanning.config import (read_config_file, create_config,
+                                get_config_variables)
 from .... import __version__
 
 
@@ -310,14 +309,6 @@ class ConfigManager:
         return self.recipeNameList()[-1] if len(self.recipeNameList()) != 0 else ""
 
     # set Param
-    def _defaultParameterPars(self) -> dict:
-        return {'name': 'parameter',
-                'address': 'None',
-                'nbpts': 1,
-                'start_value': 0,
-                'end_value': 0,
-                'log': False}
-
     def _addDefaultParameter(self, recipe_name: str):
         """ Adds a default parameter to the config"""
         parameter_name = self.getUniqueName(recipe_name, 'parameter')
@@ -898,22 +889,12 @@ class ConfigManager:
         if not self.gui.scanManager.isStarted():
             if os.path.exists(filename):
                 try:
-                    legacy_configPars = configparser.ConfigParser()
-                    legacy_configPars.read(filename)
-                except:
-                    try:
-                        with open(filename, "r") as read_file:
-                            configPars = json.load(read_file)
-                    except Exception as e:
-                        self.gui.setStatus(
-                            f"Impossible to load configuration file: {e}",
-                            10000, False)
-                        return None
-                else:
-                    print("ConfigParser depreciated, now use json. " \
-                          "Will convert this config to json if save it.")
-                    configPars = {s: dict(legacy_configPars.items(s))
-                                  for s in legacy_configPars.sections()}
+                    configPars = read_config_file(filename)
+                except Exception as e:
+                    self.gui.setStatus(
+                        f"Impossible to load configuration file: {e}",
+                        10000, False)
+                    return None
 
                 path = os.path.dirname(filename)
                 PATHS['last_folder'] = path
@@ -933,198 +914,10 @@ class ConfigManager:
         already_loaded_devices = list_loaded_devices()
 
         try:
-            # LEGACY <= 1.2
-            try:
-                LEGACY = (configPars["autolab"]["version"].startswith("1.0")
-                          or configPars["autolab"]["version"].startswith("1.1.")
-                          or configPars["autolab"]["version"] == "1.2")
-                if LEGACY:
-                    new_configPars = OrderedDict()
-                    new_configPars["autolab"] = configPars["autolab"]
-
-                    if 'initrecipe' in configPars:
-                        new_configPars["recipe_1"] = {}
-                        new_configPars["recipe_1"]['name'] = "init"
-                        new_configPars["recipe_1"]['active'] = "True"
-                        new_configPars["recipe_1"]['parameter'] = {}
-                        new_configPars["recipe_1"]['parameter']["parameter_1"] = self._defaultParameterPars()
-                        new_configPars["recipe_1"]['parameter']["parameter_1"]['name'] = 'init'
-                        new_configPars["recipe_1"]['recipe'] = configPars['initrecipe']
-
-                    new_configPars["recipe_2"] = {}
-                    new_configPars["recipe_2"]['name'] = "recipe_1"
-                    new_configPars["recipe_2"]['active'] = "True"
-                    new_configPars["recipe_2"]['parameter'] = {}
-                    new_configPars["recipe_2"]['parameter']["parameter_1"] = configPars['parameter']
-                    new_configPars["recipe_2"]['recipe'] = configPars['recipe']
-
-                    if 'endrecipe' in configPars:
-                        new_configPars["recipe_3"] = {}
-                        new_configPars["recipe_3"]['name'] = "end"
-                        new_configPars["recipe_3"]['active'] = "True"
-                        new_configPars["recipe_3"]['parameter'] = {}
-                        new_configPars["recipe_3"]['parameter']["parameter_1"] = self._defaultParameterPars()
-                        new_configPars["recipe_3"]['parameter']['name'] = 'end'
-                        new_configPars["recipe_3"]['recipe'] = configPars['endrecipe']
-
-                    configPars = new_configPars
-            except: pass
-
-            # Config
-            config = OrderedDict()
-            # to remove 'autolab' and 'variables' from recipe list
-            recipeNameList = [i for i in list(configPars)
-                              if i not in ('autolab', 'variables')]
-
-            for recipe_num_name in recipeNameList:
-
-                pars_recipe_i = configPars[recipe_num_name]
-
-                if 'name' in pars_recipe_i:
-                    recipe_name = pars_recipe_i['name']
-                else:
-                    recipe_name = recipe_num_name  # LEGACY <= 2.0b1
-
-                config[recipe_name] = OrderedDict()
-                recipe_i = config[recipe_name]
-
-                recipe_i['name'] = recipe_name
-
-                if 'active' in pars_recipe_i:
-                    recipe_i['active'] = boolean(pars_recipe_i['active'])
-                else:
-                    recipe_i['active'] = True  # LEGACY <= 1.2.1
-
-                assert 'parameter' in pars_recipe_i, (
-                    f'Missing parameter in {recipe_name}')
-
-                param_list = recipe_i['parameter'] = []
-
-                # LEGACY <= 1.2.1
-                if len(pars_recipe_i['parameter']) != 0:
-                    if not isinstance(
-                            list(pars_recipe_i['parameter'].values())[0],
-                            dict):
-                        pars_recipe_i['parameter'] = {
-                            'parameter_1': pars_recipe_i['parameter']}
-
-                for param_pars_name in pars_recipe_i['parameter']:
-                    param_pars = pars_recipe_i['parameter'][param_pars_name]
-
-                    param = {}
-
-                    assert 'name' in param_pars, (
-                        f"Missing name to {param_pars}")
-                    param['name'] = param_pars['name']
-
-                    assert 'address' in param_pars, (
-                        f"Missing address to {param_pars}")
-                    if param_pars['address'] == "None": element = None
-                    else:
-                        device_name = param_pars['address'].split('.')[0]
-                        element = self.ask_get_element_by_address(device_name, param_pars['address'])
-
-                    param['element'] = element
-
-                    if 'values' in param_pars:
-                        if has_eval(param_pars['values']):
-                            values = param_pars['values']
-                        else:
-                            values = str_to_array(param_pars['values'])
-                        if not has_eval(values):
-                            assert np.ndim(values) == 1, (
-                                f"Values must be one dimension array in parameter: {param['name']}")
-                        param['values'] = values
-                    else:
-                        for key in ['nbpts', 'start_value', 'end_value', 'log']:
-                            assert key in param_pars, "Missing parameter key {key}."
-
-                        param['nbpts'] = int(param_pars['nbpts'])
-                        start = float(param_pars['start_value'])
-                        end = float(param_pars['end_value'])
-                        param['range'] = (start, end)
-                        param['log'] = bool(int(param_pars['log']))
-
-                        if param['nbpts'] > 1:
-                            param['step'] = abs(end - start) / (param['nbpts'] - 1)
-                        else:
-                            param['step'] = 0
+            config = create_config(
+                configPars, get_element=lambda address: self.ask_get_element_by_address(
+                    address.split('.')[0], address))
 
-                    param_list.append(param)
-
-                recipe_i['recipe'] = []
-                recipe = recipe_i['recipe']
-                pars_recipe = pars_recipe_i['recipe']
-
-                while True:
-                    step = {}
-                    i = len(recipe) + 1
-
-                    if f'{i}_name' in pars_recipe:
-                        step['name'] = pars_recipe[f'{i}_name']
-                        name = step['name']
-
-                        assert f'{i}_steptype' in pars_recipe, (
-                            f"Missing stepType in step {i} ({name}).")
-                        step['stepType'] = pars_recipe[f'{i}_steptype']
-
-                        assert f'{i}_address' in pars_recipe, (
-                            f"Missing address in step {i} ({name}).")
-                        address = pars_recipe[f'{i}_address']
-
-                        if step['stepType'] == 'recipe':
-                            assert step['stepType'] != 'recipe', (
-                                "Removed the recipe in recipe feature!")
-                            element = address
-                        else:
-                            device_name = address.split('.')[0]
-                            element = self.ask_get_element_by_address(device_name, address)
-
-                        step['element'] = element
-
-                        if (step['stepType'] == 'set') or (
-                                step['stepType'] == 'action' and element.type in [
-                                    int, float, bool, str, bytes, tuple,
-                                    np.ndarray, pd.DataFrame]):
-                            assert f'{i}_value' in pars_recipe, (
-                                f"Missing value in step {i} ({name}).")
-                            value = pars_recipe[f'{i}_value']
-
-                            try:
-                                try:
-                                    assert has_eval(value), (
-                                        "Need $eval: to evaluate the given string")
-                                except:
-                                    # Type conversions
-                                    if element.type in [int]:
-                                        value = int(value)
-                                    elif element.type in [float]:
-                                        value = float(value)
-                                    elif element.type in [str]:
-                                        value = str(value)
-                                    elif element.type in [bytes]:
-                                        value = value.encode()
-                                    elif element.type in [bool]:
-                                        value = boolean(value)
-                                    elif element.type in [tuple]:
-                                        value = str_to_tuple(value)
-                                    elif element.type in [np.ndarray]:
-                                        value = str_to_array(value)
-                                    elif element.type in [pd.DataFrame]:
-                                        value = str_to_dataframe(value)
-                                    else:
-                                        assert has_eval(value), (
-                                            "Need $eval: to evaluate the given string")
-                            except:
-                                raise ValueError(f"Error with {i}_value = {value}. Expect either {element.type} or device address. Check address or open device first.")
-
-                            step['value'] = value
-                        else:
-                            step['value'] = None
-
-                        recipe.append(step)
-                    else:
-                        break
             if append:
                 for conf in config.values():
                     recipe_name = conf['name']
@@ -1138,15 +931,7 @@ class ConfigManager:
                 self.config = config
 
             if 'variables' in configPars:
-                var_dict = configPars['variables']
-
-                add_vars = []
-                for var_name, raw_value in var_dict.items():
-                    if not has_eval(raw_value):
-                        raw_value = str_to_data(raw_value)
-                    add_vars.append((var_name, raw_value))
-
-                update_from_config(add_vars)
+                update_from_config(get_config_variables(configPars))
 
         except Exception as error:
             self._got_error = True
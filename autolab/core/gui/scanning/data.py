@@ -5,13 +5,12 @@ Created on Sun Sep 29 18:10:31 2019
 @author: qchat
 """
 
-from collections import OrderedDict
 from queue import Queue
 import os
-import shutil
 import tempfile
 import sys
 import random
+import time
 from typing import List, Union
 
 import numpy as np
@@ -21,6 +20,7 @@ from qtpy import QtCore, QtWidgets
 from ...config import get_scanner_config
 from ...utilities import boolean, create_array, data_to_dataframe
 from ...variables import has_eval, eval_safely
+from ...scanning.data import Dataset, ScanSet, create_scanset
 
 
 class DataManager:
@@ -34,6 +34,7 @@ class DataManager:
 
         scanner_config = get_scanner_config()
         self.save_temp = boolean(scanner_config["save_temp"])
+        self.memory_budget = float(scanner_config["memory_budget"]) * 1e6  # MB
 
         # Timer
         self.timer = QtCore.QTimer(self.gui)
@@ -52,6 +53,7 @@ class DataManager:
                 scanset = self.datasets[-(i+1)]
                 if recipe_name not in scanset: continue
                 if not scanset.display: continue
+                scanset.last_used = time.monotonic()
                 dataset = scanset[recipe_name]
                 data = None
 
@@ -103,13 +105,28 @@ class DataManager:
         """ Returns the last selected dataset """
         index = self.gui.data_comboBox.currentIndex()
         if index != -1 and index < len(self.datasets):
-            return self.datasets[index]
+            scanset = self.datasets[index]
+            scanset.last_used = time.monotonic()
+            return scanset
         return None
 
+    def checkMemory(self):
+        """ Moves the data of the least recently displayed scans in the temp
+        folder if the scans exceed the memory budget. The last scan is kept in
+        memory. The spilled data are read back from the disk when displayed """
+        if self.memory_budget <= 0: return None
+
+        total = sum(scanset.memory_size() for scanset in self.datasets)
+        if total <= self.memory_budget: return None
+
+        for scanset in sorted(self.datasets[:-1],
+                              key=lambda scanset: scanset.last_used):
+            total -= scanset.spill()
+            if total <= self.memory_budget: break
+
     def newDataset(self, config: dict):
         """ Creates and returns a new empty dataset """
         maximum = 0
-        scanset = ScanSet()
 
         if self.save_temp:
             FOLDER_TEMP = os.environ['TEMP']  # This variable can be changed at autolab start-up
@@ -119,16 +136,12 @@ class DataManager:
         else:
             folder_dataset_temp = str(random.random())
 
+        scanset = create_scanset(config, folder_dataset_temp,
+                                 save_temp=self.save_temp)
+
         for recipe_name, recipe in config.items():
 
             if recipe['active']:
-                sub_folder = os.path.join(folder_dataset_temp, recipe_name)
-                if self.save_temp: os.mkdir(sub_folder)
-
-                dataset = Dataset(sub_folder, recipe_name,
-                                  config, save_temp=self.save_temp)
-                scanset[recipe_name] = dataset
-
                 # bellow just to know maximum point
                 nbpts = 1
                 for parameter in recipe['parameter']:
@@ -177,6 +190,7 @@ class DataManager:
 
         self.datasets.append(scanset)
         self.gui.progressBar.setMaximum(maximum)
+        self.checkMemory()
 
     def sync(self):
         """ This function sync the last dataset with the data available in the queue """
@@ -289,215 +303,3 @@ class DataManager:
                 if variable_y_index != -1:
                     self.gui.variable_y_comboBox.setCurrentIndex(variable_y_index)
         return None
-
-
-class Dataset():
-    """ Collection of data from a recipe """
-    def __init__(self, folder_dataset_temp: str, recipe_name: str, config: dict,
-                 save_temp: bool = True):
-        self._data_temp = []
-        self.recipe_name = recipe_name
-        self.folders = []
-        self.data_arrays = {}
-        self.folder_dataset_temp = folder_dataset_temp
-        self.new = True
-        self.save_temp = save_temp
-
-        recipe = config[self.recipe_name]
-        list_recipe = [recipe]
-        list_recipe_new = [recipe]
-        has_sub_recipe = True
-
-        while has_sub_recipe:  # OBSOLETE
-            has_sub_recipe = False
-            recipe_list = list_recipe_new
-
-            for recipe_i in recipe_list:
-                for step in recipe_i['recipe']:
-                    if step['stepType'] == "recipe":
-                        has_sub_recipe = True
-                        other_recipe = config[step['element']]
-                        list_recipe_new.append(other_recipe)
-                        list_recipe.append(other_recipe)
-
-                list_recipe_new.remove(recipe_i)
-
-        list_param = [recipe['parameter'] for recipe in list_recipe]
-        self.list_param = sum(list_param, [])
-
-        list_step = [recipe['recipe'] for recipe in list_recipe]
-        self.list_step = sum(list_step, [])
-
-        self.header = (["id"]
-                       + [step['name'] for step in self.list_param]
-                       + [step['name'] for step in self.list_step if (
-                           step['stepType'] == 'measure'
-                           and step['element'].type in [int, float, bool])]
-                       )
-        self.data = pd.DataFrame(columns=self.header)
-
-    def getData(self, var_list: List[str], data_name: str = "Scan",
-                dataID: int = 0, filter_condition: List[dict] = []) -> pd.DataFrame:
-        """ This function returns a dataframe with two columns : the parameter value,
-        and the requested result value """
-        if data_name == "Scan":
-            data = self.data
-        else:
-            data = self.data_arrays[data_name][dataID]
-
-            if (data is not None
-                    and not isinstance(data, str)
-                    and (len(data.T.shape) == 1 or (
-                        len(data.T.shape) != 0 and data.T.shape[0] == 2))):
-                data = data_to_dataframe(data)
-            else:  # Image
-                return data
-
-        # Add var for filtering
-        for var_filter in filter_condition:
-            if var_filter['enable']:
-                if (var_filter['name'] not in var_list
-                        and var_filter['name'] != ''
-                        and var_filter['name'] is not None):
-                    var_list.append(var_filter['name'])
-                elif isinstance(var_filter['condition'], str):
-                    for key in self.header:
-                        if key in var_filter['condition']:
-                            var_list.append(key)
-
-        if any(map(lambda v: v in var_list, list(data.columns))):
-            data = data.loc[:,~data.columns.duplicated()].copy()  # unique data column
-            unique_var_list = list(dict.fromkeys(var_list))  # unique var_list
-            # Filter data
-            for var_filter in filter_condition:
-                if var_filter['enable']:
-                    if var_filter['name'] in data:
-                        filter_cond = var_filter['condition']
-                        filter_name = var_filter['name']
-                        filter_value = var_filter['value']
-                        mask = filter_cond(data[filter_name], filter_value)
-                        data = data[mask]
-                    elif isinstance(var_filter['condition'], str):
-                        filter_cond = var_filter['condition']
-                        if filter_cond:
-                            try:
-                                data = data.query(filter_cond)
-                            except:
-                                # If error, output empty dataframe
-                                data = pd.DataFrame(columns=self.header)
-                                break
-
-            return data.loc[:,unique_var_list]
-
-        return None
-
-    def save(self, filename: str):
-        """ This function saved the dataset in the provided path """
-        dataset_folder = os.path.splitext(filename)[0]
-        data_name = os.path.join(self.folder_dataset_temp, 'data.txt')
-
-        if os.path.exists(data_name):
-            shutil.copy(data_name, filename)
-        else:
-            self.data.to_csv(filename, index=False, header=self.header)
-
-        if self.folders:
-            if not os.path.exists(dataset_folder): os.mkdir(dataset_folder)
-            for tmp_folder in self.folders:
-                array_name = os.path.basename(tmp_folder)
-                dest_folder = os.path.join(dataset_folder, array_name)
-
-                if os.path.exists(tmp_folder):
-                    try:
-                        shutil.copytree(tmp_folder, dest_folder,
-                                        dirs_exist_ok=True)  # python >=3.8 only
-                    except:
-                        if os.path.exists(dest_folder):
-                            shutil.rmtree(dest_folder, ignore_errors=True)
-                        shutil.copytree(tmp_folder, dest_folder)
-                else:
-                    # This is only executed if no temp folder is set
-                    if not os.path.exists(dest_folder): os.mkdir(dest_folder)
-
-                    if array_name in self.data_arrays:
-                        list_data = self.data_arrays[array_name]  # data is list representing id 1,2
-
-                        for i, value in enumerate(list_data):
-                            path = os.path.join(dest_folder, f"{i+1}.txt")
-
-                            if isinstance(value, (int, float, bool, str, tuple)):
-                                with open(path, 'w') as f: f.write(str(value))
-                            elif isinstance(value, bytes):
-                                with open(path, 'wb') as f: f.write(value)
-                            elif isinstance(value, np.ndarray):
-                                df = pd.DataFrame(value)
-                                df.to_csv(path, index=False, header=None)  # faster and handle better different dtype than np.savetxt
-                            elif isinstance(value, pd.DataFrame):
-                                value.to_csv(path, index=False)
-
-    def addPoint(self, dataPoint: OrderedDict):
-        """ This function add a data point (parameter value, and results) in the dataset """
-        ID = len(self.data) + 1
-        simpledata = OrderedDict()
-        simpledata['id'] = ID
-
-        for result_name, result in dataPoint.items():
-
-            if result_name == 0: continue  # skip first result which is recipe_name
-
-            elements = [step['element'] for step in (
-                self.list_param+self.list_step) if step['name']==result_name]
-            element = elements[0]
-            # should always find exactly one element in list above
-
-            # If the result is displayable (numerical), keep it in memory
-            if element is None or element.type in [int, float, bool]:
-                simpledata[result_name] = result
-            else : # Else write it on a file, in a temp directory
-                results_folder = os.path.join(self.folder_dataset_temp, result_name)
-
-                if self.save_temp:
-                    if not os.path.exists(results_folder): os.mkdir(results_folder)
-                    result_path = os.path.join(results_folder, f'{ID}.txt')
-
-                    if element is not None:
-                        element.save(result_path, value=result)
-
-                if results_folder not in self.folders:
-                    self.folders.append(results_folder)
-
-                if self.data_arrays.get(result_name) is None:
-                    self.data_arrays[result_name] = []
-
-                self.data_arrays[result_name].append(result)
-
-        self._data_temp.append(simpledata)
-        self.data = pd.DataFrame(self._data_temp, columns=self.header)
-
-        if self.save_temp:
-            if not os.path.exists(self.folder_dataset_temp):
-                print(f'Warning: {self.folder_dataset_temp} has been created ' \
-                      'but should have been created earlier. ' \
-                      'Check that you have not lost any data',
-                      file=sys.stderr)
-                os.mkdir(self.folder_dataset_temp)
-            if ID == 1:
-                self.data.tail(1).to_csv(
-                    os.path.join(self.folder_dataset_temp, 'data.txt'),
-                    index=False, mode='a', header=self.header)
-            else:
-                self.data.tail(1).to_csv(
-                    os.path.join(self.folder_dataset_temp, 'data.txt'),
-                    index=False, mode='a', header=False)
-
-    def __len__(self):
-        """ Returns the number of data point of this dataset """
-        return len(self.data)
-
-
-class ScanSet(dict):
-    """ Collection of data from a scan """
-    # TODO: use this in scan plot
-    display = True
-    color = 'default'
-    saved = False
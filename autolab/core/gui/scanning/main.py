@@ -24,6 +24,7 @@ from ..GUI_instances import openVariablesMenu, openPlotter
 from ...paths import PATHS
 from ...utilities import boolean, SUPPORTED_EXTENSION
 from ...config import get_scanner_config, load_config, change_autolab_config
+from ...scanning.container import is_hdf5, save_scan
 
 
 class Scanner(QtWidgets.QMainWindow):
@@ -449,7 +450,7 @@ class Scanner(QtWidgets.QMainWindow):
         filename = QtWidgets.QFileDialog.getSaveFileName(
             self,  caption="Save data",
             directory=PATHS['last_folder'],
-            filter=SUPPORTED_EXTENSION)[0]
+            filter=SUPPORTED_EXTENSION + ";; HDF5 Files (*.hdf5 *.h5)")[0]
         path = os.path.dirname(filename)
 
         save_folder, extension = os.path.splitext(filename)
@@ -469,6 +470,16 @@ class Scanner(QtWidgets.QMainWindow):
                     scan_filename = f'{save_folder}_{scan_name}'
                     new_configname = f'{save_folder}_{scan_name}.conf'
 
+                if is_hdf5(filename):
+                    # Single file with all the recipes and the scan config
+                    try:
+                        save_scan(scanset, f'{scan_filename}{extension}')
+                    except Exception as e:
+                        self.setStatus(f'Error while saving {scan_name}: {e}', 10000, False)
+                        return None
+                    scanset.saved = True
+                    continue
+
                 for recipe_name in scanset:
                     dataset = scanset[recipe_name]
 
@@ -6,21 +6,15 @@ Created on Sun Sep 29 18:08:45 2019
 """
 
 import os
-import time
-import math as m
-import threading
-from collections import OrderedDict
 from queue import Queue
-from itertools import product
 
-import numpy as np
 from qtpy import QtCore, QtWidgets
 
 from ..GUI_utilities import qt_object_exists, MyInputDialog, MyFileDialog
 from ..GUI_instances import instances
 from ...paths import PATHS
-from ...variables import eval_variable, set_variable, has_eval
-from ...utilities import create_array
+from ...variables import eval_variable, has_eval
+from ...scanning.engine import ScanEngine
 
 
 class ScanManager:
@@ -268,6 +262,11 @@ class ScanManager:
         self.gui.configManager.updateUndoRedoButtons()
         self.gui.dataManager.timer.stop()
         self.gui.dataManager.sync() # once again to be sure we grabbed every data
+        try:
+            self.gui.dataManager.getLastDataset().close()  # write the buffered data
+        except Exception as e:
+            self.gui.setStatus(f'Scan data error: {e}', 10000, False)
+        self.gui.dataManager.checkMemory()
         self.thread = None
         self.gui.refresh_widget(self.gui.stop_pushButton)
 
@@ -312,6 +311,7 @@ class ScanManager:
         self.thread.pauseFlag.set()
         self.gui.dataManager.timer.stop()
         self.gui.dataManager.sync() # once again to be sure we grabbed every data
+        self.gui.dataManager.getLastDataset().flush()
         self.gui.pause_pushButton.setText('Resume')
 
     def resume(self):
@@ -328,8 +328,8 @@ class ScanManager:
 
 
 class ScanThread(QtCore.QThread):
-    """ This thread class is dedicated to read the variable,
-        and send its data to GUI through a queue """
+    """ This thread class runs the scan engine (see :class:`ScanEngine`),
+        sends its data to GUI through a queue and its progress through signals """
     # Signals
     userSignal = QtCore.Signal(dict)
     errorSignal = QtCore.Signal(object)
@@ -348,180 +348,28 @@ class ScanThread(QtCore.QThread):
         self.config = config
         self.queue = queue
 
-        self.pauseFlag = threading.Event()
-        self.stopFlag = threading.Event()
-
-        self.user_response = None
+        self.engine = ScanEngine(config)
+        self.pauseFlag = self.engine.pauseFlag
+        self.stopFlag = self.engine.stopFlag
+
+        self.engine.connect('point', self.queue.put)
+        self.engine.connect('error', self.errorSignal.emit)
+        self.engine.connect('user_input', self.userSignal.emit)
+        self.engine.connect('parameter_started', self.startParameterSignal.emit)
+        self.engine.connect('parameter_finished', self.finishParameterSignal.emit)
+        self.engine.connect('parameter_completed', self.parameterCompletedSignal.emit)
+        self.engine.connect('step_started', self.startStepSignal.emit)
+        self.engine.connect('step_finished', self.finishStepSignal.emit)
+        self.engine.connect('recipe_completed', self.recipeCompletedSignal.emit)
+        self.engine.connect('scan_completed', self.scanCompletedSignal.emit)
+
+    @property
+    def user_response(self):
+        return self.engine.user_response
+
+    @user_response.setter
+    def user_response(self, value):
+        self.engine.user_response = value
 
     def run(self):
-        # Start the scan
-        for recipe_name in self.config:
-            if self.config[recipe_name]['active']: self.execRecipe(recipe_name)
-
-        self.scanCompletedSignal.emit()
-
-    def execRecipe(self, recipe_name: str,
-                   initPoint: OrderedDict = None):
-        """ Executes a recipe. initPoint is obsolete, was used to add parameters values
-        and master-recipe name to a sub-recipe """
-
-        paramValues_list = []
-
-
-        for parameter in self.config[recipe_name]['parameter']:
-            param_name = parameter['name']
-
-            if 'values' in parameter:
-                paramValues = parameter['values']
-                try:
-                    paramValues = eval_variable(paramValues)
-                    paramValues = create_array(paramValues)
-                except Exception as e:
-                    self.errorSignal.emit(e)
-                    self.stopFlag.set()
-            else:
-                startValue, endValue = parameter['range']
-                nbpts = parameter['nbpts']
-                logScale = parameter['log']
-
-                # Creates the array of values for the parameter
-                if logScale:
-                    paramValues = np.logspace(m.log10(startValue), m.log10(endValue), nbpts, endpoint=True)
-                else:
-                    paramValues = np.linspace(startValue, endValue, nbpts, endpoint=True)
-
-            set_variable(param_name, paramValues[0])
-            paramValues_list.append(paramValues)
-
-        ID = 0
-        # iter over each parameter (do once if no parameter!)
-        for i, paramValueList in enumerate(product(*paramValues_list)):
-
-            if not self.stopFlag.is_set():
-
-                if initPoint is None:  # OBSOLETE
-                    initPoint = OrderedDict()
-                    initPoint[0] = recipe_name
-
-                initPointStep = initPoint.copy()
-
-                try:
-                    self._source_of_error = None
-                    ID += 1
-                    set_variable('ID', ID)
-
-                    for parameter, paramValue in zip(
-                            self.config[recipe_name]['parameter'], paramValueList):
-                        self._source_of_error = parameter
-                        element = parameter['element']
-                        param_name = parameter['name']
-
-                        set_variable(param_name, element.type(
-                                paramValue) if element is not None else paramValue)
-
-                        # Set the parameter value
-                        self.startParameterSignal.emit(recipe_name, param_name)
-                        if element is not None: element(paramValue)
-                        self.finishParameterSignal.emit(recipe_name, param_name)
-
-                        initPointStep[param_name] = paramValue
-
-                    dataPoint = initPointStep.copy()
-
-                    # Start the recipe
-                    dataPoint = self.processStep(
-                        recipe_name, dataPoint, initPointStep)
-                    # Send the whole data in the queue
-                    if not self.stopFlag.is_set(): self.queue.put(dataPoint)
-
-                except Exception as e:
-                    # If an error occurs, stop the scan and send an error signal
-                    name = self._source_of_error['name']
-                    if self._source_of_error['element'] is not None:
-                        address = f"='{self._source_of_error['element'].address()}'"
-                    else: address = ''
-
-                    try:
-                        from pyvisa import VisaIOError
-                    except:
-                        e = f"In recipe '{recipe_name}' for step '{name}': {e}"
-                    else:
-                        if str(e) == str(VisaIOError(-1073807339)):
-                            e = f"Timeout reached for device {address}. Acquisition time may be too long. If so, you can increase timeout delay in the driver to avoid this error."
-                        else:
-                            e = f"In recipe '{recipe_name}' for step '{name}': {e}"
-
-                    self.errorSignal.emit(e)
-                    self.stopFlag.set()
-
-                # Wait until the scan is no more in pause
-                while self.pauseFlag.is_set():
-                    time.sleep(0.1)
-            else:
-                break
-
-        for parameter in self.config[recipe_name]['parameter']:
-            self.parameterCompletedSignal.emit(recipe_name, parameter['name'])
-
-    def processStep(self, recipe_name: str,
-                    dataPoint: OrderedDict,
-                    initPoint: OrderedDict):
-        """ Executes the recipe step """
-        for stepInfos in self.config[recipe_name]['recipe']:
-            self._source_of_error = stepInfos
-
-            if not self.stopFlag.is_set():
-                # Process the recipe step
-                result = self.processElement(recipe_name, stepInfos, initPoint)
-
-                if result is not None:
-                    dataPoint[stepInfos['name']] = result
-
-                # Wait until the scan is no more in pause
-                while self.pauseFlag.is_set():
-                    time.sleep(0.1)
-            else:
-                break
-
-        self.recipeCompletedSignal.emit(recipe_name)
-        return dataPoint
-
-    def processElement(self, recipe_name: str, stepInfos: dict,
-                       initPoint: OrderedDict):
-        """ Processes the recipe step """
-        element = stepInfos['element']
-        stepType = stepInfos['stepType']
-        self.startStepSignal.emit(recipe_name, stepInfos['name'])
-        result = None
-
-        if stepType == 'measure':
-            result = element()
-            set_variable(stepInfos['name'], result)
-        elif stepType == 'set':
-            value = eval_variable(stepInfos['value'])
-            if element.type in [bytes] and isinstance(value, str): value = value.encode()
-            if element.type in [np.ndarray]: value = create_array(value)
-            element(value)
-        elif stepType == 'action':
-            if stepInfos['value'] is not None:
-                # Open dialog for open file, save file or input text
-                if isinstance(stepInfos['value'], str) and stepInfos['value'] == '':
-                    self.userSignal.emit(stepInfos)
-                    while (not self.stopFlag.is_set()
-                           and self.user_response is None):
-                        time.sleep(0.1)
-                    if not self.stopFlag.is_set():
-                        element(self.user_response)
-                    self.user_response = None
-                else:
-                    value = eval_variable(stepInfos['value'])
-                    if element.type in [bytes] and isinstance(value, str): value = value.encode()
-                    if element.type in [np.ndarray]: value = create_array(value)
-                    element(value)
-            else:
-                element()
-        elif stepType == 'recipe':  # OBSOLETE
-            self.execRecipe(element, initPoint=initPoint)  # Execute a recipe in the recipe
-
-        self.finishStepSignal.emit(recipe_name, stepInfos['name'])
-        return result
+        self.engine.run()
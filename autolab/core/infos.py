@@ -3,6 +3,7 @@ import sys
 
 from .config import get_device_config
 from .drivers import (update_drivers_paths, DRIVERS_PATHS, get_driver_category,
+                      update_drivers_index,
                       load_driver_lib, get_connection_names, get_class_args,
                       get_connection_class, get_driver_class, get_module_names,
                       get_module_class)
@@ -18,6 +19,7 @@ def _list_drivers(_print: bool = True) -> str:
     ''' Returns a list of all the drivers with categories by sections
     (autolab drivers, local drivers) '''
     update_drivers_paths()
+    update_drivers_index()  # categories are read without importing the drivers
 
     s = '\n'
     s += f'{len(DRIVERS_PATHS)} drivers found\n\n'
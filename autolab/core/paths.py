@@ -17,6 +17,8 @@ DEVICES_CONFIG = os.path.join(USER_FOLDER, 'devices_config.ini')
 AUTOLAB_CONFIG = os.path.join(USER_FOLDER, 'autolab_config.ini')
 PLOTTER_CONFIG = os.path.join(USER_FOLDER, 'plotter_config.ini')
 HISTORY_CONFIG = os.path.join(USER_FOLDER, '.history_config.txt')
+DRIVERS_INDEX = os.path.join(USER_FOLDER, '.drivers_index.json')
+VERSION_ADAPTER = os.path.join(USER_FOLDER, '.version_adapter.txt')
 
 # Drivers locations
 DRIVERS = os.path.join(USER_FOLDER, 'drivers')
@@ -35,6 +37,7 @@ PATHS = {'autolab_folder': AUTOLAB_FOLDER, 'version': VERSION,
          'user_folder': USER_FOLDER, 'drivers': DRIVERS,
          'devices_config': DEVICES_CONFIG, 'autolab_config': AUTOLAB_CONFIG,
          'plotter_config': PLOTTER_CONFIG, 'history_config': HISTORY_CONFIG,
+         'drivers_index': DRIVERS_INDEX, 'version_adapter': VERSION_ADAPTER,
          'last_folder': LAST_FOLDER}
 
 # Storage of the drivers paths
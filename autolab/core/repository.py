@@ -15,7 +15,7 @@ import json
 from typing import Union, Tuple
 
 from .paths import DRIVER_SOURCES, DRIVER_REPOSITORY
-from .drivers import update_drivers_paths
+from .drivers import update_drivers_paths, clear_driver_cache
 from .utilities import input_wrap
 from .gitdir import download
 
@@ -181,7 +181,8 @@ def install_drivers(*repo_url: Union[None, str, Tuple[str, str]],
     os.rmdir(temp_repo_folder)
 
     # Update available drivers
-    update_drivers_paths()
+    update_drivers_paths(force=True)
+    clear_driver_cache()
 
 
 # =============================================================================
@@ -224,6 +225,7 @@ def _download_driver(url, driver_name, output_dir, _print=True):
         # Too slow to be used for full repo, only use it for one or 2 drivers
         # 'HTTP Error 403: rate limit exceeded' due to too much download if don't have github account
         download(driver_url, output_dir=output_dir, _print=_print)
+        clear_driver_cache()
     except:  # if use Exception, crash python when having error
         e = f"Error when downloading driver '{driver_name}'"
         if _print:
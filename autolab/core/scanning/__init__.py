@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""
+Scan execution independent of the GUI: parsing of the scan configuration
+files, scan engine and storage of the scan data
+"""
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Binary storage of the array and DataFrame results of a scan
+"""
+
+import os
+import sys
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Union
+
+import numpy as np
+import pandas as pd
+
+
+class ArrayStore:
+    """ Append-only storage of the array or DataFrame results of a scan in
+    binary chunks of chunk_size points (.npz files, compressed if compress).
+    A chunk is also written once its first value is flush_time seconds old.
+    Values are copied when stored, keep their dtype and shape, and are only
+    loaded when requested, the last used chunks being kept in memory.
+    Behaves as the list of the stored values, :meth:`get` gives the value of a
+    point ID """
+
+    def __init__(self, folder: str, chunk_size: int = 100,
+                 compress: bool = False, cache_chunks: int = 2,
+                 flush_time: float = 1.):
+        self.folder = folder
+        self.chunk_size = max(int(chunk_size), 1)
+        self.flush_time = max(float(flush_time), 0.)
+        self.compress = compress
+        self.cache_chunks = max(int(cache_chunks), 1)
+
+        if not os.path.exists(self.folder): os.mkdir(self.folder)
+
+        self.ids = []  # point ID of each value, in order
+        self._locations = {}  # point ID -> chunk number
+        self._buffer = {}  # point ID -> value of the chunk being filled
+        self._chunk = 0  # number of the chunk being filled
+        self._chunk_start = 0.  # time of the first value of the chunk being filled
+        self._loaded = OrderedDict()  # chunk number -> {ID: value}, last used at the end
+
+    def append(self, ID: int, value: Any):
+        """ Stores a copy of the value of the point ID, the driver being
+        allowed to reuse its output buffer for the next point """
+        if not self._buffer: self._chunk_start = time.monotonic()
+        self.ids.append(ID)
+        self._locations[ID] = self._chunk
+        self._buffer[ID] = _copy(value)
+        if (len(self._buffer) >= self.chunk_size
+                or time.monotonic() - self._chunk_start >= self.flush_time):
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered values in a new chunk """
+        if not self._buffer: return None
+
+        arrays = {}
+        for ID, value in self._buffer.items():
+            arrays.update(_encode(ID, value))
+
+        save = np.savez_compressed if self.compress else np.savez
+        save(self._chunk_path(self._chunk), **arrays)
+
+        # Keep the last values in memory to plot them without reading the file
+        self._cache(self._chunk, self._buffer)
+        self._buffer = {}
+        self._chunk += 1
+
+    def release(self):
+        """ Writes the buffered values and frees the chunks kept in memory,
+        they are read again from the files when requested """
+        self.flush()
+        self._loaded.clear()
+
+    def nbytes(self) -> int:
+        """ Returns the approximate memory used by the values kept in memory """
+        values = list(self._buffer.values())
+        for chunk_values in self._loaded.values():
+            values.extend(chunk_values.values())
+        return sum(value_nbytes(value) for value in values)
+
+    def get(self, ID: int) -> Any:
+        """ Returns the value of the point ID """
+        chunk = self._locations[ID]
+        if chunk == self._chunk: return self._buffer[ID]
+
+        if chunk in self._loaded:
+            self._loaded.move_to_end(chunk)
+            return self._loaded[chunk][ID]
+
+        with np.load(self._chunk_path(chunk), allow_pickle=True) as data:
+            values = _decode(data)
+        self._cache(chunk, values)
+
+        return values[ID]
+
+    def _cache(self, chunk: int, values: dict):
+        self._loaded[chunk] = values
+        while len(self._loaded) > self.cache_chunks:
+            self._loaded.popitem(last=False)
+
+    def _chunk_path(self, chunk: int) -> str:
+        return os.path.join(self.folder, f'chunk_{chunk:06d}.npz')
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self.get(ID) for ID in self.ids[index]]
+        return self.get(self.ids[index])
+
+    def __iter__(self):
+        for ID in list(self.ids):
+            yield self.get(ID)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def value_nbytes(value: Any) -> int:
+    """ Returns the approximate memory used by a result """
+    if isinstance(value, np.ndarray): return value.nbytes
+    if isinstance(value, pd.DataFrame): return int(value.memory_usage(index=False).sum())
+    return sys.getsizeof(value)
+
+
+def _copy(value: Any) -> Any:
+    """ Returns a copy of the value, as the array read back from a chunk """
+    if isinstance(value, pd.DataFrame): return value.copy()
+    try:
+        return np.array(value, copy=True)
+    except ValueError:  # ragged sequence
+        return np.array(value, dtype=object)
+
+
+def _encode(ID: int, value: Any) -> Dict[str, np.ndarray]:
+    """ Returns the arrays representing the value of the point ID in a chunk """
+    if isinstance(value, pd.DataFrame):
+        columns = json.dumps(list(value.columns), default=str)
+        arrays = {f'd{ID}_columns': np.array(columns)}
+        for j in range(value.shape[1]):
+            arrays[f'd{ID}_{j}'] = value.iloc[:, j].to_numpy()
+        return arrays
+
+    try:
+        return {f'a{ID}': np.asarray(value)}
+    except ValueError:  # ragged sequence
+        return {f'a{ID}': np.array(value, dtype=object)}
+
+
+def _decode(data: Dict[str, np.ndarray]) -> dict:
+    """ Returns the values of a chunk by point ID """
+    values = {}
+    for key in data.keys():
+        if key.startswith('a'):
+            values[int(key[1: ])] = data[key]
+        elif key.endswith('_columns'):
+            name = key[: -len('_columns')]
+            columns = json.loads(str(data[key]))
+            values[int(name[1: ])] = pd.DataFrame(
+                {j: data[f'{name}_{j}'] for j in range(len(columns))})
+            values[int(name[1: ])].columns = columns
+
+    return values
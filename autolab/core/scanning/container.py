@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+Single file storage of a scan (.hdf5 file, needs h5py).
+
+Structure of the file:
+    attributes: format, autolab version, creation time, scan config (json)
+                and user variables (json)
+    /<recipe index>: group of a recipe (attributes name and header)
+        /data/<column index>: column of the table of the scan, typed
+        /arrays/<result index>: array results (attribute name), either
+            - values and ids datasets if all the values have the same shape
+              and dtype (values chunked by point)
+            - one dataset (or group for a DataFrame) by point ID otherwise
+"""
+
+import io
+import os
+import json
+import datetime
+from typing import Any, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ..config import get_scanner_config
+from ..devices import DEVICES, get_element_by_address
+from ..utilities import boolean
+from .config import read_config_file, convert_legacy_config
+from .data import ScanSet
+from ... import __version__
+
+SCAN_FORMAT = 'autolab_scan'
+SCAN_FORMAT_VERSION = 1
+HDF5_EXTENSIONS = ('.hdf5', '.h5')
+
+
+def _import_h5py():
+    """ Returns the h5py module, needed to save and load the .hdf5 scans """
+    try:
+        import h5py
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError(
+            f"{e}. h5py is needed to save and load scans in .hdf5 files, " \
+            "install it with: pip install h5py") from None
+    return h5py
+
+
+def is_hdf5(filename: str) -> bool:
+    """ Returns True if filename has a .hdf5 or .h5 extension """
+    return os.path.splitext(filename)[1].lower() in HDF5_EXTENSIONS
+
+
+# =============================================================================
+# WRITE
+# =============================================================================
+
+def save_scan(scanset: ScanSet, filename: str, configPars: dict = None):
+    """ Saves the data of all the recipes of scanset in the .hdf5 file filename,
+    with the scan configuration configPars (read from the temporary folder of
+    the scan if not provided) """
+    h5py = _import_h5py()
+
+    scanset.flush()
+    if configPars is None: configPars = _get_temp_config(scanset)
+    compression = 'gzip' if boolean(get_scanner_config()['compress_arrays']) else None
+
+    with h5py.File(filename, 'w') as file:
+        _write_attributes(file, configPars)
+
+        for i, (recipe_name, dataset) in enumerate(scanset.items()):
+            group = file.create_group(str(i))
+            group.attrs['name'] = recipe_name
+            group.attrs['header'] = json.dumps(dataset.header)
+
+            data_group = group.create_group('data')
+            data = dataset.data
+            for j in range(data.shape[1]):
+                _write_column(data_group, str(j), data.iloc[:, j].to_numpy())
+
+            arrays_group = group.create_group('arrays')
+            for k, (name, values) in enumerate(dataset.data_arrays.items()):
+                ids = getattr(values, 'ids', None)
+                if ids is None: ids = list(range(1, len(values) + 1))
+                _write_arrays(arrays_group, str(k), name, ids, values,
+                              compression)
+
+
+def _get_temp_config(scanset: ScanSet) -> Union[dict, None]:
+    """ Returns the scan config saved in the temporary folder of scanset """
+    for dataset in scanset.values():
+        config_name = os.path.join(
+            os.path.dirname(dataset.folder_dataset_temp), 'config.conf')
+        if os.path.exists(config_name):
+            with open(config_name) as config_file:
+                return json.load(config_file)
+    return None
+
+
+def _write_attributes(file, configPars: Union[dict, None]):
+    file.attrs['format'] = SCAN_FORMAT
+    file.attrs['format_version'] = SCAN_FORMAT_VERSION
+    file.attrs['autolab_version'] = __version__
+    file.attrs['created'] = str(datetime.datetime.now())
+    if configPars is not None:
+        file.attrs['config'] = json.dumps(configPars)
+        file.attrs['variables'] = json.dumps(configPars.get('variables', {}))
+
+
+def _write_column(group, name: str, column: np.ndarray):
+    """ Writes a column of the scan table, objects (text) being written as strings """
+    h5py = _import_h5py()
+    if column.dtype.kind == 'O':
+        column = np.array(['' if value is None or value != value else str(value)
+                           for value in column], dtype=h5py.string_dtype())
+    group.create_dataset(name, data=column)
+
+
+def _write_arrays(group, key: str, name: str, ids: List[int], values,
+                  compression: str = None):
+    """ Writes the values of an array result, stacked in one dataset if they
+    have the same shape and dtype """
+    h5py = _import_h5py()
+    sub_group = group.create_group(key)
+    sub_group.attrs['name'] = name
+
+    first = values[0] if len(values) != 0 else None
+    if (isinstance(first, np.ndarray) and first.dtype.kind in 'biufc'
+            and all(isinstance(value, np.ndarray) and value.shape == first.shape
+                    and value.dtype == first.dtype for value in values)):
+        sub_group.attrs['kind'] = 'stack'
+        sub_group.create_dataset('ids', data=np.asarray(ids, dtype=np.int64))
+        stack = sub_group.create_dataset(
+            'values', shape=(len(values), ) + first.shape, dtype=first.dtype,
+            chunks=(1, ) + first.shape if first.size else None,
+            compression=compression)
+        for i, value in enumerate(values):  # one point at a time to limit memory
+            stack[i] = value
+        return None
+
+    sub_group.attrs['kind'] = 'points'
+    for ID, value in zip(ids, values):
+        if isinstance(value, pd.DataFrame):
+            df_group = sub_group.create_group(str(ID))
+            df_group.attrs['columns'] = json.dumps(list(value.columns), default=str)
+            for j in range(value.shape[1]):
+                _write_column(df_group, str(j), value.iloc[:, j].to_numpy())
+        elif isinstance(value, bytes):
+            sub_group.create_dataset(str(ID), data=np.void(value))
+        elif isinstance(value, (str, tuple)):
+            sub_group.create_dataset(str(ID), data=str(value),
+                                     dtype=h5py.string_dtype())
+        else:
+            value = np.asarray(value)
+            if value.dtype.kind == 'O':
+                _write_column(sub_group, str(ID), value.ravel())
+            else:
+                sub_group.create_dataset(
+                    str(ID), data=value, compression=compression if value.ndim else None)
+
+
+# =============================================================================
+# READ
+# =============================================================================
+
+def load_scan(filename: str) -> 'ScanFile':
+    """ Opens a scan saved in a .hdf5 file. The data are only read when
+    requested. The file stays open until ScanFile.close is called or the end
+    of a with statement.
+
+    Example::
+
+        with autolab.load_scan('scan.hdf5') as scan:
+            print(scan.recipes)
+            data = scan['recipe'].data  # DataFrame of the scan table
+            spectrum = scan['recipe'].arrays['spectrum'].get(ID)
+    """
+    return ScanFile(filename)
+
+
+class ScanFile:
+    """ Scan saved in a .hdf5 file, see :meth:`load_scan` """
+
+    def __init__(self, filename: str):
+        h5py = _import_h5py()
+        self.filename = filename
+        self._file = h5py.File(filename, 'r')
+        assert self._file.attrs.get('format') == SCAN_FORMAT, (
+            f"{filename} is not an autolab scan file")
+
+        attrs = self._file.attrs
+        self.autolab_version = attrs.get('autolab_version')
+        self.created = attrs.get('created')
+        self.config = json.loads(attrs['config']) if 'config' in attrs else None
+        self.variables = json.loads(attrs['variables']) if 'variables' in attrs else {}
+
+        self._recipes = {self._file[key].attrs['name']: ScanRecipe(self._file[key])
+                         for key in sorted(self._file, key=int)}
+
+    @property
+    def recipes(self) -> List[str]:
+        """ Returns the names of the recipes of the scan """
+        return list(self._recipes)
+
+    def __getitem__(self, recipe_name: str) -> 'ScanRecipe':
+        return self._recipes[recipe_name]
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"ScanFile('{self.filename}', recipes={self.recipes})"
+
+
+class ScanRecipe:
+    """ Data of a recipe in a scan file """
+
+    def __init__(self, group):
+        self._group = group
+        self.name = group.attrs['name']
+        self.header = json.loads(group.attrs['header'])
+        self._data = None
+        self.arrays = {self._group['arrays'][key].attrs['name']: ScanArrays(
+            self._group['arrays'][key]) for key in sorted(
+                self._group['arrays'], key=int)}
+
+    def column(self, name: str):
+        """ Returns the column name of the scan table as a h5py dataset,
+        read when sliced (ex: column[:100]) """
+        return self._group['data'][str(self.header.index(name))]
+
+    @property
+    def data(self) -> pd.DataFrame:
+        """ Returns the table of the scan, read on first call """
+        if self._data is None:
+            data_group = self._group['data']
+            self._data = pd.DataFrame(
+                {j: _read_dataset(data_group[str(j)]) for j in range(len(self.header))})
+            self._data.columns = self.header
+        return self._data
+
+    def __repr__(self) -> str:
+        return f"ScanRecipe('{self.name}', columns={self.header}, arrays={list(self.arrays)})"
+
+
+class ScanArrays:
+    """ Array results of a recipe in a scan file, read on request.
+    Behaves as a list of the values, :meth:`get` gives the value of a point ID """
+
+    def __init__(self, group):
+        self._group = group
+        self.name = group.attrs['name']
+        self._stack = group.attrs['kind'] == 'stack'
+        if self._stack:
+            self.ids = [int(ID) for ID in group['ids'][()]]
+            self._index = {ID: i for i, ID in enumerate(self.ids)}
+        else:
+            self.ids = sorted(int(ID) for ID in group)
+
+    def get(self, ID: int) -> Any:
+        """ Returns the value of the point ID """
+        if self._stack:
+            return self._group['values'][self._index[ID]]
+
+        item = self._group[str(ID)]
+        if 'columns' in item.attrs:  # DataFrame
+            columns = json.loads(item.attrs['columns'])
+            df = pd.DataFrame({j: _read_dataset(item[str(j)])
+                               for j in range(len(columns))})
+            df.columns = columns
+            return df
+        return _read_dataset(item)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self.get(ID) for ID in self.ids[index]]
+        return self.get(self.ids[index])
+
+    def __iter__(self):
+        for ID in self.ids:
+            yield self.get(ID)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _read_dataset(dataset) -> Any:
+    """ Returns the value of a dataset written by this module """
+    h5py = _import_h5py()
+    if h5py.check_string_dtype(dataset.dtype) is not None:
+        value = dataset.asstr()[()]
+        return value if isinstance(value, str) else np.asarray(value, dtype=object)
+    value = dataset[()]
+    if isinstance(value, np.void): return value.tobytes()
+    return value
+
+
+# =============================================================================
+# LEGACY CONVERSION
+# =============================================================================
+
+def convert_scan_folder(filename: str, out: str = None) -> str:
+    """ Converts a scan saved by the scanner as text (filename.txt with the
+    scan table, folder filename with the arrays and filename.conf with the
+    config, or name.conf if filename is name_<recipe_name> for a scan with
+    several recipes) in a .hdf5 scan file. Returns the path of the new file
+    (filename with .hdf5 extension if out not provided) """
+    h5py = _import_h5py()
+
+    save_folder = os.path.splitext(filename)[0]
+    if out is None: out = f'{save_folder}.hdf5'
+
+    configPars, recipe_name = _find_config(save_folder)
+    if recipe_name is None: recipe_name = os.path.basename(save_folder)
+    result_types = _get_result_types(configPars, recipe_name)
+
+    data = pd.read_csv(filename)
+
+    with h5py.File(out, 'w') as file:
+        _write_attributes(file, configPars)
+        file.attrs['converted_from'] = os.path.abspath(filename)
+
+        group = file.create_group('0')
+        group.attrs['name'] = recipe_name
+        group.attrs['header'] = json.dumps(list(data.columns))
+
+        data_group = group.create_group('data')
+        for j in range(data.shape[1]):
+            _write_column(data_group, str(j), data.iloc[:, j].to_numpy())
+
+        arrays_group = group.create_group('arrays')
+        if os.path.isdir(save_folder):
+            names = sorted(name for name in os.listdir(save_folder)
+                           if os.path.isdir(os.path.join(save_folder, name)))
+            for k, name in enumerate(names):
+                folder = os.path.join(save_folder, name)
+                ids = sorted(int(os.path.splitext(file_name)[0])
+                             for file_name in os.listdir(folder)
+                             if os.path.splitext(file_name)[0].isdigit())
+                values = [_read_text_value(os.path.join(folder, f'{ID}.txt'),
+                                           result_types.get(name))
+                          for ID in ids]
+                _write_arrays(arrays_group, str(k), name, ids, values)
+
+    return out
+
+
+def _find_config(save_folder: str) -> Tuple[Union[dict, None], Union[str, None]]:
+    """ Returns the config saved with the scan save_folder and the name of
+    its recipe (None if unknown): save_folder.conf, or name.conf if
+    save_folder is name_<recipe_name> (scan with several recipes) """
+    if os.path.exists(f'{save_folder}.conf'):
+        configPars = read_config_file(f'{save_folder}.conf')
+        names = _get_recipe_names(configPars)
+        return configPars, names[0] if len(names) == 1 else None
+
+    folder, base_name = os.path.split(save_folder)
+    for i, char in enumerate(base_name):
+        if char != '_': continue
+        config_name = os.path.join(folder, f'{base_name[: i]}.conf')
+        if os.path.exists(config_name):
+            configPars = read_config_file(config_name)
+            if base_name[i+1: ] in _get_recipe_names(configPars):
+                return configPars, base_name[i+1: ]
+
+    return None, None
+
+
+def _get_recipe_names(configPars: dict) -> List[str]:
+    configPars = convert_legacy_config(configPars)
+    return [pars.get('name', key) for key, pars in configPars.items()
+            if key not in ('autolab', 'variables') and isinstance(pars, dict)]
+
+
+def _get_result_types(configPars: Union[dict, None], recipe_name: str) -> dict:
+    """ Returns the element type of the results of recipe_name in configPars,
+    by name. Only the elements of the opened devices are known, a conversion
+    doesn't open the devices """
+    if configPars is None: return {}
+    configPars = convert_legacy_config(configPars)
+
+    addresses = {}
+    for key, pars in configPars.items():
+        if (key in ('autolab', 'variables') or not isinstance(pars, dict)
+                or pars.get('name', key) != recipe_name):
+            continue
+        for param_pars in pars.get('parameter', {}).values():
+            if isinstance(param_pars, dict) and 'name' in param_pars:
+                addresses.setdefault(param_pars['name'], param_pars.get('address'))
+        recipe = pars.get('recipe', {})
+        i = 1
+        while f'{i}_name' in recipe:
+            addresses.setdefault(recipe[f'{i}_name'], recipe.get(f'{i}_address'))
+            i += 1
+
+    result_types = {}
+    for name, address in addresses.items():
+        if isinstance(address, str) and address.split('.')[0] in DEVICES:
+            try:
+                result_types[name] = get_element_by_address(address).type
+            except Exception:
+                pass
+
+    return result_types
+
+
+def _read_text_value(path: str, element_type: type = None) -> Any:
+    """ Returns the value of a result saved as text by the scanner, of type
+    element_type if known. Otherwise guessed from the text: array, DataFrame
+    (csv with header, so at least two lines) or string """
+    if element_type is bytes:
+        with open(path, 'rb') as f: return f.read()
+    if element_type in (str, tuple):
+        with open(path) as f: return f.read()
+    if element_type is pd.DataFrame:
+        return pd.read_csv(path)
+
+    try:
+        value = pd.read_csv(path, header=None).to_numpy(dtype=float)
+        return value[:, 0] if value.shape[1] == 1 else value
+    except Exception:
+        if element_type is np.ndarray:
+            value = pd.read_csv(path, header=None).to_numpy()
+            return value[:, 0] if value.shape[1] == 1 else value
+
+    with open(path) as f: text = f.read()
+    if len(text.splitlines()) > 1:
+        try:
+            return pd.read_csv(io.StringIO(text))
+        except Exception:
+            pass
+    return text
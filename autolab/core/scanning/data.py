@@ -0,0 +1,627 @@
+# -*- coding: utf-8 -*-
+"""
+Storage of the data of a scan, shared by the scanner GUI and the headless scan
+"""
+
+from collections import OrderedDict
+from queue import Queue, Empty
+import os
+import csv
+import time
+import atexit
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
+from typing import List, Any
+
+import numpy as np
+import pandas as pd
+
+from ..config import get_scanner_config
+from ..utilities import boolean, data_to_dataframe
+from .arrays import ArrayStore, value_nbytes
+
+# Writers with a file open, closed at python exit to not loose buffered rows
+_OPEN_WRITERS = weakref.WeakSet()
+
+
+def create_scanset(config: dict, folder_dataset_temp: str,
+                   save_temp: bool = True) -> 'ScanSet':
+    """ Returns a new ScanSet with an empty Dataset for each active recipe of
+    config, writing their data in sub-folders of folder_dataset_temp """
+    scanset = ScanSet()
+
+    for recipe_name, recipe in config.items():
+        if recipe['active']:
+            sub_folder = os.path.join(folder_dataset_temp, recipe_name)
+            if save_temp: os.mkdir(sub_folder)
+
+            scanset[recipe_name] = Dataset(sub_folder, recipe_name,
+                                           config, save_temp=save_temp)
+
+    return scanset
+
+
+class ColumnarData:
+    """ Table of the scan points stored in one numpy array per column.
+    The arrays are preallocated and grow geometrically, so adding a point has a
+    constant cost. The DataFrame is only created when requested, as a view on
+    the arrays. The type of a column is given by its first value and upgraded
+    (int -> float -> object) if a new value doesn't fit """
+
+    def __init__(self, columns: List[str], capacity: int = 1024):
+        self.columns = list(columns)  # can have duplicated names
+        self._arrays = [None] * len(self.columns)
+        self._size = 0
+        self._capacity = max(int(capacity), 1)
+        self._frame = None
+
+    def append(self, row: list):
+        """ Adds a point, row having a value for each column (None if missing) """
+        if self._size == self._capacity:
+            self._capacity *= 2
+            self._arrays = [self._resize(array) for array in self._arrays]
+
+        for i, value in enumerate(row):
+            if value is None: value = np.nan
+            array = self._arrays[i]
+
+            if array is None:
+                array = self._arrays[i] = np.empty(
+                    self._capacity, dtype=self._get_dtype(value))
+            elif not self._fits(array.dtype, value):
+                array = self._arrays[i] = self._upgrade(array, value)
+
+            array[self._size] = value
+
+        self._size += 1
+        self._frame = None
+
+    def frame(self) -> pd.DataFrame:
+        """ Returns the points as a DataFrame sharing the memory of the columns """
+        if self._frame is None:
+            arrays = [np.empty(0, dtype=object) if array is None
+                      else array[: self._size] for array in self._arrays]
+            frame = pd.DataFrame(dict(enumerate(arrays)), copy=False)
+            frame.columns = self.columns
+            self._frame = frame
+
+        return self._frame
+
+    def spill(self, folder: str):
+        """ Moves the numerical columns in memory-mapped files of folder, read
+        from the disk by the system when the points are requested """
+        if self._size == 0: return None
+
+        for i, array in enumerate(self._arrays):
+            if (array is None or array.dtype.kind == 'O'
+                    or isinstance(array, np.memmap)):
+                continue
+            path = os.path.join(folder, f'column_{i}.npy')
+            np.save(path, array[: self._size])
+            self._arrays[i] = np.load(path, mmap_mode='r')
+
+        # A new point copies the columns back in memory
+        self._capacity = self._size
+        self._frame = None
+
+    def nbytes(self) -> int:
+        """ Returns the approximate memory used by the columns """
+        return sum(array.nbytes for array in self._arrays
+                   if array is not None and not isinstance(array, np.memmap))
+
+    def _resize(self, array: np.ndarray) -> np.ndarray:
+        if array is None: return None
+        new_array = np.empty(self._capacity, dtype=array.dtype)
+        new_array[: self._size] = array[: self._size]
+        return new_array
+
+    def _upgrade(self, array: np.ndarray, value: Any) -> np.ndarray:
+        """ Returns a copy of array with a type that can store value """
+        dtype = self._get_dtype(value)
+        if (array.dtype.kind in 'iuf' and dtype.kind in 'iuf'):
+            dtype = np.dtype(float)
+        elif (array.dtype.kind in 'iufc' and dtype.kind in 'iufc'):
+            dtype = np.dtype(complex)
+        else:
+            dtype = np.dtype(object)
+        # Integers that a float can't represent exactly are kept as objects
+        if dtype.kind in 'fc' and not (
+                self._is_float_exact(value) and (
+                    array.dtype.kind not in 'iu' or self._size == 0
+                    or (array[: self._size].min() >= -2**53
+                        and array[: self._size].max() <= 2**53))):
+            dtype = np.dtype(object)
+        new_array = np.empty(self._capacity, dtype=dtype)
+        new_array[: self._size] = array[: self._size]
+        return new_array
+
+    @staticmethod
+    def _get_dtype(value: Any) -> np.dtype:
+        if isinstance(value, (bool, np.bool_)): return np.dtype(bool)
+        if isinstance(value, (int, np.integer)):
+            info = np.iinfo(np.int64)
+            return np.dtype(np.int64 if info.min <= value <= info.max else object)
+        if isinstance(value, (float, np.floating)): return np.dtype(float)
+        if isinstance(value, (complex, np.complexfloating)): return np.dtype(complex)
+        return np.dtype(object)
+
+    @staticmethod
+    def _fits(dtype: np.dtype, value: Any) -> bool:
+        if dtype.kind == 'O': return True
+        if dtype.kind == 'b': return isinstance(value, (bool, np.bool_))
+        if isinstance(value, (bool, np.bool_)): return False
+        if dtype.kind in 'iu':
+            return (isinstance(value, (int, np.integer))
+                    and np.iinfo(dtype).min <= value <= np.iinfo(dtype).max)
+        if dtype.kind == 'f':
+            return (isinstance(value, (int, float, np.integer, np.floating))
+                    and ColumnarData._is_float_exact(value))
+        if dtype.kind == 'c':
+            return (isinstance(value, (int, float, complex, np.number))
+                    and ColumnarData._is_float_exact(value))
+        return False
+
+    @staticmethod
+    def _is_float_exact(value: Any) -> bool:
+        """ Returns False for an integer rounded when stored as a float """
+        if isinstance(value, (int, np.integer)):
+            return -2**53 <= value <= 2**53
+        return True
+
+    def __len__(self):
+        return self._size
+
+
+class DataWriter:
+    """ Appends rows to a csv file from a background thread. The file is kept
+    open and the rows are buffered, then written every flush_rows rows or
+    flush_time seconds. :meth:`flush` waits for the buffered rows to be written,
+    and on disk if sync is True (used on pause and stop of the scan).
+    An error stops the writer and is raised by every later call """
+    _CLOSE = object()
+
+    def __init__(self, filename: str, header: List[str],
+                 flush_rows: int = 100, flush_time: float = 1.):
+        self.filename = filename
+        self.header = header
+        self.flush_rows = max(int(flush_rows), 1)
+        self.flush_time = max(float(flush_time), 0.)
+
+        self._queue = Queue()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='autolab_data_writer')
+        self._thread.start()
+        _OPEN_WRITERS.add(self)
+
+    def write(self, row: list):
+        """ Adds a row to the buffer """
+        self._check_error()
+        assert self._thread.is_alive(), f"Can't write in {self.filename}, the writer is closed"
+        self._queue.put(row)
+
+    def flush(self, sync: bool = True):
+        """ Waits until the buffered rows are written in the file """
+        if not self._thread.is_alive(): return self._check_error()
+        done = threading.Event()
+        self._queue.put((done, sync))
+        while not done.wait(0.1):
+            if not self._thread.is_alive(): break
+        self._check_error()
+
+    def close(self):
+        """ Writes the buffered rows on disk and closes the file """
+        if self._thread.is_alive():
+            self._queue.put(self._CLOSE)
+            self._thread.join()
+        _OPEN_WRITERS.discard(self)
+        self._check_error()
+
+    def _check_error(self):
+        if self.error is not None: raise self.error
+
+    def _run(self):
+        rows = []
+        last_write = time.monotonic()
+
+        try:
+            with open(self.filename, 'a', newline='') as file:
+                writer = csv.writer(file)
+                if file.tell() == 0: writer.writerow(self.header)
+
+                while True:
+                    timeout = None
+                    if rows:
+                        timeout = max(self.flush_time - (time.monotonic() - last_write), 0)
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except Empty:
+                        item = None
+
+                    if isinstance(item, list):
+                        rows.append(item)
+                        if len(rows) < self.flush_rows: continue
+
+                    # Write the buffered rows on timeout, full buffer, flush or close
+                    writer.writerows([[_csv_value(value) for value in row]
+                                      for row in rows])
+                    file.flush()
+                    rows = []
+                    last_write = time.monotonic()
+
+                    if isinstance(item, tuple):
+                        done, sync = item
+                        if sync: os.fsync(file.fileno())
+                        done.set()
+                    elif item is self._CLOSE:
+                        os.fsync(file.fileno())
+                        break
+        except Exception as e:
+            self.error = e
+            # Release the pending flush requests
+            while not self._queue.empty():
+                item = self._queue.get()
+                if isinstance(item, tuple): item[0].set()
+
+
+def _csv_value(value: Any) -> Any:
+    """ Missing values are written as empty fields, as in pandas """
+    if value is None or (isinstance(value, float) and value != value): return ''
+    return value
+
+
+@atexit.register
+def _close_writers():
+    for writer in list(_OPEN_WRITERS):
+        try: writer.close()
+        except Exception: pass
+
+
+class Dataset():
+    """ Collection of data from a recipe """
+    def __init__(self, folder_dataset_temp: str, recipe_name: str, config: dict,
+                 save_temp: bool = True):
+        self.recipe_name = recipe_name
+        self.folders = []
+        self.data_arrays = {}
+        self.folder_dataset_temp = folder_dataset_temp
+        self.new = True
+        self.save_temp = save_temp
+        self._writer = None
+        self._spill_folder = None
+
+        recipe = config[self.recipe_name]
+        list_recipe = [recipe]
+        list_recipe_new = [recipe]
+        has_sub_recipe = True
+
+        while has_sub_recipe:  # OBSOLETE
+            has_sub_recipe = False
+            recipe_list = list_recipe_new
+
+            for recipe_i in recipe_list:
+                for step in recipe_i['recipe']:
+                    if step['stepType'] == "recipe":
+                        has_sub_recipe = True
+                        other_recipe = config[step['element']]
+                        list_recipe_new.append(other_recipe)
+                        list_recipe.append(other_recipe)
+
+                list_recipe_new.remove(recipe_i)
+
+        list_param = [recipe['parameter'] for recipe in list_recipe]
+        self.list_param = sum(list_param, [])
+
+        list_step = [recipe['recipe'] for recipe in list_recipe]
+        self.list_step = sum(list_step, [])
+
+        self.header = (["id"]
+                       + [step['name'] for step in self.list_param]
+                       + [step['name'] for step in self.list_step if (
+                           step['stepType'] == 'measure'
+                           and step['element'].type in [int, float, bool])]
+                       )
+        self._data = ColumnarData(self.header)
+
+        # Routing of the results, compiled once: name -> (element, indexes of
+        # the columns in header, or folder of the files for the other types)
+        self._routes = {}
+        self._array_names = set()  # results stored in an ArrayStore
+        for step in self.list_param + self.list_step:
+            name = step['name']
+            if name in self._routes: continue  # first element with this name
+            element = step['element']
+
+            if element is None or element.type in [int, float, bool]:
+                indexes = [i for i, column in enumerate(self.header)
+                           if column == name]
+                self._routes[name] = (element, indexes, None)
+            else:
+                results_folder = os.path.join(self.folder_dataset_temp, name)
+                self._routes[name] = (element, None, results_folder)
+                if self.save_temp and element.type in [np.ndarray, pd.DataFrame]:
+                    self._array_names.add(name)
+
+        scanner_config = get_scanner_config()
+        self._array_chunk_size = int(float(scanner_config['array_chunk_size']))
+        self._compress_arrays = boolean(scanner_config['compress_arrays'])
+        self._flush_time = float(scanner_config['flush_time'])
+
+    @property
+    def data(self) -> pd.DataFrame:
+        """ DataFrame of the numerical results, created on request """
+        return self._data.frame()
+
+    def getData(self, var_list: List[str], data_name: str = "Scan",
+                dataID: int = 0, filter_condition: List[dict] = []) -> pd.DataFrame:
+        """ This function returns a dataframe with two columns : the parameter value,
+        and the requested result value """
+        if data_name == "Scan":
+            data = self.data
+        else:
+            data = self.data_arrays[data_name][dataID]
+
+            if (data is not None
+                    and not isinstance(data, str)
+                    and (len(data.T.shape) == 1 or (
+                        len(data.T.shape) != 0 and data.T.shape[0] == 2))):
+                data = data_to_dataframe(data)
+            else:  # Image
+                return data
+
+        # Add var for filtering
+        for var_filter in filter_condition:
+            if var_filter['enable']:
+                if (var_filter['name'] not in var_list
+                        and var_filter['name'] != ''
+                        and var_filter['name'] is not None):
+                    var_list.append(var_filter['name'])
+                elif isinstance(var_filter['condition'], str):
+                    for key in self.header:
+                        if key in var_filter['condition']:
+                            var_list.append(key)
+
+        if any(map(lambda v: v in var_list, list(data.columns))):
+            data = data.loc[:,~data.columns.duplicated()].copy()  # unique data column
+            unique_var_list = list(dict.fromkeys(var_list))  # unique var_list
+            # Filter data
+            for var_filter in filter_condition:
+                if var_filter['enable']:
+                    if var_filter['name'] in data:
+                        filter_cond = var_filter['condition']
+                        filter_name = var_filter['name']
+                        filter_value = var_filter['value']
+                        mask = filter_cond(data[filter_name], filter_value)
+                        data = data[mask]
+                    elif isinstance(var_filter['condition'], str):
+                        filter_cond = var_filter['condition']
+                        if filter_cond:
+                            try:
+                                data = data.query(filter_cond)
+                            except:
+                                # If error, output empty dataframe
+                                data = pd.DataFrame(columns=self.header)
+                                break
+
+            return data.loc[:,unique_var_list]
+
+        return None
+
+    def save(self, filename: str):
+        """ This function saved the dataset in the provided path """
+        dataset_folder = os.path.splitext(filename)[0]
+        data_name = os.path.join(self.folder_dataset_temp, 'data.txt')
+
+        if self._writer is not None and self._writer.error is not None:
+            # data.txt misses the points buffered at the error of the writer
+            self._flush_arrays()
+            self.data.to_csv(filename, index=False, header=self.header)
+        else:
+            self.flush()
+            if os.path.exists(data_name):
+                shutil.copy(data_name, filename)
+            else:
+                self.data.to_csv(filename, index=False, header=self.header)
+
+        if self.folders:
+            if not os.path.exists(dataset_folder): os.mkdir(dataset_folder)
+            for tmp_folder in self.folders:
+                array_name = os.path.basename(tmp_folder)
+                dest_folder = os.path.join(dataset_folder, array_name)
+
+                if isinstance(self.data_arrays.get(array_name), ArrayStore):
+                    # Binary chunks written back as one text file per point
+                    if not os.path.exists(dest_folder): os.mkdir(dest_folder)
+                    store = self.data_arrays[array_name]
+                    for ID in store.ids:
+                        path = os.path.join(dest_folder, f"{ID}.txt")
+                        _save_value(path, store.get(ID))
+                elif os.path.exists(tmp_folder):
+                    try:
+                        shutil.copytree(tmp_folder, dest_folder,
+                                        dirs_exist_ok=True)  # python >=3.8 only
+                    except:
+                        if os.path.exists(dest_folder):
+                            shutil.rmtree(dest_folder, ignore_errors=True)
+                        shutil.copytree(tmp_folder, dest_folder)
+                else:
+                    # This is only executed if no temp folder is set
+                    if not os.path.exists(dest_folder): os.mkdir(dest_folder)
+
+                    if array_name in self.data_arrays:
+                        list_data = self.data_arrays[array_name]  # data is list representing id 1,2
+
+                        for i, value in enumerate(list_data):
+                            path = os.path.join(dest_folder, f"{i+1}.txt")
+                            _save_value(path, value)
+
+    def addPoint(self, dataPoint: OrderedDict):
+        """ This function add a data point (parameter value, and results) in the dataset """
+        ID = len(self) + 1
+        row = [None] * len(self.header)
+        row[0] = ID
+
+        for result_name, result in dataPoint.items():
+
+            if result_name == 0: continue  # skip first result which is recipe_name
+
+            element, indexes, results_folder = self._routes[result_name]
+
+            # If the result is displayable (numerical), keep it in memory
+            if indexes is not None:
+                for index in indexes:
+                    row[index] = result
+            else : # Else write it on a file, in a temp directory
+                if self.data_arrays.get(result_name) is None:
+                    # First result: creates its folder
+                    if results_folder not in self.folders:
+                        self.folders.append(results_folder)
+                    if result_name in self._array_names:
+                        self.data_arrays[result_name] = ArrayStore(
+                            results_folder, chunk_size=self._array_chunk_size,
+                            compress=self._compress_arrays,
+                            flush_time=self._flush_time)
+                    else:
+                        if self.save_temp and not os.path.exists(results_folder):
+                            os.mkdir(results_folder)
+                        self.data_arrays[result_name] = []
+
+                if isinstance(self.data_arrays[result_name], ArrayStore):
+                    self.data_arrays[result_name].append(ID, result)
+                else:
+                    if self.save_temp and element is not None:
+                        result_path = os.path.join(results_folder, f'{ID}.txt')
+                        element.save(result_path, value=result)
+
+                    self.data_arrays[result_name].append(result)
+
+        self._data.append(row)
+
+        if self.save_temp:
+            if ID == 1 and not os.path.exists(self.folder_dataset_temp):
+                print(f'Warning: {self.folder_dataset_temp} has been created ' \
+                      'but should have been created earlier. ' \
+                      'Check that you have not lost any data',
+                      file=sys.stderr)
+                os.mkdir(self.folder_dataset_temp)
+            if self._writer is None:
+                scanner_config = get_scanner_config()
+                self._writer = DataWriter(
+                    os.path.join(self.folder_dataset_temp, 'data.txt'),
+                    self.header,
+                    flush_rows=int(float(scanner_config['flush_rows'])),
+                    flush_time=float(scanner_config['flush_time']))
+            self._writer.write(row)
+
+    def flush(self, sync: bool = True):
+        """ Writes the buffered points in the data.txt file of the dataset
+        and the buffered arrays in their stores """
+        self._flush_arrays()
+        if self._writer is not None: self._writer.flush(sync=sync)
+
+    def close(self):
+        """ Writes the buffered points and closes the data.txt file, called
+        at the end of the scan. The writer is kept if it failed, to raise
+        its error again """
+        self._flush_arrays()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _flush_arrays(self):
+        for name in self._array_names:
+            if name in self.data_arrays: self.data_arrays[name].flush()
+
+    def memory_size(self) -> int:
+        """ Returns the approximate memory used by the points and the array
+        results of the dataset """
+        size = self._data.nbytes()
+        for values in self.data_arrays.values():
+            if isinstance(values, ArrayStore): size += values.nbytes()
+            else: size += sum(value_nbytes(value) for value in values)
+        return size
+
+    def spill(self) -> int:
+        """ Moves the points and the array results of the dataset in files of
+        the temp folder, read back when requested. Only for a finished dataset.
+        Returns the memory released """
+        size = self.memory_size()
+        folder = self._get_spill_folder()
+        self._data.spill(folder)
+
+        for name, values in self.data_arrays.items():
+            if isinstance(values, ArrayStore):
+                values.release()
+            elif values and all(isinstance(value, (np.ndarray, pd.DataFrame))
+                                for value in values):
+                # Results kept in a list if save_temp is False
+                store = ArrayStore(os.path.join(folder, name),
+                                   chunk_size=self._array_chunk_size,
+                                   compress=self._compress_arrays)
+                for i, value in enumerate(values): store.append(i+1, value)
+                store.release()
+                self.data_arrays[name] = store
+
+        return size - self.memory_size()
+
+    def _get_spill_folder(self) -> str:
+        if self._spill_folder is None:
+            if self.save_temp:
+                self._spill_folder = os.path.join(self.folder_dataset_temp,
+                                                  '.spill')
+                if not os.path.exists(self._spill_folder):
+                    os.mkdir(self._spill_folder)
+            else:
+                FOLDER_TEMP = os.environ.get('TEMP', tempfile.gettempdir())
+                self._spill_folder = tempfile.mkdtemp(dir=FOLDER_TEMP)
+        return self._spill_folder
+
+    def __len__(self):
+        """ Returns the number of data point of this dataset """
+        return len(self._data)
+
+
+def _save_value(path: str, value: Any):
+    """ Saves the value of an array result of a point in a text file """
+    if isinstance(value, (int, float, bool, str, tuple)):
+        with open(path, 'w') as f: f.write(str(value))
+    elif isinstance(value, bytes):
+        with open(path, 'wb') as f: f.write(value)
+    elif isinstance(value, np.ndarray):
+        df = pd.DataFrame(value)
+        df.to_csv(path, index=False, header=None)  # faster and handle better different dtype than np.savetxt
+    elif isinstance(value, pd.DataFrame):
+        value.to_csv(path, index=False)
+
+
+class ScanSet(dict):
+    """ Collection of data from a scan """
+    # TODO: use this in scan plot
+    display = True
+    color = 'default'
+    saved = False
+    last_used = 0.  # time of the last display, to spill the oldest first
+
+    def flush(self, sync: bool = True):
+        """ Writes the buffered points of each dataset in their files """
+        for dataset in self.values(): dataset.flush(sync=sync)
+
+    def close(self):
+        """ Closes the files of each dataset at the end of the scan, then
+        raises the first error of their writers """
+        errors = []
+        for dataset in self.values():
+            try: dataset.close()
+            except Exception as e: errors.append(e)
+        if errors: raise errors[0]
+
+    def memory_size(self) -> int:
+        """ Returns the approximate memory used by the datasets """
+        return sum(dataset.memory_size() for dataset in self.values())
+
+    def spill(self) -> int:
+        """ Moves the data of each dataset on disk, returns the memory released """
+        return sum(dataset.spill() for dataset in self.values())
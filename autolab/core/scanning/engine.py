@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+"""
+Scan engine executing a scan config without GUI. Used by the scanner through
+its ScanThread and by the command line (autolab scan run)
+"""
+
+import os
+import sys
+import json
+import time
+import math as m
+import random
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from itertools import product
+from typing import Callable
+
+import numpy as np
+
+from ..config import get_scanner_config
+from ..variables import (eval_variable, set_variable, has_eval, precompile_eval,
+                         eval_vectorized, update_from_config)
+from ..executor import set_priority, SCAN
+from ..elements import Variable as Variable_og
+from ..elements import read_variables, has_read_batch
+from ..utilities import boolean, create_array
+from .config import read_config_file, create_config, get_config_variables
+from .data import ScanSet, create_scanset
+from .container import is_hdf5, save_scan
+
+
+class ScanEngine:
+    """ Executes the recipes of a scan config (see :meth:`create_config`).
+    The data points and the progress of the scan are reported to the callbacks
+    connected to the events listed in EVENTS:
+
+    - 'point' (dataPoint): data of a point, dataPoint[0] being the recipe name
+    - 'error' (error): the scan is stopped after an error
+    - 'user_input' (stepInfos): an action step needs a value from the user,
+      which must be given in user_response
+    - 'parameter_started', 'parameter_finished', 'parameter_completed'
+      (recipe_name, param_name)
+    - 'step_started', 'step_finished' (recipe_name, step_name)
+    - 'recipe_completed' (recipe_name)
+    - 'scan_completed' ()
+    """
+    EVENTS = ('point', 'error', 'user_input',
+              'parameter_started', 'parameter_finished', 'parameter_completed',
+              'step_started', 'step_finished', 'recipe_completed',
+              'scan_completed')
+
+    def __init__(self, config: dict):
+        self.config = config
+
+        self.pauseFlag = threading.Event()
+        self.stopFlag = threading.Event()
+
+        self.user_response = None
+
+        self._callbacks = {event: [] for event in self.EVENTS}
+        self._measure_batches = {}  # id of first step -> consecutive measure steps
+        self._batch_results = {}  # step name -> value read in batch
+        self._vectorized_values = {}  # id of step -> values at each point
+        self._point_index = {}  # recipe name -> index of the current point
+
+    def connect(self, event: str, callback: Callable):
+        """ Calls callback with the arguments of event each time it occurs """
+        assert event in self.EVENTS, f"Unknown event '{event}', must be one of {self.EVENTS}"
+        self._callbacks[event].append(callback)
+
+    def disconnect(self, event: str, callback: Callable):
+        """ Stops calling callback on event """
+        if callback in self._callbacks.get(event, []):
+            self._callbacks[event].remove(callback)
+
+    def emit(self, event: str, *args):
+        """ Calls the callbacks connected to event """
+        for callback in self._callbacks[event]:
+            callback(*args)
+
+    def run(self):
+        """ Executes the active recipes of the scan """
+        # Scan requests have priority over monitors and GUI on shared devices
+        set_priority(SCAN)
+        self.precompileExpressions()
+        self.prepareMeasureBatches()
+        # Start the scan
+        for recipe_name in self.config:
+            if self.config[recipe_name]['active']: self.execRecipe(recipe_name)
+
+        self.emit('scan_completed')
+
+    def stop(self):
+        """ Stops the scan after the current step """
+        self.stopFlag.set()
+        self.pauseFlag.clear()
+
+    def precompileExpressions(self):
+        """ Compiles the $eval: expressions of the scan before its start,
+        to not parse them at each point """
+        for recipe in self.config.values():
+            for parameter in recipe['parameter']:
+                precompile_eval(parameter.get('values'))
+            for step in recipe['recipe']:
+                precompile_eval(step.get('value'))
+
+    def prepareMeasureBatches(self):
+        """ Groups the consecutive measure steps of a same device having a
+        read_batch driver function, to read them in a single driver call """
+        self._measure_batches = {}
+
+        for recipe in self.config.values():
+            batches = [[]]
+            for step in recipe['recipe']:
+                element = step['element']
+                if (step['stepType'] == 'measure'
+                        and isinstance(element, Variable_og)
+                        and has_read_batch(element)):
+                    if (batches[-1] and element._root()
+                            is not batches[-1][0]['element']._root()):
+                        batches.append([])
+                    batches[-1].append(step)
+                elif batches[-1]:
+                    batches.append([])
+
+            for batch in batches:
+                if len(batch) > 1:
+                    self._measure_batches[id(batch[0])] = batch
+
+    def execRecipe(self, recipe_name: str,
+                   initPoint: OrderedDict = None):
+        """ Executes a recipe. initPoint is obsolete, was used to add parameters values
+        and master-recipe name to a sub-recipe """
+
+        paramValues_list = []
+
+
+        for parameter in self.config[recipe_name]['parameter']:
+            param_name = parameter['name']
+
+            if 'values' in parameter:
+                paramValues = parameter['values']
+                try:
+                    paramValues = eval_variable(paramValues)
+                    paramValues = create_array(paramValues)
+                except Exception as e:
+                    self.emit('error', e)
+                    self.stopFlag.set()
+            else:
+                startValue, endValue = parameter['range']
+                nbpts = parameter['nbpts']
+                logScale = parameter['log']
+
+                # Creates the array of values for the parameter
+                if logScale:
+                    paramValues = np.logspace(m.log10(startValue), m.log10(endValue), nbpts, endpoint=True)
+                else:
+                    paramValues = np.linspace(startValue, endValue, nbpts, endpoint=True)
+
+            set_variable(param_name, paramValues[0])
+            paramValues_list.append(paramValues)
+
+        if not self.stopFlag.is_set():
+            self.prepareVectorizedValues(recipe_name, paramValues_list)
+
+        ID = 0
+        # iter over each parameter (do once if no parameter!)
+        for i, paramValueList in enumerate(product(*paramValues_list)):
+
+            if not self.stopFlag.is_set():
+                self._point_index[recipe_name] = i
+
+                if initPoint is None:  # OBSOLETE
+                    initPoint = OrderedDict()
+                    initPoint[0] = recipe_name
+
+                initPointStep = initPoint.copy()
+
+                try:
+                    self._source_of_error = None
+                    ID += 1
+                    set_variable('ID', ID)
+
+                    for parameter, paramValue in zip(
+                            self.config[recipe_name]['parameter'], paramValueList):
+                        self._source_of_error = parameter
+                        element = parameter['element']
+                        param_name = parameter['name']
+
+                        set_variable(param_name, element.type(
+                                paramValue) if element is not None else paramValue)
+
+                        # Set the parameter value
+                        self.emit('parameter_started', recipe_name, param_name)
+                        if element is not None: element(paramValue)
+                        self.emit('parameter_finished', recipe_name, param_name)
+
+                        initPointStep[param_name] = paramValue
+
+                    dataPoint = initPointStep.copy()
+
+                    # Start the recipe
+                    dataPoint = self.processStep(
+                        recipe_name, dataPoint, initPointStep)
+                    # Send the whole data
+                    if not self.stopFlag.is_set(): self.emit('point', dataPoint)
+
+                except Exception as e:
+                    # If an error occurs, stop the scan and send an error signal
+                    name = self._source_of_error['name']
+                    if self._source_of_error['element'] is not None:
+                        address = f"='{self._source_of_error['element'].address()}'"
+                    else: address = ''
+
+                    try:
+                        from pyvisa import VisaIOError
+                    except:
+                        e = f"In recipe '{recipe_name}' for step '{name}': {e}"
+                    else:
+                        if str(e) == str(VisaIOError(-1073807339)):
+                            e = f"Timeout reached for device {address}. Acquisition time may be too long. If so, you can increase timeout delay in the driver to avoid this error."
+                        else:
+                            e = f"In recipe '{recipe_name}' for step '{name}': {e}"
+
+                    self.emit('error', e)
+                    self.stopFlag.set()
+
+                # Wait until the scan is no more in pause
+                while self.pauseFlag.is_set():
+                    time.sleep(0.1)
+            else:
+                break
+
+        for parameter in self.config[recipe_name]['parameter']:
+            self.emit('parameter_completed', recipe_name, parameter['name'])
+
+    def prepareVectorizedValues(self, recipe_name: str, paramValues_list: list):
+        """ Evaluates at once for all the points of the recipe the $eval: values
+        of the set and action steps computed element by element from the
+        parameters, ID and numpy ufuncs (see variables.is_elementwise).
+        The other values are evaluated at each point """
+        parameters = self.config[recipe_name]['parameter']
+        steps = [step for step in self.config[recipe_name]['recipe']
+                 if step['stepType'] in ('set', 'action')
+                 and has_eval(step['value'])
+                 and step['element'].type in [int, float, bool]]
+        if not steps: return None
+
+        try:
+            grids = np.meshgrid(*paramValues_list, indexing='ij')
+            arrays = {}
+            for parameter, grid in zip(parameters, grids):
+                element = parameter['element']
+                grid = grid.ravel()
+                # Same type as the variable set at each point
+                if element is not None:
+                    if element.type not in [int, float, bool]: continue
+                    grid = grid.astype(element.type)
+                arrays[parameter['name']] = grid
+            size = int(np.prod([len(values) for values in paramValues_list]))
+            arrays['ID'] = np.arange(1, size + 1)
+        except Exception:
+            return None
+
+        for step in steps:
+            values = eval_vectorized(step['value'], arrays)
+            if values is not None:
+                self._vectorized_values[id(step)] = values
+
+    def getStepValue(self, recipe_name: str, stepInfos: dict):
+        """ Returns the value of a set or action step for the current point """
+        if id(stepInfos) in self._vectorized_values:
+            return self._vectorized_values[id(stepInfos)][
+                self._point_index[recipe_name]]
+        return eval_variable(stepInfos['value'])
+
+    def processStep(self, recipe_name: str,
+                    dataPoint: OrderedDict,
+                    initPoint: OrderedDict):
+        """ Executes the recipe step """
+        self._batch_results = {}
+
+        for stepInfos in self.config[recipe_name]['recipe']:
+            self._source_of_error = stepInfos
+
+            if not self.stopFlag.is_set():
+                # Process the recipe step
+                result = self.processElement(recipe_name, stepInfos, initPoint)
+
+                if result is not None:
+                    dataPoint[stepInfos['name']] = result
+
+                # Wait until the scan is no more in pause
+                while self.pauseFlag.is_set():
+                    time.sleep(0.1)
+            else:
+                break
+
+        self.emit('recipe_completed', recipe_name)
+        return dataPoint
+
+    def processElement(self, recipe_name: str, stepInfos: dict,
+                       initPoint: OrderedDict):
+        """ Processes the recipe step """
+        element = stepInfos['element']
+        stepType = stepInfos['stepType']
+        self.emit('step_started', recipe_name, stepInfos['name'])
+        result = None
+
+        if stepType == 'measure':
+            if stepInfos['name'] in self._batch_results:
+                result = self._batch_results.pop(stepInfos['name'])
+            elif id(stepInfos) in self._measure_batches:
+                batch = self._measure_batches[id(stepInfos)]
+                results = read_variables([step['element'] for step in batch])
+                self._batch_results = {step['name']: value for step, value in zip(
+                    batch[1: ], results[1: ])}
+                result = results[0]
+            else:
+                result = element()
+            set_variable(stepInfos['name'], result)
+        elif stepType == 'set':
+            value = self.getStepValue(recipe_name, stepInfos)
+            if element.type in [bytes] and isinstance(value, str): value = value.encode()
+            if element.type in [np.ndarray]: value = create_array(value)
+            element(value)
+        elif stepType == 'action':
+            if stepInfos['value'] is not None:
+                # Open dialog for open file, save file or input text
+                if isinstance(stepInfos['value'], str) and stepInfos['value'] == '':
+                    self.emit('user_input', stepInfos)
+                    while (not self.stopFlag.is_set()
+                           and self.user_response is None):
+                        time.sleep(0.1)
+                    if not self.stopFlag.is_set():
+                        element(self.user_response)
+                    self.user_response = None
+                else:
+                    value = self.getStepValue(recipe_name, stepInfos)
+                    if element.type in [bytes] and isinstance(value, str): value = value.encode()
+                    if element.type in [np.ndarray]: value = create_array(value)
+                    element(value)
+            else:
+                element()
+        elif stepType == 'recipe':  # OBSOLETE
+            self.execRecipe(element, initPoint=initPoint)  # Execute a recipe in the recipe
+
+        self.emit('step_finished', recipe_name, stepInfos['name'])
+        return result
+
+
+# =============================================================================
+# HEADLESS SCAN
+# =============================================================================
+
+def run_scan(filename: str, out: str = None, verbose: bool = True) -> ScanSet:
+    """ Executes the scan configuration file filename (exported by the scanner)
+    without GUI and returns its data. If out is provided, saves the data of each
+    recipe as the scanner does (out, or out_<recipe_name> if several recipes).
+    Ctrl+C stops the scan, keeping the data already acquired.
+    If verbose, prints the number of points acquired during the scan. """
+    configPars = read_config_file(filename)
+    config = create_config(configPars)
+    if 'variables' in configPars:
+        update_from_config(get_config_variables(configPars))
+
+    scanner_config = get_scanner_config()
+    save_temp = boolean(scanner_config["save_temp"])
+
+    if save_temp:
+        FOLDER_TEMP = os.environ.get('TEMP')  # Set at autolab start-up
+        folder_dataset_temp = tempfile.mkdtemp(dir=FOLDER_TEMP)
+        with open(os.path.join(folder_dataset_temp, 'config.conf'), 'w') as configfile:
+            json.dump(configPars, configfile, indent=4)
+    else:
+        folder_dataset_temp = str(random.random())
+
+    scanset = create_scanset(config, folder_dataset_temp, save_temp=save_temp)
+
+    engine = ScanEngine(config)
+    engine.connect('point', lambda dataPoint: scanset[dataPoint[0]].addPoint(dataPoint))
+    engine.connect('error', lambda error: print(f'Scan error: {error}', file=sys.stderr))
+    engine.connect('user_input', lambda stepInfos: _ask_user_input(engine, stepInfos))
+    if verbose:
+        engine.connect('point', lambda dataPoint: _print_progress(scanset, dataPoint[0]))
+    try:
+        engine.run()
+    except KeyboardInterrupt:
+        engine.stop()
+        print('Scan stopped', file=sys.stderr)
+    finally:
+        try:
+            scanset.close()  # write the buffered data
+        except Exception as e:  # the data kept in memory can still be saved
+            print(f'Scan data error: {e}', file=sys.stderr)
+
+    if verbose:
+        for recipe_name, dataset in scanset.items():
+            print(f"Recipe '{recipe_name}': {len(dataset)} points")
+
+    if out is not None:
+        save_scanset(scanset, out)
+        if verbose: print(f'Scan saved in {out}')
+
+    return scanset
+
+
+def save_scanset(scanset: ScanSet, filename: str):
+    """ Saves the data of each recipe of scanset as the scanner does: filename
+    if only one recipe, filename_<recipe_name> otherwise, and the scan
+    configuration next to it if save_config is enabled.
+    A .hdf5 filename saves the whole scan, with its configuration, in this file """
+    if is_hdf5(filename):
+        save_scan(scanset, filename)
+        scanset.saved = True
+        return None
+
+    save_folder, extension = os.path.splitext(filename)
+
+    for recipe_name, dataset in scanset.items():
+        if len(scanset) == 1:
+            filename_recipe = f'{save_folder}{extension}'
+        else:
+            filename_recipe = f'{save_folder}_{recipe_name}{extension}'
+        dataset.save(filename_recipe)
+
+    scanset.saved = True
+
+    if boolean(get_scanner_config()["save_config"]) and len(scanset) != 0:
+        config_name = os.path.join(os.path.dirname(
+            dataset.folder_dataset_temp), 'config.conf')
+        if os.path.exists(config_name):
+            shutil.copy(config_name, f'{save_folder}.conf')
+
+
+def _print_progress(scanset: ScanSet, recipe_name: str):
+    """ Prints in place the number of points acquired by recipe_name """
+    print(f"Recipe '{recipe_name}': {len(scanset[recipe_name])} points",
+          end='\r', flush=True)
+
+
+def _ask_user_input(engine: ScanEngine, stepInfos: dict):
+    """ Asks in the console the value of an action step without value """
+    unit = stepInfos['element'].unit
+    if unit == 'open-file': prompt = 'File to open'
+    elif unit == 'save-file': prompt = 'File to save'
+    else: prompt = 'Value'
+
+    try:
+        response = input(f"{prompt} for step '{stepInfos['name']}': ")
+    except EOFError:  # no console available
+        engine.emit('error', f"Step '{stepInfos['name']}' needs a user input")
+        engine.stop()
+        return None
+
+    if has_eval(response):
+        try:
+            response = eval_variable(response)
+        except Exception as e:
+            engine.emit('error', e)
+            engine.stop()
+            return None
+
+    engine.user_response = response
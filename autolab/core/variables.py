@@ -6,12 +6,19 @@ Created on Mon Mar  4 14:54:41 2024
 """
 
 import re
-from typing import Any, List, Tuple
+import sys
+import ast
+import hashlib
+from collections import ChainMap
+from functools import lru_cache
+from types import CodeType
+from typing import Any, List, Tuple, Dict, Union
 
 import numpy as np
 import pandas as pd
 
 from .devices import DEVICES
+from .elements import Element
 from .utilities import clean_string
 
 
@@ -46,18 +53,42 @@ from .utilities import clean_string
 VARIABLES = {}
 
 EVAL = "$eval:"
-
-
-def update_allowed_dict() -> dict:
-    global allowed_dict  # needed to remove variables instead of just adding new one
-    allowed_dict = {"np": np, "pd": pd}
-    allowed_dict.update(DEVICES)
-    allowed_dict.update(VARIABLES)
+# Maximum number of compiled $eval: expressions kept in memory
+EVAL_CACHE_SIZE = 1024
+
+# Names that can be used in a $eval: expression without preventing to reuse
+# its last value (if not overwritten by a variable or a device)
+STATIC_NAMES = {
+    'np', 'pd', 'abs', 'all', 'any', 'bool', 'complex', 'dict', 'divmod',
+    'enumerate', 'filter', 'float', 'int', 'len', 'list', 'map', 'max', 'min',
+    'pow', 'range', 'reversed', 'round', 'set', 'sorted', 'str', 'sum',
+    'tuple', 'zip', 'True', 'False', 'None'}
+# Attributes giving a different value at each call (random numbers, time, files)
+VOLATILE_ATTRIBUTES = {
+    'random', 'now', 'today', 'utcnow', 'load', 'loadtxt', 'genfromtxt',
+    'fromfile', 'memmap'}
+# Numpy functions (besides ufuncs) whose value only depends on their arguments,
+# the only functions with the builtins of STATIC_NAMES allowing to reuse the
+# last value of a $eval: expression
+PURE_NUMPY_FUNCTIONS = {
+    'sum', 'mean', 'std', 'var', 'min', 'max', 'amin', 'amax', 'prod',
+    'median', 'average', 'cumsum', 'cumprod', 'diff', 'sort', 'array',
+    'asarray', 'linspace', 'logspace', 'arange', 'zeros', 'ones', 'full',
+    'dot', 'round', 'around', 'clip', 'where', 'concatenate', 'stack',
+    'reshape', 'transpose', 'real', 'imag', 'angle', 'interp', 'polyval',
+    'gradient', 'argmin', 'argmax', 'size', 'shape', 'ndim'}
+
+
+# Namespace of the $eval: expressions, looking up the live registries
+# (variables first, then devices, then numpy and pandas)
+allowed_dict = ChainMap(VARIABLES, DEVICES, {"np": np, "pd": pd})
+
+
+def update_allowed_dict() -> ChainMap:
+    """ Returns the namespace of the $eval: expressions. Nothing needs to be
+    updated since the namespace is a view on VARIABLES and DEVICES """
     return allowed_dict
 
-
-allowed_dict = update_allowed_dict()
-
 # OPTIMIZE: Variable becomes closer and closer to core.elements.Variable, could envision a merge
 # TODO: refresh menu display by looking if has eval (no -> can refresh)
 # TODO add read signal to update gui (separate class for event and use it on itemwidget creation to change setText with new value)
@@ -72,6 +103,9 @@ class Variable():
         self.unit = None
         self.writable = True
         self.readable = True
+        self._version = 0  # incremented at each write
+        self._dependencies = None  # names used by the $eval: expression
+        self._cached_state = None  # state of the dependencies of self.value
         self._rename(name)
         self.write_function(var)
 
@@ -87,6 +121,11 @@ class Variable():
             self.raw = var
             self.value = 'Need update' if has_eval(self.raw) else self.raw
 
+        self._version += 1
+        self._cached_state = None
+        self._dependencies = (get_dependencies(self.raw)
+                              if has_eval(self.raw) and is_pure(self.raw) else None)
+
         # If no devices or variables with char '(' found in raw, can evaluate value safely
         if not has_variable(self.raw) or '(' not in self.raw:
             try: self.value = self.read_function()
@@ -96,14 +135,56 @@ class Variable():
 
     def read_function(self):
         if has_eval(self.raw):
-            value = str(self.raw)[len(EVAL): ]
-            call = eval(str(value), {}, allowed_dict)
+            # Reuse the last value if none of the dependencies changed
+            state = self._get_state()
+            if state is not None and state == self._cached_state:
+                return self.value
+
+            call = eval_expression(self.raw)
             self.value = call
+            self._cached_state = state
         else:
             call = self.value
 
         return call
 
+    def _get_state(self, visiting: set = None) -> Any:
+        """ Returns a value that changes each time the value of the variable may
+        have changed, or None if it can change at any time (expression using a
+        device, a function outside of an allow-list, unknown names or a cyclic
+        dependency, or value being a device element, a function or a mutable
+        object). Numerical arrays are identified by their content as they can
+        be modified in place """
+        if not has_eval(self.raw):
+            if isinstance(self.raw, np.ndarray) and self.raw.dtype.kind in 'biufc':
+                digest = hashlib.blake2b(
+                    np.ascontiguousarray(self.raw).view(np.uint8)).digest()
+                return (id(self), self._version, id(self.raw),
+                        self.raw.shape, self.raw.dtype.str, digest)
+            if (isinstance(self.raw, (Element, np.ndarray, pd.DataFrame, pd.Series,
+                                      list, dict, set))
+                    or callable(self.raw)):
+                return None
+            return (id(self), self._version)
+        if self._dependencies is None: return None
+
+        if visiting is None: visiting = set()
+        if id(self) in visiting: return None
+        visiting.add(id(self))
+
+        states = []
+        for name in self._dependencies:
+            var = VARIABLES.get(name)
+            if var is not None:
+                state = var._get_state(visiting)
+                if state is None: return None
+                states.append(state)
+            elif name in DEVICES or name not in STATIC_NAMES:
+                return None
+
+        visiting.discard(id(self))
+        return (id(self), self._version, tuple(states))
+
     def __call__(self, value: Any = None) -> Any:
         if value is None:
             return self.read_function()
@@ -123,7 +204,6 @@ def rename_variable(name: str, new_name: str):
     var = VARIABLES.pop(name)
     VARIABLES[new_name] = var
     var._rename(new_name)
-    update_allowed_dict()
 
 
 def set_variable(name: str, value: Any) -> Variable:
@@ -141,7 +221,6 @@ def set_variable(name: str, value: Any) -> Variable:
             var = Variable(name, value)
 
     VARIABLES[name] = var
-    update_allowed_dict()
     return var
 
 
@@ -152,9 +231,7 @@ def get_variable(name: str) -> Variable:
 
 
 def remove_variable(name: str) -> Variable:
-    var = VARIABLES.pop(name)
-    update_allowed_dict()
-    return var
+    return VARIABLES.pop(name)
 
 
 def remove_from_config(variables: List[Tuple[str, Any]]):
@@ -168,19 +245,81 @@ def update_from_config(variables: List[Tuple[str, Any]]):
         set_variable(var[0], var[1])
 
 
+_NAME_PATTERN = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*(?:\.[a-zA-Z_][a-zA-Z0-9_]*)*')
+
+
 def has_variable(value: str) -> bool:
     if not isinstance(value, str): return False
     if has_eval(value): value = value[len(EVAL): ]
 
-    pattern = r'[a-zA-Z_][a-zA-Z0-9_]*(?:\.[a-zA-Z_][a-zA-Z0-9_]*)*'
-    pattern_match = [var.split('.')[0] for var in re.findall(pattern, value)]
-
-    for key in (list(DEVICES) + list(VARIABLES)):
-        if key in pattern_match:
+    for var in _NAME_PATTERN.findall(value):
+        name = var.split('.')[0]
+        if name in VARIABLES or name in DEVICES:
             return True
     return False
 
 
+# Nodes defining or assigning names, not followed by is_pure
+_SCOPE_NODES = tuple(getattr(ast, name) for name in (
+    'Lambda', 'ListComp', 'SetComp', 'DictComp', 'GeneratorExp', 'NamedExpr')
+    if hasattr(ast, name))
+
+
+def is_pure(value: str) -> bool:
+    """ Returns True if a string starting with '$eval:' only calls variables
+    without argument, the builtins of STATIC_NAMES, numpy ufuncs and
+    PURE_NUMPY_FUNCTIONS, so that its value only depends on the names it uses.
+    Methods, other functions (np.datetime64('now'), ...), comprehensions and
+    lambdas give False """
+    try:
+        tree = ast.parse(value[len(EVAL): ].lstrip(' \t'), mode='eval')
+    except SyntaxError:
+        return False
+
+    for node in ast.walk(tree):
+        if isinstance(node, _SCOPE_NODES): return False
+        if not isinstance(node, ast.Call): continue
+
+        func = node.func
+        if isinstance(func, ast.Name):
+            if func.id in STATIC_NAMES: continue
+            # Variable read
+            if not node.args and not node.keywords: continue
+            return False
+        if (isinstance(func, ast.Attribute)
+                and isinstance(func.value, ast.Name) and func.value.id == 'np'
+                and (func.attr in PURE_NUMPY_FUNCTIONS
+                     or isinstance(getattr(np, func.attr, None), np.ufunc))):
+            continue
+        return False
+
+    return True
+
+
+def get_dependencies(value: str) -> frozenset:
+    """ Returns the names used by a string starting with '$eval:' (variables,
+    devices or STATIC_NAMES), or None if its value can change at each
+    evaluation (VOLATILE_ATTRIBUTES) or if it can't be parsed """
+    try:
+        tree = ast.parse(value[len(EVAL): ].lstrip(' \t'), mode='eval')
+    except SyntaxError:
+        return None
+
+    loaded = set()
+    bound = set()  # names defined in comprehensions and lambdas
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load): loaded.add(node.id)
+            else: bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.Attribute):
+            if node.attr in VOLATILE_ATTRIBUTES or node.attr.startswith('read_'):
+                return None
+
+    return frozenset(loaded - bound)
+
+
 def has_eval(value: Any) -> bool:
     """ Checks if value is a string starting with '$eval:'"""
     return True if isinstance(value, str) and value.startswith(EVAL) else False
@@ -191,10 +330,120 @@ def is_Variable(value: Any):
     return isinstance(value, Variable)
 
 
+@lru_cache(maxsize=EVAL_CACHE_SIZE)
+def compile_eval(value: str) -> CodeType:
+    """ Returns the compiled code of a string starting with '$eval:'.
+    The last EVAL_CACHE_SIZE compiled expressions are kept in cache """
+    # eval strips leading spaces and tabs of a string but compile doesn't
+    return compile(value[len(EVAL): ].lstrip(' \t'), '<eval>', 'eval')
+
+
+def precompile_eval(value: Any):
+    """ Compiles value in advance if it is a string starting with '$eval:'.
+    Syntax errors are raised on evaluation """
+    if has_eval(value):
+        try: compile_eval(value)
+        except SyntaxError: pass
+
+
+def eval_expression(value: str) -> Any:
+    """ Evaluates a string starting with '$eval:' with the devices, variables,
+    numpy (np) and pandas (pd) """
+    return eval(compile_eval(value), {}, allowed_dict)
+
+
+# Operators applied element by element on arrays
+ELEMENTWISE_OPERATORS = (
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+def is_elementwise(value: str, names: set) -> bool:
+    """ Returns True if a string starting with '$eval:' gives the same value
+    evaluated on arrays as point by point: only numbers, calls without argument
+    of names (ex: parameter x()), arithmetic operators, single comparisons and
+    numpy ufuncs (np.sin, np.exp, ...). Reductions, sorting, slicing,
+    attributes of the arrays and other functions give False """
+    try:
+        tree = ast.parse(value[len(EVAL): ].lstrip(' \t'), mode='eval')
+    except SyntaxError:
+        return False
+
+    def check(node: ast.AST) -> bool:
+        if isinstance(node, ast.Expression):
+            return check(node.body)
+        if isinstance(node, ast.Constant):
+            return isinstance(node.value, (int, float, bool))
+        if sys.version_info < (3, 8):  # numbers are not Constant before python 3.8
+            if isinstance(node, ast.Num): return isinstance(node.n, (int, float))
+            if isinstance(node, ast.NameConstant): return isinstance(node.value, bool)
+        if isinstance(node, ast.BinOp):
+            return (isinstance(node.op, ELEMENTWISE_OPERATORS)
+                    and check(node.left) and check(node.right))
+        if isinstance(node, ast.UnaryOp):
+            return isinstance(node.op, ELEMENTWISE_OPERATORS) and check(node.operand)
+        if isinstance(node, ast.Compare):
+            return (len(node.ops) == 1
+                    and isinstance(node.ops[0], ELEMENTWISE_OPERATORS)
+                    and check(node.left) and check(node.comparators[0]))
+        if isinstance(node, ast.Call):
+            if node.keywords: return False
+            func = node.func
+            if isinstance(func, ast.Name):
+                return func.id in names and not node.args
+            if (isinstance(func, ast.Attribute)
+                    and isinstance(func.value, ast.Name) and func.value.id == 'np'
+                    and isinstance(getattr(np, func.attr, None), np.ufunc)):
+                return all(check(arg) for arg in node.args)
+        return False
+
+    return check(tree)
+
+
+def eval_vectorized(value: str, arrays: Dict[str, np.ndarray]) -> Union[np.ndarray, None]:
+    """ Evaluates a string starting with '$eval:' at once for several points,
+    the variables in arrays being replaced by their array of values (ex: the
+    parameters of a scan over all its points). Returns the array of the values
+    at each point, or None if the expression uses other names (devices or other
+    variables) or is not element by element (see :meth:`is_elementwise`), as
+    np.mean(x()) would give a different value. Numpy floating point errors
+    (division by zero, overflow, ...) also return None, as well as integer
+    results that can't be exact in float64. """
+    dependencies = get_dependencies(value)
+    if dependencies is None or not dependencies & set(arrays): return None
+    if not is_elementwise(value, set(arrays)): return None
+    for name in dependencies:
+        if name in arrays: continue
+        if name in VARIABLES or name in DEVICES or name not in STATIC_NAMES:
+            return None
+
+    # Integers are computed as floats, an overflow raising FloatingPointError
+    # instead of wrapping around silently as int64
+    has_int = any(arrays[name].dtype.kind in 'biu'
+                  for name in dependencies if name in arrays)
+    size = len(next(iter(arrays.values())))
+    namespace = {"np": np, "pd": pd}
+    arrays = {name: array.astype(float) if array.dtype.kind in 'biu' else array
+              for name, array in arrays.items()}
+    namespace.update({name: (lambda array=array: array)
+                      for name, array in arrays.items()})
+    try:
+        with np.errstate(all='raise'):
+            result = np.asarray(eval(compile_eval(value), {}, namespace))
+    except Exception:
+        return None
+
+    if result.shape != (size, ) or result.dtype.kind not in 'biuf': return None
+    # Integers above 2**53 are not exact as floats, python ints are needed
+    if has_int and result.dtype.kind == 'f' and np.any(np.abs(result) > 2**53):
+        return None
+    return result
+
+
 def eval_variable(value: Any) -> Any:
     """ Evaluate the given python string. String can contain variables,
     devices, numpy arrays and pandas dataframes."""
-    if has_eval(value): value = Variable('temp', value)
+    if has_eval(value): return eval_expression(value)
 
     if is_Variable(value): return value()
     return value
@@ -202,7 +451,11 @@ def eval_variable(value: Any) -> Any:
 
 def eval_safely(value: Any) -> Any:
     """ Same as eval_variable but do not evaluate if contains devices or variables """
-    if has_eval(value): value = Variable('temp', value)
+    if has_eval(value):
+        # Same rule as Variable.write_function
+        if has_variable(value) and '(' in value: return 'Need update'
+        try: return eval_expression(value)
+        except Exception as e: return str(e)
 
     if is_Variable(value): return value.value
     return value
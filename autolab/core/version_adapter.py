@@ -4,14 +4,47 @@ import os
 import shutil
 
 from .paths import PATHS, DRIVER_LEGACY, DRIVER_SOURCES
-from .repository import install_drivers
 
 
 def process_all_changes():
-    ''' Apply all changes '''
+    ''' Apply all changes, once per autolab version.
+    The last processed version is stored in PATHS['version_adapter'] '''
+    version = get_current_version()
+    if get_processed_version() == version: return None
+
     rename_old_devices_config_file()
     move_driver()
 
+    set_processed_version(version)
+
+
+def get_current_version() -> str:
+    ''' Returns the version of the installed autolab '''
+    with open(PATHS['version']) as version_file:
+        return version_file.read().strip()
+
+
+def get_processed_version() -> str:
+    ''' Returns the last autolab version for which the changes have been
+    applied, or None if unknown '''
+    try:
+        with open(PATHS['version_adapter']) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def set_processed_version(version: str):
+    ''' Records that the changes have been applied for this autolab version.
+    Nothing is recorded if the user folder doesn't exist yet, to apply the
+    changes again once created '''
+    if not os.path.isdir(PATHS['user_folder']): return None
+    try:
+        with open(PATHS['version_adapter'], 'w') as file:
+            file.write(version)
+    except OSError as e:
+        print(f"Warning, can't write {PATHS['version_adapter']}: {e}")
+
 
 def rename_old_devices_config_file():
     ''' Rename local_config.ini into devices_config.ini'''
@@ -33,6 +66,7 @@ def move_driver():
             os.rename(os.path.join(PATHS['drivers'], os.path.basename(DRIVER_LEGACY['official'])),
                       DRIVER_SOURCES['official'])
             print(f"Old official drivers directory has been moved from: {DRIVER_LEGACY['official']} to: {DRIVER_SOURCES['official']}")
+            from .repository import install_drivers
             install_drivers()  # Ask if want to download official drivers
 
         if os.path.exists(DRIVER_LEGACY["local"]):
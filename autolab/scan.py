@@ -6,11 +6,12 @@ Created on Fri Nov 22 21:03:46 2019
 """
 from threading import Thread, Event
 from autolab.core import elements
+from autolab.core.executor import set_priority, SCAN
 import collections
-import itertools
 import os
 import time
 import h5py
+import numpy as np
 
 class Scanner :
     
@@ -233,8 +234,17 @@ class ScanThread(Thread):
         self.scanner = scanner
         Thread.__init__(self)
         
-        # Itertools product on parameters
-        self.param_sets = list(dict(zip(self.scanner._parameters.keys(),x)) for x in itertools.product(*[a.values for a in self.scanner._parameters.values()]) )
+        # Parameter values, the i-th set is computed from i (see get_param_set)
+        self.param_names = list(self.scanner._parameters.keys())
+        self.param_values = [a.values if hasattr(a.values,'__getitem__') else list(a.values)
+                             for a in self.scanner._parameters.values()]
+        self.nb_points = 1
+        for values in self.param_values :
+            self.nb_points *= len(values)
+        
+        # Datafile written every flush_interval seconds
+        self.flush_interval = 1.
+        self.last_flush = time.monotonic()
             
         # Pause and stop events
         self.stop_event = Event()
@@ -261,16 +271,20 @@ class ScanThread(Thread):
             suffix = f'_{count}'
         self.datapath = os.path.join(self.scanner._datapath,self.scanner._name+suffix+'.hdf5')
 
-        # Prepare structure
-        def configure(file,obj,data_length):
+        # Prepare structure: length of the datasets, created with the shape 
+        # of the first value saved (scalar or array)
+        self.data_lengths = {}
+        def configure(obj,data_length):
             for key in obj.keys(): 
                 if isinstance(obj[key],(Parameter,Measure)) :
-                    file.create_dataset(key, (data_length,))     
-        with h5py.File(self.datapath, "a") as file :
-            configure(file,self.scanner._initrecipe,1)
-            configure(file,self.scanner._parameters,len(self.param_sets))
-            configure(file,self.scanner._recipe,len(self.param_sets))
-            configure(file,self.scanner._endrecipe,1)
+                    self.data_lengths[key] = data_length
+        configure(self.scanner._initrecipe,1)
+        configure(self.scanner._parameters,self.nb_points)
+        configure(self.scanner._recipe,self.nb_points)
+        configure(self.scanner._endrecipe,1)
+        
+        # The file stays open during the scan
+        self.file = h5py.File(self.datapath, "w")
 
 
 
@@ -278,19 +292,25 @@ class ScanThread(Thread):
         
         ''' Start the execution of the scan '''
         
-        # Init recipe
-        self.reset_data()
-        self.execute_recipe(self.scanner._initrecipe)
-        
-        # Main recipe of each set of parameter
-        self.reset_data()
-        for i in range(len(self.param_sets)) :
-            self.set_parameters(i)
-            self.execute_recipe(self.scanner._recipe,i)
+        set_priority(SCAN)
+        
+        try :
+            # Init recipe
+            self.reset_data()
+            self.execute_recipe(self.scanner._initrecipe)
             
-        # End recipe
-        self.reset_data()
-        self.execute_recipe(self.scanner._endrecipe)
+            # Main recipe of each set of parameter
+            self.reset_data()
+            for i in range(self.nb_points) :
+                if self.stop_event.is_set() : break
+                self.set_parameters(i)
+                self.execute_recipe(self.scanner._recipe,i)
+                
+            # End recipe
+            self.reset_data()
+            self.execute_recipe(self.scanner._endrecipe)
+        finally :
+            self.file.close()
         
         
         
@@ -319,8 +339,7 @@ class ScanThread(Thread):
                 if self.scanner.verbose : print(key, step.info(), ans)
                 
                 # If scan is paused, wait for resume
-                while self.pause_event.is_set() :
-                    time.sleep(0.1)
+                self.wait_resume()
               
             # If the scan has been stopped
             else :
@@ -332,11 +351,25 @@ class ScanThread(Thread):
         
         
         
+    def get_param_set(self,i):
+        
+        """ Returns the i-th set of parameters, in the order of 
+        itertools.product (last parameter varying the fastest) """
+        
+        indexes = []
+        for values in reversed(self.param_values) :
+            i, index = divmod(i, len(values))
+            indexes.insert(0,index)
+        return collections.OrderedDict((key,values[index]) for key,values,index 
+                                       in zip(self.param_names,self.param_values,indexes))
+        
+        
+        
     def set_parameters(self,i):
         
         """ Apply the i-th set of parameters """
         
-        param_set = self.param_sets[i]
+        param_set = self.get_param_set(i)
         
         for key in param_set.keys() :
             
@@ -351,8 +384,7 @@ class ScanThread(Thread):
                     if self.scanner.verbose : print(key, parameter.info(), value)
                     
                 # If scan is paused, wait for resume
-                while self.pause_event.is_set() :
-                    time.sleep(0.1)
+                self.wait_resume()
         
             # If the scan has been stopped
             else :
@@ -369,10 +401,63 @@ class ScanThread(Thread):
         """ Save in the whole content of the current self.data dictionnary 
         in the hdf5 datafile """
         
-        with h5py.File(self.datapath, "a") as file :
-            for key in self.data.keys():
-                file[key][i] = self.data[key]
+        for key in self.data.keys():
+            value = np.asarray(self.data[key])
+            if key not in self.file :
+                self.create_dataset(key,value)
+            dataset = self.file[key]
+            assert value.shape == dataset.shape[1:], f"Data {key} has shape {value.shape} instead of {dataset.shape[1:]}."
+            if dataset.dtype.kind == 'O' : value = str(value)
+            dataset[i] = value
         if self.scanner.verbose : print('Saving data')
+        
+        # Write the data on disk periodically
+        if time.monotonic() - self.last_flush >= self.flush_interval :
+            self.flush()
+            
+            
+            
+    def create_dataset(self,key,value):
+        
+        """ Create the dataset of key in the hdf5 datafile, with one chunk 
+        per point for arrays. Numerical data are stored as float64 (or 
+        complex128), so that an int first value doesn't truncate the next ones """
+        
+        shape = (self.data_lengths.get(key,1),) + value.shape
+        if value.dtype.kind in 'biuf' :
+            # float64 whatever the first value, to not truncate the next ones
+            dtype = np.dtype(float)
+            fillvalue = np.nan
+        elif value.dtype.kind == 'c' :
+            dtype = np.dtype(complex)
+            fillvalue = np.nan
+        else :
+            dtype = h5py.string_dtype()
+            fillvalue = None
+        if value.shape == () : chunks = True
+        else : chunks = (1,) + value.shape
+        self.file.create_dataset(key, shape, dtype=dtype, chunks=chunks,
+                                 fillvalue=fillvalue)
+        
+        
+        
+    def flush(self):
+        
+        """ Write the buffered data in the hdf5 datafile """
+        
+        self.file.flush()
+        self.last_flush = time.monotonic()
+        
+        
+        
+    def wait_resume(self):
+        
+        """ Wait while the scan is paused, the data being written on disk """
+        
+        if self.pause_event.is_set() :
+            self.flush()
+        while self.pause_event.is_set() :
+            time.sleep(0.1)
             
         
         
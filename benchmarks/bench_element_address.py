@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the address resolution of Device elements.
+
+Resolves 100k addresses on a synthetic driver containing 1000 elements
+(10 modules, 90 submodules and 900 variables) using the device index
+(get_element_by_address) and the attribute walk through Module.__getattr__.
+
+Usage: python benchmarks/bench_element_address.py
+"""
+import time
+import random
+
+import autolab
+from autolab.core.paths import DRIVERS_PATHS
+from autolab.core.devices import DEVICES, Device, get_element_by_address
+
+
+NB_MODULES = 10
+NB_SUBMODULES = 9
+NB_VARIABLES = 10
+NB_ADDRESSES = 100_000
+
+
+class Submodule:
+
+    def __init__(self):
+        self.value = 0.
+
+    def get_value(self) -> float:
+        return self.value
+
+    def set_value(self, value: float):
+        self.value = value
+
+    def get_driver_model(self):
+        return [{'element': 'variable', 'name': f'var{i}', 'type': float,
+                 'read': self.get_value, 'write': self.set_value}
+                for i in range(NB_VARIABLES)]
+
+
+class Channel:
+
+    def get_driver_model(self):
+        return [{'element': 'module', 'name': f'sub{i}', 'object': Submodule()}
+                for i in range(NB_SUBMODULES)]
+
+
+class Driver:
+
+    def get_driver_model(self):
+        return [{'element': 'module', 'name': f'channel{i}', 'object': Channel()}
+                for i in range(NB_MODULES)]
+
+    def close(self):
+        pass
+
+
+def walk(address: str):
+    """ Address resolution without index, as done before the device index """
+    address_list = address.split('.')
+    element = DEVICES[address_list[0]]
+    for address_part in address_list[1:]:
+        element = getattr(element, address_part)
+    return element
+
+
+def main():
+    DRIVERS_PATHS['bench_driver'] = {'path': __file__, 'source': 'benchmark'}
+    device = Device('bench', Driver(), {'driver': 'bench_driver',
+                                        'connection': 'DEFAULT'})
+    DEVICES['bench'] = device
+
+    try:
+        addresses = [element.address() for element in device.get_elements()]
+        print(f'{len(addresses)} elements in the synthetic driver')
+
+        random.seed(0)
+        queries = [random.choice(addresses) for _ in range(NB_ADDRESSES)]
+
+        for name, func in (('index', get_element_by_address), ('walk', walk)):
+            t0 = time.perf_counter()
+            for address in queries:
+                func(address)
+            dt = time.perf_counter() - t0
+            print(f'{name:>5}: {NB_ADDRESSES} addresses resolved in {dt:.3f} s '
+                  f'({dt/NB_ADDRESSES*1e6:.2f} us/address)')
+    finally:
+        autolab.close('bench')
+        DRIVERS_PATHS.pop('bench_driver', None)
+
+
+if __name__ == '__main__':
+    main()
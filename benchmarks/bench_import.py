@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the startup time of autolab.
+
+Measures the wall-clock time of each scenario in fresh interpreters, so that
+the deferred work (initialization of the user folder, drivers scan) is counted
+along with the imports:
+ - 'import autolab' alone (lazy package, nothing initialized),
+ - 'import autolab' followed by the first use of the package (initialization
+   of the user folder and import of the devices API),
+ - direct import of a submodule (initialized at its import),
+ - 'import autolab' followed by the import of the GUI functions.
+
+Usage: python benchmarks/bench_import.py [--repeat N] [--save results.csv]
+With --save, the median times are appended to the csv file along with the
+autolab version, to follow the startup time over the releases.
+"""
+import os
+import sys
+import csv
+import argparse
+import statistics
+import subprocess
+
+
+SCENARIOS = {
+    'import': 'import autolab',
+    'first_use': 'import autolab; autolab.get_device',
+    'submodule': 'import autolab.core.devices',
+    'gui': 'import autolab; autolab.gui',
+}
+
+
+def get_startup_time(code: str) -> float:
+    """ Returns the time in seconds taken by code executed in a new interpreter,
+    imports and initialization included (interpreter startup excluded) """
+    timed_code = ('import time; _start = time.perf_counter()\n'
+                  f'{code}\n'
+                  'print(time.perf_counter() - _start)')
+    result = subprocess.run([sys.executable, '-c', timed_code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    # Last line, the code may print messages on first initialization
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def get_version() -> str:
+    """ Returns the version of autolab without importing it """
+    version_path = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'autolab', 'version.txt')
+    with open(version_path) as f:
+        return f.read().strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of autolab')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', type=str, default=None,
+                        help='csv file to append the results to')
+    args = parser.parse_args()
+
+    results = {}
+    for name, code in SCENARIOS.items():
+        times = [get_startup_time(code) for _ in range(args.repeat)]
+        results[name] = statistics.median(times)
+        print(f'{name:>10}: {results[name]*1e3:8.1f} ms (median of {args.repeat})')
+
+    if args.save is not None:
+        new_file = not os.path.exists(args.save)
+        with open(args.save, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file: writer.writerow(['version', 'python'] + list(results))
+            writer.writerow([get_version(), sys.version.split()[0]]
+                            + [f'{value:.4f}' for value in results.values()])
+
+
+if __name__ == '__main__':
+    main()